@@ -0,0 +1,3 @@
+from .probe import CapabilityProbe
+
+__all__ = ['CapabilityProbe']
@@ -0,0 +1,178 @@
+import asyncio
+import json
+import logging
+import os
+import re
+import shutil
+import time
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+from app.transcoder.task import REQUIRED_FILTERS, VIDEO_CODEC_ARGS
+
+logger = logging.getLogger(__name__)
+
+# Output formats tasks ask for, and the muxer each needs
+FORMAT_MUXERS = {'mp4': 'mp4', 'webm': 'webm', 'mkv': 'matroska', 'hls': 'hls', 'dash': 'dash'}
+
+ENCODER_LINE = re.compile(r'^ ([VA])[A-Z.]{5} (\S+)')
+FILTER_LINE = re.compile(r'^ [T.][S.][C.] (\S+)\s+\S+->\S+')
+MUXER_LINE = re.compile(r'^ [D ]E[d ]? (\S+)')
+
+class CapabilityProbe:
+    """What the local ffmpeg build can encode, and how fast.
+
+    Encoders, filters and muxers come from ``ffmpeg -encoders``, ``-filters``
+    and ``-muxers``. With ``calibrate`` a short synthetic encode per codec
+    measures its speed on this host. The result is cached in ``state_dir``
+    under the ffmpeg binary's path, size and mtime, so it is only measured
+    again when ffmpeg changes.
+    """
+
+    CACHE_FILE = "capabilities.json"
+
+    def __init__(
+        self,
+        state_dir: Path,
+        ffmpeg: str = 'ffmpeg',
+        calibrate: bool = True,
+        calibration_seconds: float = 1.0,
+        calibration_size: str = '1280x720',
+        command_timeout: float = 60.0
+    ):
+        self.cache_path = Path(state_dir) / self.CACHE_FILE
+        self.ffmpeg = ffmpeg
+        self.calibrate = calibrate
+        self.calibration_seconds = calibration_seconds
+        self.calibration_size = calibration_size
+        self.command_timeout = command_timeout
+
+    async def discover(self) -> Dict:
+        """Capabilities for the connect message, from the cache if ffmpeg is unchanged"""
+        binary = self._binary_key()
+        if binary is None:
+            logger.error(f"{self.ffmpeg} not found, advertising no codecs")
+            return {"codecs": [], "formats": [], "encoders": [], "filters": []}
+
+        cached = self._load_cache(binary)
+        if cached is not None:
+            logger.info(f"Using cached capabilities of {binary['path']}")
+            return cached
+
+        capabilities = await self.probe()
+        if self.calibrate:
+            capabilities["calibration"] = await self.calibrate_codecs(capabilities["codecs"])
+            # An encoder that can't run the calibration encode can't run tasks either
+            capabilities["codecs"] = [codec for codec in capabilities["codecs"] if codec in capabilities["calibration"]]
+        self._save_cache(binary, capabilities)
+        logger.info(
+            f"ffmpeg {capabilities.get('ffmpeg_version')}: codecs {', '.join(capabilities['codecs']) or 'none'}"
+            + (f", calibration {capabilities['calibration']}" if capabilities.get("calibration") else "")
+        )
+        return capabilities
+
+    def _binary_key(self) -> Optional[Dict]:
+        path = shutil.which(self.ffmpeg)
+        if not path:
+            return None
+        path = os.path.realpath(path)
+        stat = os.stat(path)
+        return {"path": path, "size": stat.st_size, "mtime": stat.st_mtime}
+
+    def _load_cache(self, binary: Dict) -> Optional[Dict]:
+        try:
+            with open(self.cache_path) as f:
+                cached = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if cached.get("binary") != binary:
+            return None
+        capabilities = cached.get("capabilities") or {}
+        if self.calibrate and "calibration" not in capabilities:
+            return None
+        return capabilities
+
+    def _save_cache(self, binary: Dict, capabilities: Dict):
+        try:
+            self.cache_path.parent.mkdir(parents=True, exist_ok=True)
+            tmp_path = self.cache_path.with_suffix('.tmp')
+            with open(tmp_path, 'w') as f:
+                json.dump({"binary": binary, "capabilities": capabilities}, f)
+            os.replace(tmp_path, self.cache_path)
+        except OSError as e:
+            logger.warning(f"Could not cache capabilities: {e}")
+
+    async def _run(self, *args: str) -> Tuple[int, str]:
+        """Exit code and stdout of ffmpeg with args"""
+        process = await asyncio.create_subprocess_exec(
+            self.ffmpeg, '-hide_banner', *args,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.DEVNULL
+        )
+        try:
+            stdout, _ = await asyncio.wait_for(process.communicate(), self.command_timeout)
+        except asyncio.TimeoutError:
+            process.kill()
+            await process.wait()
+            raise
+        return process.returncode, stdout.decode('utf-8', errors='ignore')
+
+    async def probe(self) -> Dict:
+        _, version_output = await self._run('-version')
+        version = re.match(r'ffmpeg version (\S+)', version_output)
+
+        encoders = []
+        for line in (await self._run('-encoders'))[1].splitlines():
+            match = ENCODER_LINE.match(line)
+            if match:
+                encoders.append(match.group(2))
+        filters = set()
+        for line in (await self._run('-filters'))[1].splitlines():
+            match = FILTER_LINE.match(line)
+            if match:
+                filters.add(match.group(1))
+        muxers = set()
+        for line in (await self._run('-muxers'))[1].splitlines():
+            match = MUXER_LINE.match(line)
+            if match:
+                muxers.update(match.group(1).split(','))
+
+        available = set(encoders)
+        return {
+            "ffmpeg_version": version.group(1) if version else None,
+            "codecs": [codec for codec, args in VIDEO_CODEC_ARGS.items() if args[1] in available],
+            "formats": [name for name, muxer in FORMAT_MUXERS.items() if muxer in muxers],
+            "encoders": sorted(available),
+            "filters": [name for name in REQUIRED_FILTERS if name in filters],
+            "missing_filters": [name for name in REQUIRED_FILTERS if name not in filters]
+        }
+
+    async def calibrate_codecs(self, codecs: List[str]) -> Dict[str, Dict]:
+        """Speed of a synthetic encode per codec, in seconds of video per second,
+        with the options real tasks use; relative is the speed over h264's.
+        Codecs whose encode fails or times out are left out."""
+        results = {}
+        for codec in codecs:
+            cmd = [
+                '-v', 'error',
+                '-f', 'lavfi', '-i', f"testsrc2=size={self.calibration_size}:rate=30",
+                '-t', str(self.calibration_seconds),
+                *VIDEO_CODEC_ARGS[codec],
+                '-f', 'null', '-'
+            ]
+            started = time.monotonic()
+            try:
+                returncode, _ = await self._run(*cmd)
+            except asyncio.TimeoutError:
+                logger.warning(f"Calibration of {codec} timed out")
+                continue
+            if returncode != 0:
+                logger.warning(f"Calibration of {codec} failed (exit code {returncode}), not advertising it")
+                continue
+            elapsed = time.monotonic() - started
+            results[codec] = {"speed": round(self.calibration_seconds / max(elapsed, 1e-3), 3)}
+        baseline = (results.get('h264') or {}).get('speed')
+        for result in results.values():
+            if baseline:
+                result["relative"] = round(result["speed"] / baseline, 3)
+        return results
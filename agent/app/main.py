@@ -9,9 +9,13 @@ from pathlib import Path
 # Add the parent directory to Python path to allow imports
 sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
-from app.websocket_client import WebSocketClient
-from app.transcoder import TranscodeTask
+from app.websocket_client import WebSocketClient, Outbox
+from app.transcoder import ComplexityAnalyzer, KeyframeIndexCache, TranscodeTask, failure_info
 from app.checkpoint import CheckpointManager
+from app.monitor import HostLoadMonitor
+from app.staging import StagingArea
+from app.capabilities import CapabilityProbe
+from app.resources import ResourceManager, parse_cpu_list
 
 # Configure logging
 logging.basicConfig(
@@ -26,24 +30,84 @@ class TranscoderAgent:
         self.orchestrator_url = os.getenv("ORCHESTRATOR_URL", "ws://localhost:8000/ws/agent")
         self.state_dir = Path(os.getenv("STATE_DIR", "/tmp/agent-state"))
         self.storage_map = json.loads(os.getenv("STORAGE_MAP", '{"shared": "/storage"}'))
+        self.batch_interval = float(os.getenv("MESSAGE_BATCH_INTERVAL", "1.0"))
+        self.scratch_dir = Path(os.getenv("SCRATCH_DIR", "/tmp/agent-scratch"))
+        self.heartbeat_interval = float(os.getenv("HEARTBEAT_INTERVAL", "30"))
 
         self.state_dir.mkdir(parents=True, exist_ok=True)
+        self.scratch_dir.mkdir(parents=True, exist_ok=True)
+
+        self.load_monitor = HostLoadMonitor(self.scratch_dir)
+        self.staging = StagingArea(
+            self.scratch_dir,
+            cache_bytes=int(os.getenv("INPUT_CACHE_SIZE_MB", "10240")) * 1024 * 1024,
+            enabled=os.getenv("STAGING_ENABLED", "true").lower() in ("1", "true", "yes")
+        )
 
         self.ws_client = WebSocketClient(
             url=self.orchestrator_url,
             agent_id=self.agent_id,
-            on_task_received=self.handle_task_assignment
+            on_task_received=self.handle_task_assignment,
+            batch_interval=self.batch_interval,
+            heartbeat_payload=self._heartbeat_payload,
+            heartbeat_interval=self.heartbeat_interval,
+            on_cancel=self.handle_cancel,
+            # Encodes outlive the connection: results wait in the outbox and
+            # the running task is announced again on reconnect
+            outbox=Outbox(self.state_dir / "outbox.json"),
+            running_tasks=lambda: [self.current_task_id] if self.current_task_id else []
+        )
+
+        # The agent runs one encode at a time, in the single slot spanning
+        # AGENT_CPUS; agents sharing a host are given disjoint CPU lists
+        agent_cpus = os.getenv("AGENT_CPUS")
+        cgroup_root = os.getenv("CGROUP_ROOT")
+        self.resources = ResourceManager(
+            cpus=parse_cpu_list(agent_cpus) if agent_cpus else None,
+            pinning=os.getenv("CPU_PINNING", "true").lower() in ("1", "true", "yes"),
+            priority_nice=json.loads(os.getenv("PRIORITY_NICE", '{"HIGH": 0, "MEDIUM": 5, "LOW": 10}')),
+            ionice=os.getenv("IONICE_ENABLED", "true").lower() in ("1", "true", "yes"),
+            cgroup_root=Path(cgroup_root) if cgroup_root else None,
+            cpu_limit=float(os.getenv("CGROUP_CPU_LIMIT", "0")),
+            memory_limit_mb=int(os.getenv("CGROUP_MEMORY_LIMIT_MB", "0"))
+        )
+        self.current_slot = None
+
+        self.capability_probe = CapabilityProbe(
+            self.state_dir,
+            calibrate=os.getenv("CAPABILITY_CALIBRATION", "true").lower() in ("1", "true", "yes"),
+            calibration_seconds=float(os.getenv("CALIBRATION_SECONDS", "1"))
+        )
+
+        # Keyframes of trimmed sources, to cut them without re-encoding
+        self.keyframes = KeyframeIndexCache(self.state_dir / 'keyframes')
+        # CRFs picked by per-title analysis, for outputs asking for "crf": "auto"
+        self.complexity = ComplexityAnalyzer(
+            self.state_dir / 'complexity',
+            samples=int(os.getenv("COMPLEXITY_SAMPLES", "3")),
+            sample_seconds=float(os.getenv("COMPLEXITY_SAMPLE_SECONDS", "2"))
         )
 
         self.checkpoint_manager = CheckpointManager(self.state_dir)
         self.current_task = None
+        self.current_staging = None
+        # Task being handled, from assignment (before staging) until it is finished
+        self.current_task_id = None
+        self.cancel_requested = None
+        self.cancel_reason = None
         self.shutdown_requested = False
 
     async def start(self):
         """Start the agent and handle reconnection"""
         logger.info(f"Agent {self.agent_id} starting...")
 
-        # Check for any crashed tasks
+        # Advertise what the local ffmpeg can actually do
+        try:
+            self.ws_client.capabilities = await self.capability_probe.discover()
+        except Exception as e:
+            logger.error(f"Capability discovery failed, advertising defaults: {e}")
+
+        # Check for any crashed tasks; reported once connected
         crashed_task = self.checkpoint_manager.get_crashed_task()
         if crashed_task:
             logger.info(f"Found crashed task: {crashed_task['task_id']}")
@@ -54,34 +118,161 @@ class TranscoderAgent:
 
     async def handle_task_assignment(self, task_data: dict):
         """Handle a new task assignment from orchestrator"""
+        task_id = task_data['id']
+        self.current_task_id = task_id
+        self.cancel_requested = None
+        self.cancel_reason = None
+        # A duplicate of a straggler running elsewhere: its outputs stay in
+        # scratch until it has finished, so it can't clobber the other attempt
+        speculative = bool(task_data.get('speculative'))
         try:
-            logger.info(f"Received task: {task_data['id']}")
+            logger.info(f"Received task: {task_id}" + (" (speculative copy)" if speculative else ""))
 
             # Map storage paths
             input_files = self._map_storage_paths(task_data['input_files'])
+            input_ranges = [(file.get('start'), file.get('end')) for file in task_data['input_files']]
+            trimmed = [index for index, (start, end) in enumerate(input_ranges) if start or end is not None]
             output_settings = self._map_storage_path(task_data['output_settings'])
+            resume = self._resume_state(task_data, output_settings)
 
             # Create checkpoint
-            self.checkpoint_manager.create_checkpoint(task_data['id'])
+            self.checkpoint_manager.create_checkpoint(task_id)
+
+            # Copy inputs to local scratch and point outputs at it
+            self.current_staging = await self.staging.stage(
+                task_id, input_files, output_settings, private_outputs=speculative, in_place=trimmed
+            )
+            if self.cancel_requested == task_id:
+                await self._finish_cancelled(task_id, resume['parts'] if resume and self.cancel_reason != "superseded" else [])
+                return
 
             # Create and start transcoding task
+            self.current_slot = self.resources.acquire(task_id, task_data.get('priority'))
+            logger.info(f"Task {task_id} runs with {self.current_slot.describe()}")
             self.current_task = TranscodeTask(
                 task_id=task_data['id'],
-                input_files=input_files,
-                output_settings=output_settings,
+                input_files=self.current_staging.input_files,
+                output_settings=self.current_staging.output_settings,
                 progress_callback=self._on_progress,
                 completion_callback=self._on_completion,
-                error_callback=self._on_error
+                error_callback=self._on_error,
+                segment_callback=self._on_segments,
+                resume=resume,
+                timeout=task_data.get('timeout_seconds'),
+                stall_timeout=task_data.get('stall_timeout_seconds'),
+                input_ranges=input_ranges,
+                keyframes=self.keyframes,
+                slot=self.current_slot,
+                complexity=self.complexity
             )
+            if self.current_task.offset:
+                logger.info(f"Resuming task {task_id} at {self.current_task.offset:.1f}s")
 
             # Run transcoding
-            await self.current_task.run()
+            task = self.current_task
+            self.current_staging.encode_started()
+            await task.run()
+            if self.cancel_requested == task_id and self.current_task_id == task_id:
+                if self.cancel_reason == "superseded":
+                    # The other attempt already published the outputs
+                    await self._finish_cancelled(task_id, [])
+                else:
+                    task.cleanup_outputs()
+                    await self._finish_cancelled(task_id, task.resume_parts)
 
         except Exception as e:
             logger.error(f"Error handling task: {e}")
-            await self.ws_client.send_failed(task_data['id'], str(e))
+            await self.ws_client.send_failed(task_id, str(e), failure_info(e))
             self.checkpoint_manager.clear_checkpoint()
-            self.current_task = None
+            self._finish_task()
+
+    async def handle_cancel(self, task_id: str, reason: str = None):
+        """Stop a running task; a preempted one keeps what it encoded so far"""
+        if task_id != self.current_task_id:
+            logger.info(f"Ignoring cancellation of task {task_id}, it is not running here")
+            if reason == "superseded":
+                # The orchestrator keeps this agent busy until the task is reported stopped
+                await self.ws_client.send_cancelled(task_id)
+            return
+        task = self.current_task
+
+        if reason != "preempt":
+            # Finished by handle_task_assignment once staging or ffmpeg has stopped
+            logger.info(f"Cancelling task {task_id} ({reason or 'cancel'})")
+            self.cancel_requested = task_id
+            self.cancel_reason = reason
+            if task:
+                # A superseded attempt's output is worthless, don't let ffmpeg finalize it
+                await task.cancel(grace=0 if reason == "superseded" else 10.0)
+            return
+
+        if not task or not task.process or task.process.returncode is not None:
+            # Not started yet or already finishing; its final state is reported anyway
+            logger.info(f"Ignoring preemption of task {task_id}, ffmpeg is not running")
+            return
+
+        staging = self.current_staging
+        resume = None
+        offset = await task.preempt()
+        if offset is not None:
+            # Parts live next to the final output so any agent can resume the task
+            final_path = self._final_output_path()
+            part_name = os.path.basename(TranscodeTask.part_path(final_path, len(task.resume_parts)))
+            try:
+                await staging.publish_file(task.encode_path, os.path.join(os.path.dirname(final_path), part_name))
+                resume = {
+                    "offset": round(offset, 3),
+                    "parts": [os.path.basename(part) for part in task.resume_parts] + [part_name]
+                }
+            except Exception as e:
+                logger.warning(f"Could not save the preempted part of task {task_id}, it will start over: {e}")
+        logger.info(f"Task {task_id} preempted" + (f" at {offset:.1f}s" if resume else ""))
+        await self.ws_client.send_preempted(task_id, resume)
+        self.checkpoint_manager.clear_checkpoint()
+        self._finish_task()
+
+    def _resume_state(self, task_data: dict, output_settings: dict) -> dict:
+        """Parts of an earlier, preempted attempt, as paths next to the final output"""
+        state = task_data.get('resume_state')
+        if not state or len(task_data['input_files']) != 1 or output_settings.get('renditions') \
+                or output_settings.get('format', 'file') != 'file':
+            return None
+        output_dir = os.path.dirname(output_settings['path'])
+        parts = [os.path.join(output_dir, name) for name in state.get('parts', [])]
+        missing = [part for part in parts if not os.path.exists(part)]
+        if missing:
+            logger.warning(f"Parts of task {task_data['id']} are missing ({', '.join(missing)}), starting over")
+            return None
+        return {"offset": state['offset'], "parts": parts}
+
+    def _final_output_path(self) -> str:
+        """Destination of the current single-file output"""
+        for local_path, final_path in self.current_staging.outputs:
+            if local_path == self.current_task.output_settings['path']:
+                return final_path
+        return self.current_task.output_settings['path']
+
+    async def _finish_cancelled(self, task_id: str, resume_parts: list):
+        """Drop what a cancelled task left behind and tell the orchestrator the agent is free"""
+        for part in resume_parts:
+            try:
+                os.unlink(part)
+            except OSError:
+                pass
+        logger.info(f"Task {task_id} cancelled")
+        await self.ws_client.send_cancelled(task_id)
+        self.checkpoint_manager.clear_checkpoint()
+        self._finish_task()
+
+    def _finish_task(self):
+        if self.current_staging:
+            self.current_staging.cleanup()
+        if self.current_slot:
+            self.resources.release(self.current_slot)
+        self.current_staging = None
+        self.current_slot = None
+        self.current_task = None
+        self.current_task_id = None
 
     def _map_storage_paths(self, files: list) -> list:
         """Map storage IDs to actual paths"""
@@ -101,29 +292,71 @@ class TranscoderAgent:
         if storage_id in self.storage_map:
             base_path = self.storage_map[storage_id]
             settings = settings.copy()
-            settings['path'] = os.path.join(base_path, settings['path'])
+            if settings.get('renditions'):
+                # Renditions share the task's storage unless they name their own
+                renditions = []
+                for rendition in settings['renditions']:
+                    rendition_storage = rendition.get('storage', storage_id)
+                    if rendition_storage not in self.storage_map:
+                        raise ValueError(f"Unknown storage ID: {rendition_storage}")
+                    rendition = rendition.copy()
+                    rendition['path'] = os.path.join(self.storage_map[rendition_storage], rendition['path'])
+                    renditions.append(rendition)
+                settings['renditions'] = renditions
+            else:
+                settings['path'] = os.path.join(base_path, settings['path'])
             return settings
         else:
             raise ValueError(f"Unknown storage ID: {storage_id}")
 
-    async def _on_progress(self, task_id: str, progress: float):
+    async def _heartbeat_payload(self) -> dict:
+        """Host load reported with every heartbeat"""
+        own_pids = []
+        encode_fps = 0.0
+        task = self.current_task
+        if task and task.process and task.process.returncode is None:
+            own_pids.append(task.process.pid)
+            encode_fps += task.fps
+        return {"load": await self.load_monitor.sample(own_pids, encode_fps)}
+
+    async def _on_progress(self, task_id: str, progress: float, renditions: dict = None):
         """Handle progress updates from transcoding task"""
-        await self.ws_client.send_progress(task_id, progress)
+        task = self.current_task
+        speed = task.speed if task and task.task_id == task_id else None
+        await self.ws_client.send_progress(task_id, progress, renditions, speed)
         self.checkpoint_manager.update_progress(progress)
 
+    async def _on_segments(self, task_id: str, segments: list):
+        """Report finished HLS/DASH segments so consumers can start reading them"""
+        await self.ws_client.send_segments(task_id, segments)
+
     async def _on_completion(self, task_id: str):
         """Handle task completion"""
-        logger.info(f"Task {task_id} completed successfully")
-        await self.ws_client.send_complete(task_id)
+        staging = self.current_staging
+        try:
+            staging.encode_finished()
+            await staging.publish()
+        except Exception as e:
+            await self._on_error(task_id, f"Publishing output failed: {e}", failure_info(e))
+            return
+        for part in self.current_task.resume_parts:
+            # Joined into the published output
+            try:
+                os.unlink(part)
+            except OSError:
+                pass
+        logger.info(f"Task {task_id} completed successfully ({staging.timings})")
+        await self.ws_client.send_complete(task_id, staging.timings)
         self.checkpoint_manager.clear_checkpoint()
-        self.current_task = None
+        self._finish_task()
 
-    async def _on_error(self, task_id: str, error: str):
+    async def _on_error(self, task_id: str, error: str, failure: dict = None):
         """Handle task error"""
-        logger.error(f"Task {task_id} failed: {error}")
-        await self.ws_client.send_failed(task_id, error)
+        kind = f" ({failure['kind']})" if failure else ""
+        logger.error(f"Task {task_id} failed{kind}: {error}")
+        await self.ws_client.send_failed(task_id, error, failure)
         self.checkpoint_manager.clear_checkpoint()
-        self.current_task = None
+        self._finish_task()
 
     async def shutdown(self):
         """Graceful shutdown"""
@@ -0,0 +1,3 @@
+from .load import HostLoadMonitor
+
+__all__ = ['HostLoadMonitor']
@@ -0,0 +1,128 @@
+import asyncio
+import logging
+import os
+import shutil
+from pathlib import Path
+from typing import Dict, Iterable, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+class HostLoadMonitor:
+    """Samples host load for heartbeats.
+
+    CPU utilisation is measured over a short window at sample time so the
+    figure reflects the host right now rather than an average that still
+    contains the encode that just finished. The share used by our own
+    ffmpeg processes is reported separately, so the orchestrator can tell
+    competing workloads apart from our own work.
+    """
+
+    def __init__(self, scratch_dir: Path, cpu_window: float = 0.5):
+        self.scratch_dir = Path(scratch_dir)
+        self.cpu_window = cpu_window
+
+    async def sample(self, own_pids: Iterable[int] = (), encode_fps: float = 0.0) -> Dict:
+        own_pids = list(own_pids)
+        cpu_count = os.cpu_count() or 1
+
+        host_before = self._read_host_cpu()
+        own_before = self._read_process_cpu(own_pids)
+        await asyncio.sleep(self.cpu_window)
+        host_after = self._read_host_cpu()
+        own_after = self._read_process_cpu(own_pids)
+
+        cpu_percent = None
+        own_cpu_percent = None
+        if host_before and host_after:
+            busy = host_after[0] - host_before[0]
+            total = host_after[1] - host_before[1]
+            if total > 0:
+                cpu_percent = min(100.0, 100.0 * busy / total)
+                # Own jiffies are per process, host jiffies are summed over all CPUs
+                own_busy = own_after - own_before
+                own_cpu_percent = min(cpu_percent, 100.0 * own_busy / total)
+
+        try:
+            load_avg = list(os.getloadavg())
+        except OSError:
+            load_avg = None
+
+        memory = self._read_meminfo()
+        disk_free = self._disk_free()
+
+        return {
+            "load_avg": load_avg,
+            "cpu_count": cpu_count,
+            "cpu_percent": round(cpu_percent, 1) if cpu_percent is not None else None,
+            "own_cpu_percent": round(own_cpu_percent, 1) if own_cpu_percent is not None else None,
+            "external_cpu_percent": (
+                round(max(0.0, cpu_percent - own_cpu_percent), 1)
+                if cpu_percent is not None else None
+            ),
+            "memory_free_bytes": memory.get("MemAvailable"),
+            "memory_total_bytes": memory.get("MemTotal"),
+            "scratch_free_bytes": disk_free,
+            "active_encodes": len(own_pids),
+            "ffmpeg_processes": self._count_ffmpeg_processes(),
+            "encode_fps": round(encode_fps, 1),
+        }
+
+    def _read_host_cpu(self) -> Optional[Tuple[int, int]]:
+        """(busy, total) jiffies summed over all CPUs"""
+        try:
+            with open("/proc/stat") as f:
+                fields = [int(value) for value in f.readline().split()[1:]]
+        except (OSError, ValueError):
+            return None
+        idle = fields[3] + (fields[4] if len(fields) > 4 else 0)  # idle + iowait
+        total = sum(fields[:8])  # guest time is already included in user/nice
+        return total - idle, total
+
+    def _read_process_cpu(self, pids: Iterable[int]) -> int:
+        """utime + stime jiffies of the given processes"""
+        total = 0
+        for pid in pids:
+            try:
+                with open(f"/proc/{pid}/stat") as f:
+                    # comm may contain spaces, fields restart after the closing paren
+                    fields = f.read().rsplit(")", 1)[1].split()
+                total += int(fields[11]) + int(fields[12])
+            except (OSError, ValueError, IndexError):
+                continue
+        return total
+
+    def _read_meminfo(self) -> Dict[str, int]:
+        info = {}
+        try:
+            with open("/proc/meminfo") as f:
+                for line in f:
+                    key, value = line.split(":", 1)
+                    if key in ("MemTotal", "MemAvailable"):
+                        info[key] = int(value.split()[0]) * 1024
+        except (OSError, ValueError):
+            pass
+        return info
+
+    def _disk_free(self) -> Optional[int]:
+        try:
+            return shutil.disk_usage(self.scratch_dir).free
+        except OSError as e:
+            logger.warning(f"Could not read free space of {self.scratch_dir}: {e}")
+            return None
+
+    def _count_ffmpeg_processes(self) -> int:
+        count = 0
+        try:
+            entries = os.listdir("/proc")
+        except OSError:
+            return 0
+        for entry in entries:
+            if not entry.isdigit():
+                continue
+            try:
+                with open(f"/proc/{entry}/comm") as f:
+                    if f.read().strip() == "ffmpeg":
+                        count += 1
+            except OSError:
+                continue
+        return count
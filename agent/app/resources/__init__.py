@@ -0,0 +1,3 @@
+from .manager import EncodeSlot, ResourceManager, parse_cpu_list, topology_order
+
+__all__ = ['EncodeSlot', 'ResourceManager', 'parse_cpu_list', 'topology_order']
@@ -0,0 +1,223 @@
+import logging
+import os
+import shutil
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional
+
+logger = logging.getLogger(__name__)
+
+# Nice value of an encode per task priority
+DEFAULT_PRIORITY_NICE = {"HIGH": 0, "MEDIUM": 5, "LOW": 10}
+
+CGROUP_PERIOD_US = 100000
+
+def parse_cpu_list(value: str) -> List[int]:
+    """CPUs of a list like "0-3,8,10-11" (the format of cpuset and sysfs)"""
+    cpus = []
+    for part in value.split(','):
+        part = part.strip()
+        if not part:
+            continue
+        if '-' in part:
+            first, last = part.split('-', 1)
+            cpus.extend(range(int(first), int(last) + 1))
+        else:
+            cpus.append(int(part))
+    return sorted(set(cpus))
+
+def topology_order(cpus: Iterable[int]) -> List[int]:
+    """CPUs ordered by package and core, so hyperthread siblings (and cores
+    sharing a cache) end up next to each other and in the same partition"""
+    def key(cpu: int):
+        topology = Path(f"/sys/devices/system/cpu/cpu{cpu}/topology")
+        try:
+            package = int((topology / "physical_package_id").read_text())
+            core = int((topology / "core_id").read_text())
+        except (OSError, ValueError):
+            return (0, cpu, cpu)
+        return (package, core, cpu)
+    return sorted(cpus, key=key)
+
+class EncodeSlot:
+    """Cores, priority and cgroup of one running encode.
+
+    ``command`` prefixes taskset, nice and ionice, which each exec the next
+    one and finally ffmpeg in the same process, so the affinity is in place
+    before ffmpeg sizes its thread pools (they follow the affinity mask).
+    Nothing runs in the child between fork and exec, which isn't safe in a
+    threaded parent. ``attach`` moves the started process into the slot's
+    cgroup, and applies what the missing tools couldn't.
+    """
+
+    def __init__(
+        self,
+        index: int,
+        cpus: Optional[List[int]] = None,
+        nice: int = 0,
+        ionice_level: Optional[int] = None,
+        cgroup: Optional[Path] = None,
+        tools: Iterable[str] = ('taskset', 'nice')
+    ):
+        self.index = index
+        self.cpus = cpus
+        self.nice = nice
+        self.ionice_level = ionice_level
+        self.cgroup = cgroup
+        # Of taskset and nice, the ones installed
+        self.tools = frozenset(tools)
+        self.task_id = None
+
+    def _nice_increment(self) -> int:
+        # Only ever lower the priority, raising it needs privileges
+        try:
+            return max(self.nice - os.getpriority(os.PRIO_PROCESS, 0), 0)
+        except OSError:
+            return 0
+
+    def command(self, cmd: List[str]) -> List[str]:
+        prefix = []
+        if self.cpus and 'taskset' in self.tools:
+            prefix += ['taskset', '-c', ','.join(map(str, self.cpus))]
+        increment = self._nice_increment() if self.nice and 'nice' in self.tools else 0
+        if increment:
+            prefix += ['nice', '-n', str(increment)]
+        if self.ionice_level is not None:
+            prefix += ['ionice', '-c', '2', '-n', str(self.ionice_level)]
+        return prefix + list(cmd)
+
+    def attach(self, pid: int):
+        """Put a process started with command() in the slot; never raises,
+        the encode runs anyway"""
+        if self.cpus and 'taskset' not in self.tools:
+            try:
+                os.sched_setaffinity(pid, self.cpus)
+            except OSError:
+                pass
+        if self.nice and 'nice' not in self.tools:
+            try:
+                os.setpriority(os.PRIO_PROCESS, pid, max(os.getpriority(os.PRIO_PROCESS, 0), self.nice))
+            except OSError:
+                pass
+        if self.cgroup:
+            try:
+                with open(self.cgroup / "cgroup.procs", 'w') as f:
+                    f.write(str(pid))
+            except OSError:
+                pass
+
+    def describe(self) -> str:
+        parts = [f"CPUs {','.join(map(str, self.cpus))}" if self.cpus else "all CPUs", f"nice {self.nice}"]
+        if self.ionice_level is not None:
+            parts.append(f"ionice {self.ionice_level}")
+        if self.cgroup:
+            parts.append(f"cgroup {self.cgroup}")
+        return ", ".join(parts)
+
+class ResourceManager:
+    """Isolates concurrent encodes of an agent from each other and the host.
+
+    ``cpus`` (all CPUs the agent may use by default) is split into
+    ``slots`` partitions of neighbouring cores, and every encode is pinned
+    to the partition of its slot, so concurrent encodes don't migrate
+    between cores and thrash each other's caches. Encodes run with the nice
+    value of their task priority and a best-effort I/O priority derived from
+    it. With ``cgroup_root`` (a delegated cgroup v2 directory) each slot
+    also gets a cgroup limited to ``cpu_limit`` cores (0 = the slot's share
+    of the CPUs) and ``memory_limit_mb`` of memory (0 = unlimited).
+    """
+
+    def __init__(
+        self,
+        cpus: Optional[Iterable[int]] = None,
+        slots: int = 1,
+        pinning: bool = True,
+        priority_nice: Optional[Dict[str, int]] = None,
+        ionice: bool = True,
+        cgroup_root: Optional[Path] = None,
+        cpu_limit: float = 0.0,
+        memory_limit_mb: int = 0
+    ):
+        available = sorted(os.sched_getaffinity(0))
+        cpus = [cpu for cpu in (cpus if cpus is not None else available) if cpu in available] or available
+        self.cpus = topology_order(cpus)
+        self.slots = max(1, min(slots, len(self.cpus)))
+        self.pinning = pinning
+        self.priority_nice = dict(DEFAULT_PRIORITY_NICE if priority_nice is None else priority_nice)
+        self.ionice = ionice and shutil.which('ionice') is not None
+        if ionice and not self.ionice:
+            logger.warning("ionice not found, encodes keep the default I/O priority")
+        self.tools = [tool for tool in ('taskset', 'nice') if shutil.which(tool)]
+        self.partitions = self._partition(self.cpus, self.slots)
+        self.free = list(range(self.slots))
+        self.in_use: Dict[int, EncodeSlot] = {}
+        self.cgroups: List[Optional[Path]] = [None] * self.slots
+        if cgroup_root:
+            self.cgroups = self._create_cgroups(Path(cgroup_root), cpu_limit, memory_limit_mb)
+
+    @staticmethod
+    def _partition(cpus: List[int], slots: int) -> List[List[int]]:
+        """Split cpus into slots contiguous runs, sizes differing by at most one"""
+        size, extra = divmod(len(cpus), slots)
+        partitions, start = [], 0
+        for slot in range(slots):
+            end = start + size + (1 if slot < extra else 0)
+            partitions.append(cpus[start:end])
+            start = end
+        return partitions
+
+    def _create_cgroups(self, root: Path, cpu_limit: float, memory_limit_mb: int) -> List[Optional[Path]]:
+        try:
+            if not ((root if root.exists() else root.parent) / "cgroup.controllers").exists():
+                raise OSError("not in a cgroup v2 hierarchy")
+            root.mkdir(exist_ok=True)
+            # Children can only use the controllers their parent enables
+            (root / "cgroup.subtree_control").write_text("+cpu +memory")
+        except OSError as e:
+            logger.warning(f"Cannot use cgroup {root}, encodes run without limits: {e}")
+            return [None] * self.slots
+
+        cgroups = []
+        for slot, cpus in enumerate(self.partitions):
+            path = root / f"slot{slot}"
+            try:
+                path.mkdir(exist_ok=True)
+                cores = cpu_limit or len(cpus)
+                (path / "cpu.max").write_text(f"{int(cores * CGROUP_PERIOD_US)} {CGROUP_PERIOD_US}")
+                (path / "memory.max").write_text(
+                    str(memory_limit_mb * 1024 * 1024) if memory_limit_mb else "max"
+                )
+                cgroups.append(path)
+            except OSError as e:
+                logger.warning(f"Cannot set up cgroup {path}, slot {slot} runs without limits: {e}")
+                cgroups.append(None)
+        return cgroups
+
+    def acquire(self, task_id: str, priority: Optional[str] = None) -> EncodeSlot:
+        """Slot for a new encode. With every slot taken the encode still gets
+        its priority, but shares all the agent's CPUs without a cgroup."""
+        nice = self.priority_nice.get(priority or "MEDIUM", 0)
+        # The best-effort I/O level the kernel derives from nice, made explicit
+        ionice_level = min(7, (nice + 20) // 5) if self.ionice else None
+        if not self.free:
+            logger.warning(f"All {self.slots} encode slots are taken, task {task_id} shares all CPUs")
+            slot = EncodeSlot(
+                -1, cpus=self.cpus if self.pinning else None, nice=nice, ionice_level=ionice_level, tools=self.tools
+            )
+        else:
+            index = self.free.pop(0)
+            slot = EncodeSlot(
+                index,
+                cpus=self.partitions[index] if self.pinning else None,
+                nice=nice,
+                ionice_level=ionice_level,
+                cgroup=self.cgroups[index],
+                tools=self.tools
+            )
+            self.in_use[index] = slot
+        slot.task_id = task_id
+        return slot
+
+    def release(self, slot: EncodeSlot):
+        if self.in_use.get(slot.index) is slot:
+            del self.in_use[slot.index]
+            self.free.append(slot.index)
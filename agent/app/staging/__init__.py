@@ -0,0 +1,4 @@
+from .cache import InputCache
+from .stager import StagingArea, StagedTask
+
+__all__ = ['InputCache', 'StagingArea', 'StagedTask']
@@ -0,0 +1,144 @@
+import asyncio
+import hashlib
+import logging
+import os
+import shutil
+from collections import OrderedDict
+from pathlib import Path
+from typing import Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+class CacheEntry:
+    def __init__(self, path: Path, size: int):
+        self.path = path
+        self.size = size
+        self.pins = 0
+
+class InputCache:
+    """LRU cache of input files copied to local scratch.
+
+    Entries are keyed by source path, size and mtime, so a changed source is
+    fetched again. The total size stays within ``max_bytes``; entries pinned
+    by a running task are never evicted, so a file that only fits by
+    evicting them is read in place instead (counted as ``refused``).
+    """
+
+    def __init__(self, cache_dir: Path, max_bytes: int):
+        self.cache_dir = Path(cache_dir)
+        self.max_bytes = max_bytes
+        self.entries: "OrderedDict[str, CacheEntry]" = OrderedDict()
+        self.total_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.refused = 0
+        self._locks: Dict[str, asyncio.Lock] = {}
+
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        self._load_existing()
+
+    def _load_existing(self):
+        """Rebuild the index from files left by a previous run, oldest first"""
+        files = []
+        for entry in os.scandir(self.cache_dir):
+            if entry.is_file() and not entry.name.endswith('.partial'):
+                stat = entry.stat()
+                files.append((stat.st_atime, entry.name, stat.st_size))
+            elif entry.is_file():
+                os.unlink(entry.path)
+        for _, name, size in sorted(files):
+            key = name.split('.', 1)[0]
+            self.entries[key] = CacheEntry(self.cache_dir / name, size)
+            self.total_bytes += size
+        if self.entries:
+            logger.info(f"Input cache holds {len(self.entries)} files ({self.total_bytes} bytes)")
+        self._evict(0)
+
+    @staticmethod
+    def cache_key(source: str, stat: os.stat_result) -> str:
+        identity = f"{os.path.abspath(source)}:{stat.st_size}:{stat.st_mtime_ns}"
+        return hashlib.sha1(identity.encode()).hexdigest()
+
+    async def acquire(self, source: str, fetch: bool = True) -> Optional[Path]:
+        """Local copy of source, pinned until release(); None if it can't be cached,
+        or with fetch=False if it isn't cached already"""
+        stat = await asyncio.to_thread(os.stat, source)
+        if stat.st_size > self.max_bytes:
+            logger.info(f"{source} is larger than the input cache, reading it in place")
+            return None
+
+        key = self.cache_key(source, stat)
+        lock = self._locks.setdefault(key, asyncio.Lock())
+        async with lock:
+            entry = self.entries.get(key)
+            if entry and entry.path.exists():
+                self.entries.move_to_end(key)
+                self.hits += 1
+            elif not fetch:
+                return None
+            else:
+                self.misses += 1
+                pins = 0
+                if entry:
+                    # Its file is gone, fetch it again in the same place
+                    del self.entries[key]
+                    self.total_bytes -= entry.size
+                    pins = entry.pins
+                if not self._evict(stat.st_size):
+                    self.refused += 1
+                    logger.info(f"Input cache is full of files in use, reading {source} in place")
+                    return None
+                # Reserved before the copy so misses of other sources running
+                # meanwhile can't take the same room
+                self.total_bytes += stat.st_size
+                suffix = ''.join(Path(source).suffixes)
+                path = self.cache_dir / f"{key}{suffix}"
+                partial = path.with_name(path.name + '.partial')
+                try:
+                    await asyncio.to_thread(shutil.copyfile, source, partial)
+                    os.replace(partial, path)
+                except BaseException:
+                    self.total_bytes -= stat.st_size
+                    try:
+                        os.unlink(partial)
+                    except OSError:
+                        pass
+                    raise
+                entry = CacheEntry(path, stat.st_size)
+                entry.pins = pins
+                self.entries[key] = entry
+            entry.pins += 1
+            return entry.path
+
+    def release(self, path: Path):
+        for entry in self.entries.values():
+            if entry.path == path:
+                entry.pins = max(0, entry.pins - 1)
+                return
+
+    def _evict(self, incoming: int) -> bool:
+        """Drop least recently used, unpinned entries until incoming fits; False if it can't"""
+        for key in list(self.entries):
+            if self.total_bytes + incoming <= self.max_bytes:
+                break
+            entry = self.entries[key]
+            if entry.pins:
+                continue
+            try:
+                entry.path.unlink()
+            except FileNotFoundError:
+                pass
+            self.total_bytes -= entry.size
+            del self.entries[key]
+            logger.info(f"Evicted {entry.path.name} from input cache")
+        return self.total_bytes + incoming <= self.max_bytes
+
+    def stats(self) -> Dict:
+        return {
+            "files": len(self.entries),
+            "bytes": self.total_bytes,
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "refused": self.refused,
+        }
@@ -0,0 +1,174 @@
+import asyncio
+import logging
+import os
+import shutil
+import time
+import uuid
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from app.staging.cache import InputCache
+from app.transcoder.segments import SEGMENTED_FORMATS
+
+logger = logging.getLogger(__name__)
+
+def _copy_and_sync(source: str, destination: str):
+    with open(source, 'rb') as src, open(destination, 'wb') as dst:
+        shutil.copyfileobj(src, dst, 1024 * 1024)
+        dst.flush()
+        os.fsync(dst.fileno())
+
+class StagedTask:
+    """Local view of a task: cached inputs, scratch outputs and I/O timings"""
+
+    def __init__(self, staging: 'StagingArea', task_id: str, work_dir: Path):
+        self.staging = staging
+        self.task_id = task_id
+        self.work_dir = work_dir
+        self.input_files: List[str] = []
+        self.output_settings: Dict = {}
+        # (local scratch path, final path) for every output written locally
+        self.outputs: List[Tuple[str, str]] = []
+        self.pinned: List[Path] = []
+        self.timings = {
+            "stage_in_seconds": 0.0,
+            "encode_seconds": 0.0,
+            "publish_seconds": 0.0,
+            "bytes_in": 0,
+            "bytes_out": 0,
+            "cache_hits": 0,
+        }
+        self._encode_started = None
+
+    def encode_started(self):
+        self._encode_started = time.monotonic()
+
+    def encode_finished(self):
+        if self._encode_started is not None:
+            self.timings["encode_seconds"] = round(time.monotonic() - self._encode_started, 3)
+
+    async def publish(self):
+        """Copy scratch outputs next to their destination and rename them into place.
+
+        The rename is atomic on the destination filesystem, so consumers only
+        ever see a missing or a complete file.
+        """
+        started = time.monotonic()
+        for local_path, final_path in self.outputs:
+            await self.publish_file(local_path, final_path)
+        self.timings["publish_seconds"] = round(time.monotonic() - started, 3)
+
+    async def publish_file(self, local_path: str, final_path: str):
+        """Publish a single file, e.g. the part of a preempted encode"""
+        final_dir = os.path.dirname(final_path)
+        os.makedirs(final_dir, exist_ok=True)
+        if os.path.dirname(os.path.abspath(local_path)) == os.path.abspath(final_dir):
+            # Already on the destination filesystem (staging disabled)
+            os.replace(local_path, final_path)
+        else:
+            # Unique per attempt: a speculative copy may publish the same task at the same time
+            partial = os.path.join(final_dir, f".{os.path.basename(final_path)}.{self.task_id}.{uuid.uuid4().hex[:8]}.partial")
+            try:
+                await asyncio.to_thread(_copy_and_sync, local_path, partial)
+                os.replace(partial, final_path)
+            except BaseException:
+                if os.path.exists(partial):
+                    os.unlink(partial)
+                raise
+        self.timings["bytes_out"] += os.path.getsize(final_path)
+
+    def cleanup(self):
+        """Unpin cached inputs and drop the scratch work directory"""
+        for path in self.pinned:
+            self.staging.cache.release(path)
+        self.pinned = []
+        shutil.rmtree(self.work_dir, ignore_errors=True)
+
+class StagingArea:
+    """Agent-side scratch space between remote storage and ffmpeg.
+
+    Inputs are copied to local disk through an LRU cache so ffmpeg seeks
+    locally and a source reused by several jobs is only fetched once.
+    Outputs are encoded into a per-task work directory and published with
+    copy + atomic rename once ffmpeg succeeds.
+    """
+
+    def __init__(self, scratch_dir: Path, cache_bytes: int, enabled: bool = True):
+        self.enabled = enabled
+        self.work_root = Path(scratch_dir) / 'work'
+        self.cache = InputCache(Path(scratch_dir) / 'cache', cache_bytes)
+        # Work directories of a previous run belong to tasks that are gone
+        shutil.rmtree(self.work_root, ignore_errors=True)
+        self.work_root.mkdir(parents=True, exist_ok=True)
+
+    async def stage(
+        self,
+        task_id: str,
+        input_files: List[str],
+        output_settings: Dict,
+        private_outputs: bool = False,
+        in_place: Iterable[int] = ()
+    ) -> StagedTask:
+        """Stage inputs and outputs of a task. private_outputs writes the
+        outputs to scratch even with staging disabled, for an attempt that
+        must not touch the destination before it has finished. Inputs whose
+        index is in in_place are only used from the cache if already there:
+        a trim reads a small part of its source, copying all of it would cost
+        more than ffmpeg seeking in the original."""
+        work_dir = self.work_root / task_id
+        shutil.rmtree(work_dir, ignore_errors=True)
+        work_dir.mkdir(parents=True)
+        staged = StagedTask(self, task_id, work_dir)
+
+        if not self.enabled:
+            staged.input_files = list(input_files)
+            staged.output_settings = self._local_outputs(staged, output_settings) if private_outputs else output_settings
+            return staged
+
+        try:
+            started = time.monotonic()
+            hits = self.cache.hits
+            in_place = set(in_place)
+            for index, source in enumerate(input_files):
+                local = await self.cache.acquire(source, fetch=index not in in_place)
+                if local is None:
+                    staged.input_files.append(source)
+                    continue
+                staged.pinned.append(local)
+                staged.input_files.append(str(local))
+                staged.timings["bytes_in"] += local.stat().st_size
+            staged.timings["stage_in_seconds"] = round(time.monotonic() - started, 3)
+            staged.timings["cache_hits"] = self.cache.hits - hits
+        except BaseException:
+            staged.cleanup()
+            raise
+
+        staged.output_settings = self._local_outputs(staged, output_settings)
+        return staged
+
+    def _local_outputs(self, staged: StagedTask, output_settings: Dict) -> Dict:
+        if output_settings.get('format', 'file') in SEGMENTED_FORMATS:
+            # Segments are published one by one as ffmpeg finishes them (it
+            # renames them into place itself), so they are written in place
+            return output_settings
+
+        settings = output_settings.copy()
+        renditions = settings.get('renditions')
+        if renditions:
+            settings['renditions'] = []
+            for i, rendition in enumerate(renditions):
+                rendition = rendition.copy()
+                rendition['path'] = self._local_path(staged, rendition['path'], i)
+                settings['renditions'].append(rendition)
+        else:
+            settings['path'] = self._local_path(staged, settings['path'], 0)
+        return settings
+
+    @staticmethod
+    def _local_path(staged: StagedTask, final_path: str, index: int) -> str:
+        local_path = str(staged.work_dir / f"{index}_{os.path.basename(final_path)}")
+        staged.outputs.append((local_path, final_path))
+        return local_path
+
+    def stats(self) -> Optional[Dict]:
+        return self.cache.stats() if self.enabled else None
@@ -1,3 +1,6 @@
-from .task import TranscodeTask
+from .task import TranscodeTask, VIDEO_CODEC_ARGS, REQUIRED_FILTERS
+from .keyframes import KeyframeIndex, KeyframeIndexCache
+from .complexity import ComplexityAnalyzer, CrfChoice
+from .failures import StderrTail, TranscodeError, classify_exit, classify_exception, failure_info
 
-__all__ = ['TranscodeTask']
\ No newline at end of file
+__all__ = ['TranscodeTask', 'VIDEO_CODEC_ARGS', 'REQUIRED_FILTERS', 'KeyframeIndex', 'KeyframeIndexCache', 'ComplexityAnalyzer', 'CrfChoice', 'StderrTail', 'TranscodeError', 'classify_exit', 'classify_exception', 'failure_info']
\ No newline at end of file
@@ -0,0 +1,279 @@
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import re
+import shutil
+import statistics
+import tempfile
+from pathlib import Path
+from typing import Callable, Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# CRF range searched per codec, lowest (best quality) first, and the step
+CRF_RANGES = {'h264': (18, 34), 'h265': (20, 36), 'vp9': (24, 48)}
+CRF_STEP = 2
+
+# Quality proxies (ffmpeg filters) and the default target of each
+QUALITY_TARGETS = {'ssim': 0.98, 'psnr': 42.0}
+QUALITY_PATTERNS = {
+    'ssim': re.compile(r'SSIM .*All:([\d.]+|inf)'),
+    'psnr': re.compile(r'PSNR .*average:([\d.]+|inf)'),
+}
+
+# Bytes read from the start, middle and end of a source to fingerprint it
+FINGERPRINT_BLOCK = 64 * 1024
+
+def crf_args(codec: str, crf: int) -> List[str]:
+    """Constant-quality rate control options for codec"""
+    args = ['-crf', str(crf)]
+    if codec == 'vp9':
+        # libvpx only uses the CRF as a quality target with no bitrate cap
+        args.extend(['-b:v', '0'])
+    return args
+
+def excerpts(start: float, end: float, samples: int, seconds: float) -> List[Tuple[float, float]]:
+    """(start, duration) of samples excerpts, one from the middle of each equal slice of the range"""
+    length = end - start
+    if samples <= 0 or seconds <= 0 or length <= 0:
+        return []
+    if length <= samples * seconds:
+        return [(start, length)]
+    step = length / samples
+    return [(start + step * i + (step - seconds) / 2, seconds) for i in range(samples)]
+
+def fingerprint(path: str) -> str:
+    """Content fingerprint of a source, the same for every copy of it"""
+    size = os.path.getsize(path)
+    digest = hashlib.sha1(str(size).encode())
+    with open(path, 'rb') as f:
+        for offset in (0, max(size // 2 - FINGERPRINT_BLOCK // 2, 0), max(size - FINGERPRINT_BLOCK, 0)):
+            f.seek(offset)
+            digest.update(f.read(FINGERPRINT_BLOCK))
+    return digest.hexdigest()
+
+async def _spawn(cmd: List[str], **kwargs) -> asyncio.subprocess.Process:
+    return await asyncio.create_subprocess_exec(*cmd, **kwargs)
+
+class CrfChoice:
+    """CRF picked for a source, with the samples it was picked from"""
+
+    def __init__(self, crf: int, metric: str, target: float, points: List[Dict]):
+        self.crf = crf
+        self.metric = metric
+        self.target = target
+        # {"crf", "kbps", "quality"} of every CRF tried, by CRF
+        self.points = sorted(points, key=lambda point: point['crf'])
+
+    def to_dict(self) -> Dict:
+        return {"crf": self.crf, "metric": self.metric, "target": self.target, "points": self.points}
+
+    @classmethod
+    def from_dict(cls, data: Dict) -> 'CrfChoice':
+        return cls(**data)
+
+    def describe(self) -> str:
+        chosen = next((point for point in self.points if point['crf'] == self.crf), None)
+        detail = f", {chosen['quality']:g} {self.metric} at {chosen['kbps']:g} kbps" if chosen else ""
+        return f"CRF {self.crf}{detail} (target {self.target:g})"
+
+class ComplexityAnalyzer:
+    """Per-title CRF selection, cached in ``cache_dir``.
+
+    A few short excerpts spread over the source are encoded at candidate
+    CRFs, and each is compared with its source through the SSIM or PSNR
+    filter. The highest CRF (smallest output) whose mean quality still
+    meets the target wins; quality falls as the CRF rises, so the candidates
+    are searched by bisection. Results are stored under a fingerprint of
+    the source content and the analysis settings, so every copy of a source
+    is analysed once. At most ``max_entries`` results are kept.
+    """
+
+    def __init__(
+        self,
+        cache_dir: Path,
+        samples: int = 3,
+        sample_seconds: float = 2.0,
+        max_entries: int = 1000,
+        command_timeout: float = 600.0
+    ):
+        self.cache_dir = Path(cache_dir)
+        self.samples = samples
+        self.sample_seconds = sample_seconds
+        self.max_entries = max_entries
+        self.command_timeout = command_timeout
+        self._locks: Dict[str, asyncio.Lock] = {}
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+
+    def cache_key(self, source_fingerprint: str, *settings) -> str:
+        identity = ':'.join([source_fingerprint, str(self.samples), str(self.sample_seconds), *map(str, settings)])
+        return hashlib.sha1(identity.encode()).hexdigest()
+
+    async def choose_crf(
+        self,
+        source: str,
+        codec: str,
+        codec_args: List[str],
+        start: float,
+        end: float,
+        resolution: Optional[str] = None,
+        metric: str = 'ssim',
+        target: Optional[float] = None,
+        spawn: Optional[Callable] = None,
+        stopped: Optional[Callable[[], bool]] = None
+    ) -> Optional[CrfChoice]:
+        """CRF of codec_args that meets target on source between start and end,
+        encoded at resolution; None if it can't be analysed"""
+        if codec not in CRF_RANGES or metric not in QUALITY_TARGETS:
+            logger.warning(f"No per-title analysis for codec {codec} with metric {metric}")
+            return None
+        target = QUALITY_TARGETS[metric] if target is None else float(target)
+        try:
+            source_fingerprint = await asyncio.to_thread(fingerprint, source)
+        except OSError as e:
+            logger.warning(f"Cannot fingerprint {source}: {e}")
+            return None
+        key = self.cache_key(
+            source_fingerprint, codec, ' '.join(codec_args), f"{start:.3f}", f"{end:.3f}", resolution, metric, target
+        )
+        path = self.cache_dir / f"{key}.json"
+        lock = self._locks.setdefault(key, asyncio.Lock())
+        async with lock:
+            try:
+                with open(path) as f:
+                    choice = CrfChoice.from_dict(json.load(f))
+                os.utime(path)
+                return choice
+            except (OSError, ValueError, TypeError):
+                pass
+
+            work_dir = Path(tempfile.mkdtemp(prefix='analysis-', dir=self.cache_dir))
+            try:
+                choice = await self._search(
+                    source, codec, codec_args, excerpts(start, end, self.samples, self.sample_seconds),
+                    resolution, metric, target, work_dir, spawn or _spawn, stopped
+                )
+            except Exception as e:
+                logger.warning(f"Per-title analysis of {source} failed: {e}")
+                return None
+            finally:
+                shutil.rmtree(work_dir, ignore_errors=True)
+            if choice is None:
+                return None
+            tmp_path = path.with_suffix('.tmp')
+            with open(tmp_path, 'w') as f:
+                json.dump(choice.to_dict(), f)
+            os.replace(tmp_path, path)
+            self._evict()
+            return choice
+
+    async def _search(
+        self,
+        source: str,
+        codec: str,
+        codec_args: List[str],
+        windows: List[Tuple[float, float]],
+        resolution: Optional[str],
+        metric: str,
+        target: float,
+        work_dir: Path,
+        spawn: Callable,
+        stopped: Optional[Callable[[], bool]]
+    ) -> Optional[CrfChoice]:
+        if not windows:
+            return None
+        low, high = CRF_RANGES[codec]
+        candidates = list(range(low, high + 1, CRF_STEP))
+        points = []
+        best = None
+        first, last = 0, len(candidates) - 1
+        while first <= last:
+            if stopped and stopped():
+                return None
+            middle = (first + last) // 2
+            point = await self._measure(
+                source, codec, codec_args, candidates[middle], windows, resolution, metric, work_dir, spawn
+            )
+            points.append(point)
+            if point['quality'] >= target:
+                best = middle
+                first = middle + 1
+            else:
+                last = middle - 1
+        # Not even the lowest CRF meets the target: the best quality searched
+        crf = candidates[best if best is not None else 0]
+        return CrfChoice(crf, metric, target, points)
+
+    async def _measure(
+        self,
+        source: str,
+        codec: str,
+        codec_args: List[str],
+        crf: int,
+        windows: List[Tuple[float, float]],
+        resolution: Optional[str],
+        metric: str,
+        work_dir: Path,
+        spawn: Callable
+    ) -> Dict:
+        """Encode every excerpt at crf; returns its bitrate and mean quality"""
+        scale = f"scale={resolution.replace('x', ':')}," if resolution else ""
+        size, seconds, qualities = 0, 0.0, []
+        for index, (start, duration) in enumerate(windows):
+            window = ['-ss', f"{start:.3f}", '-t', f"{duration:.3f}"]
+            sample = work_dir / f"crf{crf}-{index}.mkv"
+            await self._ffmpeg(spawn, [
+                '-v', 'error', '-y', *window, '-i', source, '-map', '0:v:0',
+                *(['-vf', scale.rstrip(',')] if scale else []),
+                *codec_args, *crf_args(codec, crf), '-an', '-f', 'matroska', str(sample)
+            ])
+            size += sample.stat().st_size
+            seconds += duration
+            # The reference goes through the same scaler as the encode
+            graph = (
+                f"[0:v:0]setpts=PTS-STARTPTS[dist];[1:v:0]{scale}setpts=PTS-STARTPTS[ref];"
+                f"[dist][ref]{metric}"
+            )
+            stderr = await self._ffmpeg(spawn, [
+                '-v', 'info', '-nostats', '-i', str(sample), *window, '-i', source,
+                '-lavfi', graph, '-f', 'null', '-'
+            ])
+            matches = QUALITY_PATTERNS[metric].findall(stderr)
+            if not matches:
+                raise RuntimeError(f"no {metric} score in ffmpeg output")
+            qualities.append(float(matches[-1]))
+            sample.unlink()
+        return {
+            "crf": crf,
+            "kbps": round(size * 8 / seconds / 1000, 1),
+            "quality": round(statistics.mean(qualities), 4)
+        }
+
+    async def _ffmpeg(self, spawn: Callable, args: List[str]) -> str:
+        process = await spawn(
+            ['ffmpeg', '-hide_banner', *args],
+            stdout=asyncio.subprocess.DEVNULL,
+            stderr=asyncio.subprocess.PIPE
+        )
+        try:
+            _, stderr = await asyncio.wait_for(process.communicate(), self.command_timeout)
+        except asyncio.TimeoutError:
+            process.kill()
+            await process.wait()
+            raise
+        output = stderr.decode('utf-8', errors='ignore')
+        if process.returncode != 0:
+            raise RuntimeError(output.strip()[-500:])
+        return output
+
+    def _evict(self):
+        if not self.max_entries:
+            return
+        entries = sorted(self.cache_dir.glob('*.json'), key=lambda path: path.stat().st_mtime)
+        for path in entries[:max(len(entries) - self.max_entries, 0)]:
+            try:
+                path.unlink()
+            except FileNotFoundError:
+                pass
@@ -0,0 +1,103 @@
+import errno
+import re
+import signal
+from collections import deque
+from typing import Dict, Iterable, List, Optional, Tuple
+
+TRANSIENT = "transient"
+PERMANENT = "permanent"
+UNKNOWN = "unknown"
+
+# (pattern, kind, reason), checked in order against the captured stderr;
+# the first match wins, so more specific patterns come first
+STDERR_PATTERNS: List[Tuple[re.Pattern, str, str]] = [
+    (re.compile(r"No space left on device", re.I), TRANSIENT, "disk_full"),
+    (re.compile(r"Cannot allocate memory|Out of memory", re.I), TRANSIENT, "out_of_memory"),
+    (re.compile(r"Input/output error|Stale file handle|Transport endpoint is not connected", re.I), TRANSIENT, "io_error"),
+    (re.compile(r"Connection (reset|refused|timed out)|Network is unreachable|Broken pipe", re.I), TRANSIENT, "network"),
+    (re.compile(r"Resource temporarily unavailable", re.I), TRANSIENT, "resource_busy"),
+    (re.compile(r"Unknown encoder|Encoder .* not found|Decoder .* not found|Unsupported codec|not supported by", re.I), PERMANENT, "unsupported_codec"),
+    (re.compile(r"Invalid data found when processing input|moov atom not found|could not find codec parameters", re.I), PERMANENT, "invalid_input"),
+    (re.compile(r"does not contain any stream|Stream map .* matches no streams", re.I), PERMANENT, "no_streams"),
+    (re.compile(r"Unrecognized option|Error parsing options|Invalid argument|Option not found", re.I), PERMANENT, "invalid_options"),
+    (re.compile(r"No such file or directory", re.I), PERMANENT, "not_found"),
+    (re.compile(r"Permission denied", re.I), PERMANENT, "permission_denied"),
+]
+
+TRANSIENT_ERRNOS = {errno.ENOSPC, errno.ENOMEM, errno.EIO, errno.EAGAIN, errno.ESTALE, errno.ETIMEDOUT, errno.ECONNRESET}
+
+class StderrTail:
+    """Bounded ring buffer of the last lines ffmpeg wrote to stderr"""
+
+    def __init__(self, max_lines: int = 50, max_line_length: int = 500):
+        self.lines = deque(maxlen=max_lines)
+        self.max_line_length = max_line_length
+
+    def append(self, line: str):
+        line = line.rstrip()
+        if line:
+            self.lines.append(line[:self.max_line_length])
+
+    def __iter__(self):
+        return iter(self.lines)
+
+    def __len__(self) -> int:
+        return len(self.lines)
+
+    def text(self) -> str:
+        return "\n".join(self.lines)
+
+def classify_exit(return_code: Optional[int], stderr: Iterable[str]) -> Tuple[str, str, Optional[str]]:
+    """Kind, reason and the telling stderr line of an ffmpeg failure.
+
+    A process killed by a signal (negative return code, or 128 + signal from
+    a wrapper shell) is transient: usually the OOM killer or an operator.
+    Otherwise the stderr decides; unrecognized failures are UNKNOWN.
+    """
+    lines = list(stderr)
+    if return_code is not None and (return_code < 0 or return_code in (128 + signal.SIGKILL, 128 + signal.SIGTERM)):
+        signum = -return_code if return_code < 0 else return_code - 128
+        return TRANSIENT, "killed" if signum == signal.SIGKILL else "signal", None
+    # Later lines are closer to the actual cause
+    for line in reversed(lines):
+        for pattern, kind, reason in STDERR_PATTERNS:
+            if pattern.search(line):
+                return kind, reason, line
+    return UNKNOWN, "unknown", lines[-1] if lines else None
+
+def classify_exception(error: BaseException) -> Tuple[str, str]:
+    """Kind and reason of an error raised outside ffmpeg (staging, probing, publishing)"""
+    if isinstance(error, FileNotFoundError):
+        return PERMANENT, "not_found"
+    if isinstance(error, PermissionError):
+        return PERMANENT, "permission_denied"
+    if isinstance(error, OSError) and error.errno in TRANSIENT_ERRNOS:
+        return TRANSIENT, "io_error"
+    if isinstance(error, MemoryError):
+        return TRANSIENT, "out_of_memory"
+    return UNKNOWN, "unknown"
+
+class TranscodeError(RuntimeError):
+    """ffmpeg failed; carries the classification and the stderr tail"""
+
+    def __init__(self, message: str, kind: str, reason: str, return_code: Optional[int] = None, stderr: Iterable[str] = ()):
+        super().__init__(message)
+        self.kind = kind
+        self.reason = reason
+        self.return_code = return_code
+        self.stderr = list(stderr)
+
+    def to_dict(self) -> Dict:
+        return {
+            "kind": self.kind,
+            "reason": self.reason,
+            "return_code": self.return_code,
+            "stderr": self.stderr
+        }
+
+def failure_info(error: BaseException) -> Dict:
+    """Failure report sent to the orchestrator for any error"""
+    if isinstance(error, TranscodeError):
+        return error.to_dict()
+    kind, reason = classify_exception(error)
+    return {"kind": kind, "reason": reason, "return_code": None, "stderr": []}
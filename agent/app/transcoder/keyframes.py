@@ -0,0 +1,221 @@
+import asyncio
+import hashlib
+import json
+import logging
+import os
+from pathlib import Path
+from typing import Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+# ffprobe codec names of the codecs tasks ask for
+PROBE_CODECS = {'h264': 'h264', 'hevc': 'h265', 'vp9': 'vp9'}
+
+class KeyframeIndex:
+    """Stream layout of one source and the keyframes found before cut points"""
+
+    def __init__(
+        self,
+        keyframes: Optional[Dict[str, Optional[float]]] = None,
+        duration: Optional[float] = None,
+        video_codec: Optional[str] = None,
+        width: Optional[int] = None,
+        height: Optional[int] = None,
+        audio_codec: Optional[str] = None
+    ):
+        # Cut point ("%.3f" seconds) -> last keyframe at or before it, None if there is none
+        self.keyframes = keyframes or {}
+        self.duration = duration
+        self.video_codec = video_codec
+        self.width = width
+        self.height = height
+        self.audio_codec = audio_codec
+
+    @property
+    def codec(self) -> Optional[str]:
+        """Video codec under the name tasks use for it"""
+        return PROBE_CODECS.get(self.video_codec)
+
+    @property
+    def resolution(self) -> Optional[str]:
+        return f"{self.width}x{self.height}" if self.width and self.height else None
+
+    @staticmethod
+    def cut_key(time: float) -> str:
+        return f"{time:.3f}"
+
+    def to_dict(self) -> Dict:
+        return {
+            "keyframes": self.keyframes,
+            "duration": self.duration,
+            "video_codec": self.video_codec,
+            "width": self.width,
+            "height": self.height,
+            "audio_codec": self.audio_codec
+        }
+
+    @classmethod
+    def from_dict(cls, data: Dict) -> 'KeyframeIndex':
+        if not isinstance(data.get("keyframes"), dict):
+            # Written when the whole source was indexed, looked up again
+            data = dict(data, keyframes=None)
+        return cls(**data)
+
+class KeyframeIndexCache:
+    """Keyframe indexes of sources, kept in ``index_dir``.
+
+    An index holds the source's stream layout and, per cut point asked
+    about, the keyframe before it. That keyframe is found by probing only
+    the packets of the ``gop_window`` seconds before the cut point (ffprobe
+    seeks to the keyframe before the window and demuxes up to the cut), never
+    the whole source. Indexes are stored under the source's path, size and
+    mtime like the input cache, so a changed source is indexed again. At
+    most ``max_entries`` indexes are kept, least recently used go first.
+    """
+
+    def __init__(
+        self,
+        index_dir: Path,
+        max_entries: int = 1000,
+        command_timeout: float = 600.0,
+        gop_window: float = 10.0
+    ):
+        self.index_dir = Path(index_dir)
+        self.max_entries = max_entries
+        self.command_timeout = command_timeout
+        self.gop_window = gop_window  # seconds before a cut point its keyframe is looked for in
+        self._locks: Dict[str, asyncio.Lock] = {}
+        self.index_dir.mkdir(parents=True, exist_ok=True)
+
+    @staticmethod
+    def cache_key(source: str, stat: os.stat_result) -> str:
+        identity = f"{os.path.abspath(source)}:{stat.st_size}:{stat.st_mtime_ns}"
+        return hashlib.sha1(identity.encode()).hexdigest()
+
+    def _path(self, source: str) -> Optional[Path]:
+        try:
+            stat = os.stat(source)
+        except OSError:
+            return None
+        return self.index_dir / f"{self.cache_key(source, stat)}.json"
+
+    def _store(self, path: Path, index: KeyframeIndex):
+        tmp_path = path.with_suffix('.tmp')
+        with open(tmp_path, 'w') as f:
+            json.dump(index.to_dict(), f)
+        os.replace(tmp_path, path)
+
+    async def _get(self, source: str, path: Path) -> Optional[KeyframeIndex]:
+        """Index of source stored at path, built if missing; call with the path's lock held"""
+        try:
+            with open(path) as f:
+                index = KeyframeIndex.from_dict(json.load(f))
+            os.utime(path)
+            return index
+        except (OSError, ValueError, TypeError):
+            pass
+
+        try:
+            index = await self.build(source)
+        except Exception as e:
+            logger.warning(f"Could not probe {source}: {e}")
+            return None
+        self._store(path, index)
+        self._evict()
+        logger.info(f"Indexed the streams of {source}")
+        return index
+
+    async def get(self, source: str) -> Optional[KeyframeIndex]:
+        """Index of source, built on first use; None if it can't be probed"""
+        path = self._path(source)
+        if not path:
+            return None
+        async with self._locks.setdefault(path.stem, asyncio.Lock()):
+            return await self._get(source, path)
+
+    async def keyframe_before(self, source: str, time: float) -> Optional[float]:
+        """Last keyframe of source at or before time; None if there is none
+        within the window or the source can't be probed"""
+        path = self._path(source)
+        if not path:
+            return None
+        async with self._locks.setdefault(path.stem, asyncio.Lock()):
+            index = await self._get(source, path)
+            if not index or not index.video_codec:
+                return None
+            key = index.cut_key(time)
+            if key in index.keyframes:
+                return index.keyframes[key]
+            try:
+                keyframe = await self._find_keyframe(source, time)
+            except Exception as e:
+                logger.warning(f"Could not find the keyframe before {time:.3f}s in {source}: {e}")
+                return None
+            index.keyframes[key] = keyframe
+            self._store(path, index)
+            return keyframe
+
+    async def _find_keyframe(self, source: str, time: float) -> Optional[float]:
+        # Packets from the seek point (a keyframe before the window) up to just past the cut point
+        window = f"{max(time - self.gop_window, 0.0):.3f}%{time + 0.001:.3f}"
+        packets = await self._probe(
+            '-select_streams', 'v:0',
+            '-read_intervals', window,
+            '-show_entries', 'packet=pts_time,flags',
+            '-of', 'csv=p=0', source
+        )
+        keyframe = None
+        for line in packets.splitlines():
+            fields = line.strip().split(',')
+            if len(fields) < 2 or 'K' not in fields[1]:
+                continue
+            try:
+                pts = float(fields[0])
+            except ValueError:
+                continue
+            if pts <= time and (keyframe is None or pts > keyframe):
+                keyframe = pts
+        return keyframe
+
+    async def build(self, source: str) -> KeyframeIndex:
+        streams = json.loads(await self._probe(
+            '-show_entries', 'stream=codec_type,codec_name,width,height:format=duration',
+            '-of', 'json', source
+        ))
+        video = next((s for s in streams.get('streams', []) if s.get('codec_type') == 'video'), {})
+        audio = next((s for s in streams.get('streams', []) if s.get('codec_type') == 'audio'), {})
+        duration = streams.get('format', {}).get('duration')
+
+        return KeyframeIndex(
+            duration=float(duration) if duration else None,
+            video_codec=video.get('codec_name'),
+            width=video.get('width'),
+            height=video.get('height'),
+            audio_codec=audio.get('codec_name')
+        )
+
+    async def _probe(self, *args: str) -> str:
+        process = await asyncio.create_subprocess_exec(
+            'ffprobe', '-v', 'error', *args,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.PIPE
+        )
+        try:
+            stdout, stderr = await asyncio.wait_for(process.communicate(), self.command_timeout)
+        except asyncio.TimeoutError:
+            process.kill()
+            await process.wait()
+            raise
+        if process.returncode != 0:
+            raise RuntimeError(stderr.decode('utf-8', errors='ignore').strip()[-500:])
+        return stdout.decode('utf-8', errors='ignore')
+
+    def _evict(self):
+        if not self.max_entries:
+            return
+        entries = sorted(self.index_dir.glob('*.json'), key=lambda path: path.stat().st_mtime)
+        for path in entries[:max(len(entries) - self.max_entries, 0)]:
+            try:
+                path.unlink()
+            except FileNotFoundError:
+                pass
@@ -0,0 +1,154 @@
+import logging
+import os
+import re
+from pathlib import Path
+from typing import Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+SEGMENTED_FORMATS = ('hls', 'dash')
+# Number ffmpeg gives the first media segment (HLS start_number, DASH $Number$)
+FIRST_SEGMENT_NUMBER = {'hls': 0, 'dash': 1}
+_SEGMENT_NUMBER = re.compile(r'(\d+)\.m4s$')
+
+def segment_names(playlist_path: str) -> Dict[str, str]:
+    """File names used for the init and media segments of a playlist.
+
+    Derived from the playlist name so several renditions can share a
+    directory. Names are relative to the playlist's directory.
+    """
+    stem = Path(playlist_path).stem
+    return {
+        'init': f"{stem}_init.mp4",
+        'hls_media': f"{stem}_%05d.m4s",
+        'dash_init': f"{stem}_init-$RepresentationID$.m4s",
+        'dash_media': f"{stem}_chunk-$RepresentationID$-$Number%05d$.m4s",
+        'prefix': f"{stem}_",
+    }
+
+def segmented_output_args(output_format: str, playlist_path: str, segment_duration: float) -> List[str]:
+    """Muxer options writing fMP4 segments plus a playlist/manifest"""
+    names = segment_names(playlist_path)
+    # Keyframes on every segment boundary so each segment starts independently
+    args = [
+        '-force_key_frames', f"expr:gte(t,n_forced*{segment_duration})",
+    ]
+    if output_format == 'hls':
+        args.extend([
+            '-f', 'hls',
+            '-hls_time', str(segment_duration),
+            # EVENT playlists are appended to as segments finish, so players
+            # can start before the encode is done
+            '-hls_playlist_type', 'event',
+            '-hls_segment_type', 'fmp4',
+            '-hls_fmp4_init_filename', names['init'],
+            '-hls_segment_filename', os.path.join(os.path.dirname(playlist_path), names['hls_media']),
+            # Segments are written as .tmp and renamed once complete
+            '-hls_flags', 'independent_segments+temp_file',
+        ])
+    elif output_format == 'dash':
+        args.extend([
+            '-f', 'dash',
+            '-seg_duration', str(segment_duration),
+            '-use_template', '1',
+            '-use_timeline', '1',
+            '-init_seg_name', names['dash_init'],
+            '-media_seg_name', names['dash_media'],
+        ])
+    else:
+        raise ValueError(f"Unsupported segmented format: {output_format}")
+    return args
+
+class SegmentWatcher:
+    """Detects segments of one playlist that ffmpeg has finished writing.
+
+    HLS: the EVENT playlist only lists completed segments, so it is the
+    source of truth (with durations). DASH: every segment but the newest is
+    complete while ffmpeg runs; all of them are once it has exited.
+    """
+
+    def __init__(self, playlist_path: str, output_format: str, rendition: Optional[str] = None):
+        self.playlist_path = Path(playlist_path)
+        self.output_dir = self.playlist_path.parent
+        self.output_format = output_format
+        self.rendition = rendition
+        self.prefix = segment_names(playlist_path)['prefix']
+        self.reported = set()
+
+    def poll(self, final: bool = False) -> List[Dict]:
+        """Segments finished since the last poll"""
+        if self.output_format == 'hls':
+            finished = self._hls_finished(final)
+        else:
+            finished = self._dash_finished(final)
+
+        new_segments = []
+        for name, duration in finished:
+            if name in self.reported:
+                continue
+            path = self.output_dir / name
+            try:
+                size = path.stat().st_size
+            except OSError:
+                continue
+            self.reported.add(name)
+            init = name.startswith(self.prefix + 'init')
+            segment = {
+                "name": name,
+                "index": 0 if init else self._index(name),
+                "duration": duration,
+                "bytes": size,
+                "init": init,
+            }
+            if self.rendition:
+                segment["rendition"] = self.rendition
+            new_segments.append(segment)
+        return new_segments
+
+    def _index(self, name: str) -> int:
+        """Position of a media segment in its stream from 0, taken from the
+        number in its name (per representation for DASH)"""
+        match = _SEGMENT_NUMBER.search(name)
+        return int(match.group(1)) - FIRST_SEGMENT_NUMBER[self.output_format] if match else 0
+
+    def _hls_finished(self, final: bool):
+        entries = []
+        try:
+            lines = self.playlist_path.read_text().splitlines()
+        except OSError:
+            return entries
+
+        duration = None
+        for line in lines:
+            line = line.strip()
+            if line.startswith('#EXT-X-MAP:'):
+                # Init segment, complete as soon as it is referenced
+                uri = line.split('URI=', 1)[1].strip('"')
+                entries.append((uri, None))
+            elif line.startswith('#EXTINF:'):
+                duration = float(line[len('#EXTINF:'):].split(',')[0])
+            elif line and not line.startswith('#'):
+                entries.append((line, duration))
+                duration = None
+        return entries
+
+    def _dash_finished(self, final: bool):
+        try:
+            names = sorted(
+                entry.name for entry in os.scandir(self.output_dir)
+                if entry.is_file() and entry.name.startswith(self.prefix) and entry.name.endswith('.m4s')
+            )
+        except OSError:
+            return []
+        init_prefix = self.prefix + 'init'
+        chunk_prefix = self.prefix + 'chunk-'
+        init = [name for name in names if name.startswith(init_prefix)]
+        media = [name for name in names if name.startswith(chunk_prefix)]
+        if not final:
+            # The newest segment of each representation may still be being written
+            newest = {}
+            for name in media:
+                representation = name[len(chunk_prefix):].split('-', 1)[0]
+                newest[representation] = name
+            media = [name for name in media if name not in newest.values()]
+        return [(name, None) for name in init + media]
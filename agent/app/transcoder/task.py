@@ -3,12 +3,33 @@ import json
 import logging
 import os
 import re
+import signal
 import subprocess
+import time
 from pathlib import Path
-from typing import List, Dict, Callable, Optional
+from typing import List, Dict, Callable, Optional, Tuple
+
+from app.transcoder.failures import PERMANENT, TRANSIENT, StderrTail, TranscodeError, classify_exit, failure_info
+from app.transcoder.keyframes import KeyframeIndexCache
+from app.transcoder.complexity import ComplexityAnalyzer, crf_args
+from app.resources import EncodeSlot
+from app.transcoder.segments import SEGMENTED_FORMATS, SegmentWatcher, segment_names, segmented_output_args
 
 logger = logging.getLogger(__name__)
 
+# Encoder options for each codec name tasks ask for
+VIDEO_CODEC_ARGS = {
+    'h264': ['-c:v', 'libx264', '-preset', 'medium'],
+    'h265': ['-c:v', 'libx265', '-preset', 'medium'],
+    'vp9': ['-c:v', 'libvpx-vp9'],
+}
+
+# Filters the commands built here rely on
+REQUIRED_FILTERS = ('scale', 'pad', 'setsar', 'fps', 'format', 'concat', 'split', 'asplit')
+
+# A trim starting this close after a keyframe can be cut there without re-encoding
+KEYFRAME_TOLERANCE = 0.1
+
 class TranscodeTask:
     def __init__(
         self,
@@ -17,29 +38,85 @@ class TranscodeTask:
         output_settings: Dict,
         progress_callback: Callable,
         completion_callback: Callable,
-        error_callback: Callable
+        error_callback: Callable,
+        segment_callback: Optional[Callable] = None,
+        resume: Optional[Dict] = None,
+        timeout: Optional[float] = None,
+        stall_timeout: Optional[float] = None,
+        input_ranges: Optional[List[Tuple[Optional[float], Optional[float]]]] = None,
+        keyframes: Optional[KeyframeIndexCache] = None,
+        slot: Optional[EncodeSlot] = None,
+        complexity: Optional[ComplexityAnalyzer] = None
     ):
         self.task_id = task_id
         self.input_files = input_files
+        # (start, end) of the source each input is trimmed to, end None for the whole rest
+        self.input_ranges = [
+            (float(start or 0.0), float(end) if end is not None else None)
+            for start, end in (input_ranges or [(None, None)] * len(input_files))
+        ]
+        self.keyframes = keyframes
+        # Picks the CRF of outputs with "crf": "auto" from sample encodes
+        self.complexity = complexity
+        # CRF per output: rendition index, None for a single output
+        self.crf: Dict[Optional[int], int] = {}
+        # CPUs and priority the ffmpeg processes run with
+        self.slot = slot
+        # Keyframe-aligned trim cut without re-encoding
+        self.stream_copy = False
+        self.copy_audio = False
         self.output_settings = output_settings
         self.progress_callback = progress_callback
         self.completion_callback = completion_callback
         self.error_callback = error_callback
+        self.segment_callback = segment_callback
         self.process = None
         self.cancelled = False
+        # Seconds the run may take, and may go without progress (0 = no limit)
+        self.timeout = timeout or 0.0
+        self.stall_timeout = stall_timeout or 0.0
+        self.started_at = None
+        # "timeout" or "stalled" once the watchdog stopped ffmpeg
+        self.timed_out = None
         self.total_duration = None
+        self.fps = 0.0
+        # Seconds of source encoded per second, as ffmpeg reports it
+        self.speed = None
+        # Recent ffmpeg stderr, reported with a failure
+        self.stderr_tail = StderrTail()
+        # Output time reached by ffmpeg, in seconds of the current part
+        self.out_time = 0.0
+        self.preempted = False
+        # A preempted encode continues from offset into a new part; the
+        # earlier parts are joined with it once it finishes
+        self.offset = 0.0
+        self.resume_parts: List[str] = []
+        self.encode_path = None
+        if not self.output_settings.get('renditions'):
+            self.encode_path = self.output_settings['path']
+            if resume:
+                self.offset = float(resume['offset'])
+                self.resume_parts = list(resume['parts'])
+                self.encode_path = self.part_path(self.output_settings['path'], len(self.resume_parts))
 
     async def run(self):
         """Run the transcoding task"""
+        self.started_at = time.monotonic()
         try:
             # Validate input files exist
             for input_file in self.input_files:
                 if not os.path.exists(input_file):
                     raise FileNotFoundError(f"Input file not found: {input_file}")
 
-            # Create output directory if needed
-            output_path = Path(self.output_settings['path'])
-            output_path.parent.mkdir(parents=True, exist_ok=True)
+            # Create output directories if needed
+            for path in self.output_paths():
+                Path(path).parent.mkdir(parents=True, exist_ok=True)
+
+            await self._plan_stream_copy()
+            await self._plan_crf()
+            if self.cancelled:
+                # Cancelled or preempted during per-title analysis
+                return
 
             # Build ffmpeg command
             cmd = self._build_ffmpeg_command()
@@ -52,19 +129,140 @@ class TranscodeTask:
             # Run ffmpeg with progress monitoring
             await self._run_ffmpeg(cmd)
 
+            if self.resume_parts and not self.cancelled:
+                await self._join_parts()
+
             if not self.cancelled:
                 await self.completion_callback(self.task_id)
 
         except Exception as e:
             logger.error(f"Transcoding error: {e}")
-            await self.error_callback(self.task_id, str(e))
+            if self.timed_out:
+                self.cleanup_outputs()
+            await self.error_callback(self.task_id, str(e), failure_info(e))
 
-    async def cancel(self):
+    async def cancel(self, grace: float = 10.0):
         """Cancel the transcoding task"""
         self.cancelled = True
-        if self.process:
-            self.process.terminate()
+        await self._stop(grace)
+
+    async def _stop(self, grace: float = 10.0):
+        """SIGTERM ffmpeg, then SIGKILL it if it is still running after grace seconds
+        (right away if grace is 0)"""
+        if not self.process or self.process.returncode is not None:
+            return
+        if grace <= 0:
+            self.process.kill()
+            await self.process.wait()
+            return
+        self.process.terminate()
+        try:
+            await asyncio.wait_for(self.process.wait(), grace)
+        except asyncio.TimeoutError:
+            logger.warning(f"FFmpeg did not exit within {grace}s of SIGTERM, killing it")
+            self.process.kill()
+            await self.process.wait()
+
+    def cleanup_outputs(self):
+        """Remove what a stopped run wrote: the output files, or the
+        playlists and segments of a segmented output. Parts finished by
+        earlier, preempted runs are left alone."""
+        paths = set(self.output_paths())
+        if self.resume_parts:
+            # The final file is only written once the parts are joined
+            paths = {self.encode_path}
+        for path in paths:
+            if self.output_format in SEGMENTED_FORMATS:
+                directory = os.path.dirname(path) or '.'
+                prefix = segment_names(path)['prefix']
+                try:
+                    entries = os.listdir(directory)
+                except FileNotFoundError:
+                    continue
+                for name in entries:
+                    if name.startswith(prefix) and name.endswith(('.m4s', '.mp4', '.tmp')):
+                        self._unlink(os.path.join(directory, name))
+            self._unlink(path)
+
+    @staticmethod
+    def _unlink(path: str):
+        try:
+            os.unlink(path)
+        except FileNotFoundError:
+            pass
+        except OSError as e:
+            logger.warning(f"Could not remove {path}: {e}")
+
+    @property
+    def resumable(self) -> bool:
+        """Whether a stopped encode can continue from where it was stopped.
+
+        Only single-input, single-file outputs: concatenated inputs and
+        rendition ladders would have to be split at the same point, and
+        segmented outputs are already published piece by piece.
+        """
+        return len(self.input_files) == 1 and self.encode_path is not None and self.output_format == 'file' \
+            and not self.stream_copy
+
+    @staticmethod
+    def part_path(path: str, index: int) -> str:
+        """Name of the index-th part of a preempted encode of path"""
+        stem, ext = os.path.splitext(path)
+        return f"{stem}.part{index}{ext}"
+
+    async def preempt(self, timeout: float = 10.0) -> Optional[float]:
+        """Stop ffmpeg so the output written so far stays playable.
+
+        SIGINT makes ffmpeg finish the file it is writing (trailer, index)
+        before exiting. Returns the source offset the next part should start
+        at, or None if nothing usable was written.
+        """
+        self.cancelled = True
+        self.preempted = True
+        if not self.process or self.process.returncode is not None:
+            return None
+        self.process.send_signal(signal.SIGINT)
+        try:
+            await asyncio.wait_for(self.process.wait(), timeout)
+        except asyncio.TimeoutError:
+            logger.warning(f"FFmpeg did not stop within {timeout}s, killing it")
+            self.process.kill()
             await self.process.wait()
+            return None
+
+        if not self.resumable or not os.path.exists(self.encode_path):
+            return None
+        # The finished file can hold more than the last progress report
+        written = await self._probe_duration(self.encode_path) or self.out_time
+        if written <= 0:
+            return None
+        return self.offset + written
+
+    async def _join_parts(self):
+        """Concatenate the parts of a resumed encode into the output (stream copy)"""
+        output_path = self.output_settings['path']
+        list_path = os.path.join(os.path.dirname(self.encode_path), f".{self.task_id}.concat")
+        with open(list_path, 'w') as f:
+            for part in self.resume_parts + [self.encode_path]:
+                escaped = part.replace("'", "'\\''")
+                f.write(f"file '{escaped}'\n")
+        cmd = [
+            'ffmpeg', '-y', '-v', 'error',
+            '-f', 'concat', '-safe', '0', '-i', list_path,
+            '-map', '0', '-c', 'copy', output_path
+        ]
+        try:
+            process = await self._spawn(
+                cmd,
+                stdout=asyncio.subprocess.DEVNULL,
+                stderr=asyncio.subprocess.PIPE
+            )
+            _, stderr = await process.communicate()
+        finally:
+            os.unlink(list_path)
+        if process.returncode != 0:
+            raise RuntimeError(f"Joining resumed parts failed: {stderr.decode('utf-8', errors='ignore')[-500:]}")
+        os.unlink(self.encode_path)
 
     def _detect_stream_type(self, file_path: str) -> dict:
         """Detect if file has video and/or audio streams"""
@@ -131,21 +329,30 @@ class TranscodeTask:
                 audio_files.append((i, input_file))
 
         # Add input files
-        for input_file in self.input_files:
+        for index, input_file in enumerate(self.input_files):
+            start, duration = self._input_window(index)
+            if start:
+                # Input seeking jumps to the keyframe before start, then
+                # decodes up to it: frame-accurate when re-encoding
+                cmd.extend(['-ss', f"{start:.6f}"])
+            if duration is not None:
+                cmd.extend(['-t', f"{duration:.6f}"])
             cmd.extend(['-i', input_file])
 
+        # Sources to map: input stream specifiers ("0:v") or filter labels ("[outv]")
+        filter_parts = []
+        video_source = None
+        audio_sources = []
+
         # Handle multiple inputs
         if len(self.input_files) > 1:
-            filter_parts = []
-            map_commands = []
-
             if len(video_files) > 1:
                 # Normalize and concatenate video files
                 # First, scale and format all videos to be compatible
                 normalized_videos = []
                 normalized_audios = []
 
-                target_resolution = self.output_settings.get('resolution', '1920x1080')
+                target_resolution = self._concat_resolution()
 
                 for i, (idx, _) in enumerate(video_files):
                     # Normalize each video stream to same format
@@ -169,95 +376,339 @@ class TranscodeTask:
                 # Concatenate normalized video streams
                 video_concat = ''.join(normalized_videos)
                 filter_parts.append(f"{video_concat}concat=n={len(video_files)}:v=1:a=0[outv]")
+                video_source = '[outv]'
 
                 # Concatenate audio streams if any
                 if normalized_audios:
                     audio_concat = ''.join(normalized_audios)
                     filter_parts.append(f"{audio_concat}concat=n={len(normalized_audios)}:v=0:a=1[outa_main]")
-                    map_commands.extend(['-map', '[outa_main]'])
-
-                map_commands.insert(0, '[outv]')
-                map_commands.insert(0, '-map')
+                    audio_sources.append('[outa_main]')
             elif len(video_files) == 1:
                 # Single video file, just map it
                 idx, _ = video_files[0]
-                map_commands.extend(['-map', f'{idx}:v'])
+                video_source = f'{idx}:v'
                 if stream_info[idx]['audio']:
-                    map_commands.extend(['-map', f'{idx}:a'])
+                    audio_sources.append(f'{idx}:a')
 
             # Add additional audio files as separate tracks
             for idx, audio_file in audio_files:
-                map_commands.extend(['-map', f'{idx}:a'])
-
-            if filter_parts:
-                cmd.extend(['-filter_complex', ';'.join(filter_parts)])
-
-            cmd.extend(map_commands)
+                audio_sources.append(f'{idx}:a')
         else:
             # Single input, just process normally
             if stream_info[0]['video']:
-                cmd.extend(['-map', '0:v'])
+                video_source = '0:v'
             if stream_info[0]['audio']:
-                cmd.extend(['-map', '0:a'])
-
-        # Add output settings
-        codec = self.output_settings.get('codec', 'h264')
-        resolution = self.output_settings.get('resolution')
+                audio_sources.append('0:a')
 
-        # Video codec
-        if codec == 'h264':
-            cmd.extend(['-c:v', 'libx264', '-preset', 'medium'])
-        elif codec == 'h265':
-            cmd.extend(['-c:v', 'libx265', '-preset', 'medium'])
-        elif codec == 'vp9':
-            cmd.extend(['-c:v', 'libvpx-vp9'])
-
-        # Resolution - only apply if not using filter complex (filters already handle it)
-        if resolution and len(self.input_files) == 1:
-            cmd.extend(['-s', resolution])
+        renditions = self.output_settings.get('renditions')
+        if renditions:
+            outputs = self._rendition_outputs(renditions, video_source, audio_sources, filter_parts)
+        else:
+            outputs = self._single_output(video_source, audio_sources)
 
-        # Audio codec (AAC for MVP)
-        cmd.extend(['-c:a', 'aac'])
+        if filter_parts:
+            cmd.extend(['-filter_complex', ';'.join(filter_parts)])
 
         # Progress stats
         cmd.extend(['-progress', 'pipe:1', '-stats'])
 
+        cmd.extend(outputs)
+        return cmd
+
+    def _single_output(self, video_source: Optional[str], audio_sources: List[str]) -> List[str]:
+        """Output options for the classic one-task-one-file mode"""
+        args = []
+        if video_source:
+            args.extend(['-map', video_source])
+        for source in audio_sources:
+            args.extend(['-map', source])
+
+        if self.stream_copy:
+            args.extend(['-c:v', 'copy', '-c:a', 'copy' if self.copy_audio else 'aac'])
+            # Copied packets keep their timestamps, start the output at zero
+            args.extend(['-avoid_negative_ts', 'make_zero'])
+        else:
+            # Add output settings
+            codec = self.output_settings.get('codec', 'h264')
+            resolution = self.output_settings.get('resolution')
+
+            args.extend(self._video_codec_args(codec))
+            if None in self.crf:
+                args.extend(crf_args(codec, self.crf[None]))
+
+            # Resolution - only apply if not using filter complex (filters already handle it)
+            if resolution and len(self.input_files) == 1:
+                args.extend(['-s', resolution])
+
+            # Audio codec (AAC for MVP)
+            args.extend(['-c:a', 'aac'])
+
         # Output file
-        cmd.append(self.output_settings['path'])
+        args.extend(self._format_args(self.encode_path))
+        args.append(self.encode_path)
+        return args
 
-        return cmd
+    def _rendition_outputs(
+        self,
+        renditions: List[Dict],
+        video_source: Optional[str],
+        audio_sources: List[str],
+        filter_parts: List[str]
+    ) -> List[str]:
+        """Decode once, split the video into one scaled branch per rendition"""
+        count = len(renditions)
+        default_codec = self.output_settings.get('codec', 'h264')
+
+        video_labels = [None] * count
+        if video_source:
+            source_label = video_source if video_source.startswith('[') else f'[{video_source}]'
+            split_labels = [f'[split{i}]' for i in range(count)]
+            filter_parts.append(f"{source_label}split={count}{''.join(split_labels)}")
+            for i, rendition in enumerate(renditions):
+                resolution = rendition.get('resolution')
+                if resolution:
+                    width, height = resolution.split('x')
+                    filter_parts.append(f"{split_labels[i]}scale=w={width}:h={height}[r{i}]")
+                    video_labels[i] = f'[r{i}]'
+                else:
+                    video_labels[i] = split_labels[i]
+
+        # Filter outputs can only be mapped once, so filtered audio is split too;
+        # plain input streams can be mapped into every output directly
+        audio_per_output = [[] for _ in range(count)]
+        for a, source in enumerate(audio_sources):
+            if source.startswith('['):
+                labels = [f'[a{a}_{i}]' for i in range(count)]
+                filter_parts.append(f"{source}asplit={count}{''.join(labels)}")
+                for i in range(count):
+                    audio_per_output[i].append(labels[i])
+            else:
+                for i in range(count):
+                    audio_per_output[i].append(source)
+
+        args = []
+        for i, rendition in enumerate(renditions):
+            if video_labels[i]:
+                args.extend(['-map', video_labels[i]])
+            for source in audio_per_output[i]:
+                args.extend(['-map', source])
+
+            codec = rendition.get('codec', default_codec)
+            args.extend(self._video_codec_args(codec))
+            if i in self.crf:
+                args.extend(crf_args(codec, self.crf[i]))
+            if rendition.get('bitrate'):
+                args.extend(['-b:v', str(rendition['bitrate'])])
+            args.extend(['-c:a', 'aac'])
+            if rendition.get('audio_bitrate'):
+                args.extend(['-b:a', str(rendition['audio_bitrate'])])
+
+            args.extend(self._format_args(rendition['path']))
+            args.append(rendition['path'])
+        return args
+
+    @property
+    def output_format(self) -> str:
+        return self.output_settings.get('format', 'file')
+
+    def _format_args(self, path: str) -> List[str]:
+        """Muxer options for segmented (HLS/DASH) outputs"""
+        if self.output_format not in SEGMENTED_FORMATS:
+            return []
+        segment_duration = self.output_settings.get('segment_duration', 4)
+        return segmented_output_args(self.output_format, path, segment_duration)
+
+    def _segment_watchers(self) -> List[SegmentWatcher]:
+        if self.output_format not in SEGMENTED_FORMATS:
+            return []
+        renditions = self.output_settings.get('renditions')
+        if renditions:
+            return [
+                SegmentWatcher(rendition['path'], self.output_format, self.rendition_name(rendition, i))
+                for i, rendition in enumerate(renditions)
+            ]
+        return [SegmentWatcher(self.output_settings['path'], self.output_format)]
+
+    def _input_window(self, index: int) -> Tuple[float, Optional[float]]:
+        """Where to start reading an input and for how long (None = to the end);
+        a resumed encode starts further in by its offset"""
+        start, end = self.input_ranges[index]
+        start += self.offset
+        return start, (max(end - start, 0.0) if end is not None else None)
+
+    async def _plan_stream_copy(self):
+        """Cut a trimmed single input by stream copy when nothing needs re-encoding.
+
+        That is when the trim starts on (or just after) a keyframe and the
+        source already has the requested codec and resolution, and no CRF is
+        requested. The cut
+        starts at the keyframe itself, copied packets can't start mid-GOP.
+        """
+        start, end = self.input_ranges[0]
+        if not self.keyframes or len(self.input_files) != 1 or (not start and end is None) \
+                or self.output_settings.get('renditions') or self.output_format != 'file' \
+                or not self.output_settings.get('stream_copy', True) or self.offset:
+            return
+        if self.output_settings.get('crf') is not None:
+            # Copied packets keep the source's quality, not the requested one
+            logger.info(f"Task {self.task_id}: re-encoding the trim to apply the requested CRF")
+            return
+        index = await self.keyframes.get(self.input_files[0])
+        if not index or index.codec != self.output_settings.get('codec', 'h264'):
+            return
+        resolution = self.output_settings.get('resolution')
+        if resolution and resolution != index.resolution:
+            return
+        keyframe = await self.keyframes.keyframe_before(self.input_files[0], start) if start else 0.0
+        if keyframe is None or start - keyframe > KEYFRAME_TOLERANCE:
+            return
+        self.stream_copy = True
+        self.copy_audio = index.audio_codec in (None, 'aac')
+        self.input_ranges[0] = (keyframe, end)
+        logger.info(f"Task {self.task_id}: cutting {keyframe:.3f}-{end if end is not None else 'end'} by stream copy")
+
+    async def _plan_crf(self):
+        """CRF of each re-encoded output without a bitrate: the one the task
+        gives, or with "crf": "auto" the one per-title analysis picks"""
+        if self.stream_copy:
+            return
+        settings = self.output_settings
+        codec = settings.get('codec', 'h264')
+        renditions = settings.get('renditions')
+        if renditions:
+            outputs = [
+                (i, r.get('codec', codec), r.get('resolution'), r.get('crf', settings.get('crf')))
+                for i, r in enumerate(renditions) if not r.get('bitrate')
+            ]
+        else:
+            outputs = [(None, codec, settings.get('resolution'), settings.get('crf'))]
+        for key, output_codec, resolution, crf in outputs:
+            if crf == 'auto':
+                crf = await self._analyze_crf(output_codec, resolution)
+            if crf is not None and not self.cancelled:
+                self.crf[key] = int(crf)
+
+    async def _analyze_crf(self, codec: str, resolution: Optional[str]) -> Optional[int]:
+        if not self.complexity or len(self.input_files) != 1:
+            logger.info(f"Task {self.task_id}: no per-title analysis (needs a single input), using codec defaults")
+            return None
+        # The whole range, also when resuming, so every part gets the same CRF
+        start, end = self.input_ranges[0]
+        if end is None:
+            end = await self._probe_duration(self.input_files[0])
+        choice = await self.complexity.choose_crf(
+            self.input_files[0], codec, self._video_codec_args(codec), start, end,
+            resolution=resolution,
+            metric=self.output_settings.get('quality_metric', 'ssim'),
+            target=self.output_settings.get('quality_target'),
+            spawn=self._spawn_analysis,
+            stopped=lambda: self.cancelled
+        )
+        self.process = None
+        if not choice:
+            return None
+        logger.info(f"Task {self.task_id}: {codec} {resolution or 'source size'} gets {choice.describe()}")
+        return choice.crf
+
+    def _video_codec_args(self, codec: str) -> List[str]:
+        return list(VIDEO_CODEC_ARGS.get(codec, []))
+
+    def _concat_resolution(self) -> str:
+        """Common resolution concatenated inputs are normalized to"""
+        renditions = self.output_settings.get('renditions')
+        if renditions:
+            # Normalize to the largest rendition, the split branches scale down from there
+            sizes = [r['resolution'] for r in renditions if r.get('resolution')]
+            if sizes:
+                return max(sizes, key=lambda size: int(size.split('x')[0]) * int(size.split('x')[1]))
+        return self.output_settings.get('resolution', '1920x1080')
+
+    def output_paths(self) -> List[str]:
+        """Every file this task writes"""
+        renditions = self.output_settings.get('renditions')
+        if renditions:
+            return [r['path'] for r in renditions]
+        return [self.output_settings['path']]
+
+    def rendition_progress(self, progress: float) -> Optional[Dict[str, Dict]]:
+        """Per-rendition progress; all renditions advance together in one process"""
+        renditions = self.output_settings.get('renditions')
+        if not renditions:
+            return None
+        result = {}
+        for i, rendition in enumerate(renditions):
+            try:
+                size = os.path.getsize(rendition['path'])
+            except OSError:
+                size = 0
+            result[self.rendition_name(rendition, i)] = {
+                "progress": progress,
+                "bytes_written": size
+            }
+        return result
+
+    @staticmethod
+    def rendition_name(rendition: Dict, index: int) -> str:
+        return rendition.get('name') or rendition.get('resolution') or f"rendition{index}"
 
     async def _get_total_duration(self) -> float:
-        """Get total duration of all input files"""
+        """Get total duration of all input files, as trimmed"""
         total = 0.0
-        for input_file in self.input_files:
-            cmd = [
-                'ffprobe',
-                '-v', 'error',
-                '-show_entries', 'format=duration',
-                '-of', 'default=noprint_wrappers=1:nokey=1',
-                input_file
-            ]
+        for input_file, (start, end) in zip(self.input_files, self.input_ranges):
+            if end is None:
+                end = await self._probe_duration(input_file)
+            total += max(end - start, 0.0)
+        return total if total > 0 else 1.0  # Avoid division by zero
 
-            try:
-                result = subprocess.run(cmd, capture_output=True, text=True, check=True)
-                duration = float(result.stdout.strip())
-                total += duration
-            except Exception as e:
-                logger.warning(f"Could not get duration for {input_file}: {e}")
+    async def _probe_duration(self, path: str) -> float:
+        """Container duration of a media file, 0 if it cannot be read"""
+        cmd = [
+            'ffprobe',
+            '-v', 'error',
+            '-show_entries', 'format=duration',
+            '-of', 'default=noprint_wrappers=1:nokey=1',
+            path
+        ]
 
-        return total if total > 0 else 1.0  # Avoid division by zero
+        try:
+            result = subprocess.run(cmd, capture_output=True, text=True, check=True)
+            return float(result.stdout.strip())
+        except Exception as e:
+            logger.warning(f"Could not get duration for {path}: {e}")
+            return 0.0
+
+    async def _spawn(self, cmd: List[str], **kwargs) -> asyncio.subprocess.Process:
+        """Start an ffmpeg process in the task's slot"""
+        if not self.slot:
+            return await asyncio.create_subprocess_exec(*cmd, **kwargs)
+        process = await asyncio.create_subprocess_exec(*self.slot.command(cmd), **kwargs)
+        self.slot.attach(process.pid)
+        return process
+
+    async def _spawn_analysis(self, cmd: List[str], **kwargs) -> asyncio.subprocess.Process:
+        """Start an analysis encode as the task's process, so cancel() and
+        preempt() stop it like the encode itself"""
+        self.process = await self._spawn(cmd, **kwargs)
+        if self.cancelled:
+            # Cancelled while the process was starting
+            await self._stop(grace=0)
+        return self.process
 
     async def _run_ffmpeg(self, cmd: List[str]):
         """Run ffmpeg and monitor progress"""
-        self.process = await asyncio.create_subprocess_exec(
-            *cmd,
+        self.process = await self._spawn(
+            cmd,
             stdout=asyncio.subprocess.PIPE,
             stderr=asyncio.subprocess.PIPE
         )
+        if self.cancelled:
+            # Cancelled while the process was starting
+            await self._stop()
 
         last_progress = 0
         progress_pattern = re.compile(r'out_time_ms=(\d+)')
+        fps_pattern = re.compile(r'^fps=([\d.]+)')
+        speed_pattern = re.compile(r'^speed=\s*([\d.]+)x')
 
         async def read_progress():
             nonlocal last_progress
@@ -267,24 +718,89 @@ class TranscodeTask:
 
                 line_str = line.decode('utf-8', errors='ignore')
 
+                fps_match = fps_pattern.match(line_str)
+                if fps_match:
+                    self.fps = float(fps_match.group(1))
+                    continue
+
+                speed_match = speed_pattern.match(line_str)
+                if speed_match:
+                    self.speed = float(speed_match.group(1))
+                    continue
+
                 # Parse progress from ffmpeg stats
                 match = progress_pattern.search(line_str)
                 if match:
                     time_ms = int(match.group(1))
-                    time_seconds = time_ms / 1_000_000
+                    self.out_time = time_ms / 1_000_000
+                    # Progress of the whole source, earlier parts included
+                    time_seconds = self.offset + self.out_time
 
                     if self.total_duration > 0:
                         progress = min((time_seconds / self.total_duration) * 100, 99.9)
                         # Only send update if progress changed significantly
                         if progress - last_progress >= 1.0:
-                            await self.progress_callback(self.task_id, progress)
+                            await self.progress_callback(self.task_id, progress, self.rendition_progress(progress))
                             last_progress = progress
 
         async def read_stderr():
-            async for line in self.process.stderr:
-                line_str = line.decode('utf-8', errors='ignore')
-                if 'error' in line_str.lower():
-                    logger.error(f"FFmpeg error: {line_str}")
+            # -stats rewrites its line with carriage returns; split on both
+            buffer = b''
+            while True:
+                chunk = await self.process.stderr.read(4096)
+                if not chunk:
+                    break
+                buffer += chunk
+                *lines, buffer = re.split(rb'[\r\n]', buffer)
+                for line in lines:
+                    line_str = line.decode('utf-8', errors='ignore')
+                    if line_str.startswith('frame='):
+                        continue
+                    self.stderr_tail.append(line_str)
+                    if 'error' in line_str.lower():
+                        logger.error(f"FFmpeg error: {line_str}")
+            if buffer:
+                self.stderr_tail.append(buffer.decode('utf-8', errors='ignore'))
+
+        watchers = self._segment_watchers() if self.segment_callback else []
+
+        async def report_segments(final: bool = False):
+            segments = []
+            for watcher in watchers:
+                segments.extend(watcher.poll(final))
+            if segments:
+                await self.segment_callback(self.task_id, segments)
+
+        async def watch_segments():
+            while True:
+                await asyncio.sleep(1)
+                await report_segments()
+
+        watch_task = asyncio.create_task(watch_segments()) if watchers else None
+
+        async def watchdog():
+            """Stop ffmpeg once the run exceeds its time limit or stops advancing"""
+            last_out_time = self.out_time
+            last_advance = time.monotonic()
+            while True:
+                await asyncio.sleep(1)
+                now = time.monotonic()
+                if self.out_time != last_out_time:
+                    last_out_time = self.out_time
+                    last_advance = now
+                if self.timeout and now - self.started_at >= self.timeout:
+                    self.timed_out = "timeout"
+                elif self.stall_timeout and now - last_advance >= self.stall_timeout:
+                    self.timed_out = "stalled"
+                else:
+                    continue
+                logger.warning(f"Task {self.task_id} {self.timed_out}, stopping ffmpeg")
+                await self._stop()
+                return
+
+        if self.started_at is None:
+            self.started_at = time.monotonic()
+        watchdog_task = asyncio.create_task(watchdog()) if self.timeout or self.stall_timeout else None
 
         # Read both stdout and stderr concurrently
         await asyncio.gather(
@@ -295,6 +811,28 @@ class TranscodeTask:
 
         # Wait for process to complete
         return_code = await self.process.wait()
+        self.fps = 0.0
+        if watchdog_task and not watchdog_task.done():
+            watchdog_task.cancel()
+
+        if watch_task:
+            watch_task.cancel()
+            if return_code == 0 and not self.cancelled:
+                # Everything left on disk is complete now
+                await report_segments(final=True)
+
+        if self.timed_out == "timeout":
+            raise TranscodeError(
+                f"Timed out after {self.timeout:g}s", PERMANENT, "timeout", return_code, self.stderr_tail
+            )
+        if self.timed_out == "stalled":
+            raise TranscodeError(
+                f"No progress for {self.stall_timeout:g}s", TRANSIENT, "stalled", return_code, self.stderr_tail
+            )
 
         if return_code != 0 and not self.cancelled:
-            raise RuntimeError(f"FFmpeg failed with return code {return_code}")
\ No newline at end of file
+            kind, reason, line = classify_exit(return_code, self.stderr_tail)
+            message = f"FFmpeg failed with return code {return_code} ({reason})"
+            if line:
+                message += f": {line}"
+            raise TranscodeError(message, kind, reason, return_code, self.stderr_tail)
\ No newline at end of file
@@ -1,3 +1,4 @@
 from .client import WebSocketClient
+from .outbox import Outbox
 
-__all__ = ['WebSocketClient']
\ No newline at end of file
+__all__ = ['WebSocketClient', 'Outbox']
\ No newline at end of file
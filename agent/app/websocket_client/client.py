@@ -1,21 +1,50 @@
 import asyncio
-import json
 import logging
 import websockets
-from typing import Optional, Callable
+from typing import Optional, Callable, List
 from datetime import datetime
 
+from app.websocket_client.codec import JSON, supported_encodings, encode_message, decode_message
+from app.websocket_client.outbox import Outbox
+
 logger = logging.getLogger(__name__)
 
 class WebSocketClient:
-    def __init__(self, url: str, agent_id: str, on_task_received: Callable):
+    def __init__(
+        self,
+        url: str,
+        agent_id: str,
+        on_task_received: Callable,
+        batch_interval: float = 1.0,
+        heartbeat_payload: Optional[Callable] = None,
+        heartbeat_interval: float = 30.0,
+        on_cancel: Optional[Callable] = None,
+        outbox: Optional[Outbox] = None,
+        running_tasks: Optional[Callable[[], List[str]]] = None
+    ):
         self.url = url
         self.agent_id = agent_id
         self.on_task_received = on_task_received
+        self.on_cancel = on_cancel
+        # Completions, failures and the like wait here until the orchestrator
+        # confirms them; running_tasks are announced again on every connect
+        self.outbox = outbox
+        self.running_tasks = running_tasks
+        # What the agent advertises on connect; replaced by the discovered capabilities
+        self.capabilities = {
+            "codecs": ["h264", "h265", "vp9"],
+            "formats": ["mp4", "webm", "mkv"]
+        }
+        self.batch_interval = batch_interval
+        self.heartbeat_payload = heartbeat_payload
+        self.heartbeat_interval = heartbeat_interval
         self.websocket = None
+        self.encoding = JSON
         self.running = False
         self.heartbeat_task = None
         self.receive_task = None
+        self.flush_task = None
+        self.pending_updates = []
 
     async def connect(self):
         """Connect to orchestrator with automatic reconnection"""
@@ -27,29 +56,47 @@ class WebSocketClient:
                 logger.info(f"Connecting to orchestrator at {self.url}")
                 self.websocket = await websockets.connect(self.url)
 
+                # Everything is JSON until the orchestrator acknowledges an encoding
+                self.encoding = JSON
+                running = self.running_tasks() if self.running_tasks else []
+
                 # Send connect message
-                await self.send_message({
+                await self._send({
                     "type": "connect",
                     "agent_id": self.agent_id,
                     "data": {
-                        "capabilities": {
-                            "codecs": ["h264", "h265", "vp9"],
-                            "formats": ["mp4", "webm", "mkv"]
-                        }
+                        "capabilities": self.capabilities,
+                        "encodings": supported_encodings(),
+                        "outbox": self.outbox.id if self.outbox is not None else None,
+                        "tasks": running
                     }
                 })
+                backoff = 1
+                await self._resume(running)
 
-                # Start heartbeat and message receiver
+                # Start heartbeat, batch flusher and message receiver
                 self.heartbeat_task = asyncio.create_task(self._heartbeat_loop())
                 self.receive_task = asyncio.create_task(self._receive_loop())
+                self.flush_task = asyncio.create_task(self._flush_loop())
 
-                # Wait for tasks to complete (they won't unless disconnected)
-                await asyncio.gather(self.heartbeat_task, self.receive_task)
+                # Runs until the connection is lost
+                await self.receive_task
 
             except websockets.exceptions.WebSocketException as e:
                 logger.error(f"WebSocket error: {e}")
             except Exception as e:
                 logger.error(f"Connection error: {e}")
+            finally:
+                # Encodes carry on, their messages wait for the next connection
+                websocket, self.websocket = self.websocket, None
+                for task in (self.heartbeat_task, self.flush_task):
+                    if task:
+                        task.cancel()
+                if websocket:
+                    try:
+                        await websocket.close()
+                    except Exception:
+                        pass
 
             if self.running:
                 logger.info(f"Reconnecting in {backoff} seconds...")
@@ -64,49 +111,156 @@ class WebSocketClient:
             self.heartbeat_task.cancel()
         if self.receive_task:
             self.receive_task.cancel()
+        if self.flush_task:
+            self.flush_task.cancel()
 
         if self.websocket:
             await self.websocket.close()
 
-    async def send_message(self, message: dict):
-        """Send a message to orchestrator"""
-        if self.websocket:
-            try:
-                await self.websocket.send(json.dumps(message))
-            except Exception as e:
-                logger.error(f"Error sending message: {e}")
-                raise
+    async def _send(self, message: dict):
+        await self.websocket.send(encode_message(message, self.encoding))
 
-    async def send_progress(self, task_id: str, progress: float):
-        """Send progress update"""
-        await self.send_message({
-            "type": "progress",
-            "agent_id": self.agent_id,
+    async def send_message(self, message: dict) -> bool:
+        """Send a message to orchestrator; False if it could not be sent"""
+        if not self.websocket:
+            return False
+        try:
+            await self._send(message)
+            return True
+        except Exception as e:
+            logger.warning(f"Error sending {message.get('type')} message: {e}")
+            return False
+
+    async def send_state(self, message: dict):
+        """Send a message that must not be lost, through the outbox.
+
+        Progress of the task still queued is dropped, the state supersedes it.
+        """
+        task_id = message.get("task_id")
+        self.pending_updates = [
+            update for update in self.pending_updates
+            if update["type"] != "progress" or update["task_id"] != task_id
+        ]
+        if self.outbox is not None:
+            message = self.outbox.add(message)
+        if not await self.send_message(message) and self.outbox is not None:
+            logger.info(f"Orchestrator unreachable, {message['type']} of task {task_id} waits in the outbox")
+
+    async def _resume(self, running: List[str]):
+        """Replay unconfirmed state messages, then announce the tasks still running"""
+        pending = self.outbox.pending() if self.outbox is not None else []
+        if pending:
+            logger.info(f"Replaying {len(pending)} unconfirmed messages")
+        for message in pending:
+            await self._send(message)
+        for task_id in running:
+            await self._send({
+                "type": "reconnect",
+                "agent_id": self.agent_id,
+                "task_id": task_id,
+                "data": {"status": "running"}
+            })
+
+    async def queue_update(self, task_id: str, message_type: str, data: dict):
+        """Queue a progress/metric update to be sent in the next batch"""
+        if message_type == "progress":
+            # Only the latest progress of a task matters, also while disconnected
+            self.pending_updates = [
+                update for update in self.pending_updates
+                if update["type"] != "progress" or update["task_id"] != task_id
+            ]
+        self.pending_updates.append({
+            "type": message_type,
             "task_id": task_id,
-            "data": {"progress": progress}
+            "data": data
         })
+        if self.batch_interval <= 0:
+            await self.flush_updates()
 
-    async def send_complete(self, task_id: str):
-        """Send task completion"""
-        await self.send_message({
+    async def flush_updates(self):
+        """Send all queued updates, as a single batch frame when there are several"""
+        if not self.pending_updates or not self.websocket:
+            return
+
+        updates, self.pending_updates = self.pending_updates, []
+        if len(updates) == 1:
+            message = dict(updates[0], agent_id=self.agent_id)
+        else:
+            message = {
+                "type": "batch",
+                "agent_id": self.agent_id,
+                "data": {"messages": updates}
+            }
+        if not await self.send_message(message):
+            # Sent once the agent is connected again
+            self.pending_updates[:0] = updates
+
+    async def send_progress(
+        self,
+        task_id: str,
+        progress: float,
+        renditions: Optional[dict] = None,
+        speed: Optional[float] = None
+    ):
+        """Queue progress update"""
+        data = {"progress": progress}
+        if renditions:
+            data["renditions"] = renditions
+        if speed:
+            data["speed"] = speed
+        await self.queue_update(task_id, "progress", data)
+
+    async def send_segments(self, task_id: str, segments: list):
+        """Queue a report of finished output segments"""
+        await self.queue_update(task_id, "segment", {"segments": segments})
+
+    async def send_complete(self, task_id: str, timings: Optional[dict] = None):
+        """Send task completion, with the staging I/O timings if any"""
+        # Queued progress must reach the orchestrator before the final state
+        await self.flush_updates()
+        await self.send_state({
             "type": "complete",
             "agent_id": self.agent_id,
             "task_id": task_id,
-            "data": {}
+            "data": {"timings": timings} if timings else {}
         })
 
-    async def send_failed(self, task_id: str, error: str):
-        """Send task failure"""
-        await self.send_message({
+    async def send_failed(self, task_id: str, error: str, failure: Optional[dict] = None):
+        """Send task failure, with its classification and stderr tail if known"""
+        await self.flush_updates()
+        data = {"error": error}
+        if failure:
+            data["failure"] = failure
+        await self.send_state({
             "type": "failed",
             "agent_id": self.agent_id,
             "task_id": task_id,
-            "data": {"error": error}
+            "data": data
+        })
+
+    async def send_preempted(self, task_id: str, resume: Optional[dict] = None):
+        """Report a task stopped for higher-priority work, with where to resume it"""
+        await self.flush_updates()
+        await self.send_state({
+            "type": "preempted",
+            "agent_id": self.agent_id,
+            "task_id": task_id,
+            "data": {"resume": resume} if resume else {}
+        })
+
+    async def send_cancelled(self, task_id: str):
+        """Confirm a cancelled task was stopped and its partial outputs removed"""
+        await self.flush_updates()
+        await self.send_state({
+            "type": "cancelled",
+            "agent_id": self.agent_id,
+            "task_id": task_id,
+            "data": {}
         })
 
     async def report_crashed_task(self, crashed_task: dict):
         """Report a task that was running when agent crashed"""
-        await self.send_message({
+        await self.send_state({
             "type": "reconnect",
             "agent_id": self.agent_id,
             "task_id": crashed_task['task_id'],
@@ -120,39 +274,71 @@ class WebSocketClient:
         """Send periodic heartbeats to orchestrator"""
         while self.running:
             try:
-                await self.send_message({
-                    "type": "heartbeat",
-                    "agent_id": self.agent_id
-                })
-                await asyncio.sleep(30)  # Heartbeat every 30 seconds
+                await self.send_heartbeat()
+                await asyncio.sleep(self.heartbeat_interval)
             except Exception as e:
                 logger.error(f"Heartbeat error: {e}")
                 break
 
+    async def send_heartbeat(self):
+        """Send a heartbeat carrying the current host load"""
+        data = {}
+        if self.heartbeat_payload:
+            try:
+                data = await self.heartbeat_payload()
+            except Exception as e:
+                logger.warning(f"Could not collect heartbeat payload: {e}")
+        await self.send_message({
+            "type": "heartbeat",
+            "agent_id": self.agent_id,
+            "data": data
+        })
+
+    async def _flush_loop(self):
+        """Periodically send queued updates as one frame"""
+        if self.batch_interval <= 0:
+            return
+        while self.running:
+            await asyncio.sleep(self.batch_interval)
+            try:
+                await self.flush_updates()
+            except Exception as e:
+                logger.error(f"Batch flush error: {e}")
+                break
+
     async def _receive_loop(self):
         """Receive and handle messages from orchestrator"""
         while self.running:
             try:
                 message = await self.websocket.recv()
-                data = json.loads(message)
+                data = decode_message(message)
+
+                if data['type'] == 'acknowledge':
+                    # Switch to the encoding the orchestrator picked
+                    self.encoding = data.get('encoding') or JSON
+                    logger.info(f"Connected to orchestrator using {self.encoding} encoding")
+
+                elif data['type'] == 'delivered':
+                    # The orchestrator applied every state message up to seq
+                    if self.outbox is not None and data.get('seq') is not None:
+                        self.outbox.confirm(data['seq'])
 
-                if data['type'] == 'assign':
+                elif data['type'] == 'assign':
                     # Handle task assignment
                     task = data['task']
                     logger.info(f"Assigned task: {task['id']}")
                     asyncio.create_task(self.on_task_received(task))
 
                 elif data['type'] == 'cancel':
-                    # Handle task cancellation
-                    logger.info("Task cancellation requested")
-                    # Will be implemented when needed
+                    task_id = (data.get('task') or {}).get('id')
+                    reason = data.get('reason')
+                    logger.info(f"Cancellation requested for task {task_id} ({reason or 'no reason given'})")
+                    if self.on_cancel and task_id:
+                        asyncio.create_task(self.on_cancel(task_id, reason))
 
                 elif data['type'] == 'ping':
                     # Respond to ping
-                    await self.send_message({
-                        "type": "heartbeat",
-                        "agent_id": self.agent_id
-                    })
+                    await self.send_heartbeat()
 
             except websockets.exceptions.ConnectionClosed:
                 logger.warning("Connection closed by orchestrator")
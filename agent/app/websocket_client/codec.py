@@ -0,0 +1,32 @@
+import json
+from typing import Any, Dict, List, Union
+
+try:
+    import msgpack
+except ImportError:  # msgpack is optional, JSON is always available
+    msgpack = None
+
+JSON = "json"
+MSGPACK = "msgpack"
+
+def supported_encodings() -> List[str]:
+    """Encodings offered to the orchestrator, most compact first"""
+    encodings = []
+    if msgpack is not None:
+        encodings.append(MSGPACK)
+    encodings.append(JSON)
+    return encodings
+
+def encode_message(message: Dict[str, Any], encoding: str = JSON) -> Union[str, bytes]:
+    """Encode a message; JSON goes out as a text frame, msgpack as a binary frame"""
+    if encoding == MSGPACK and msgpack is not None:
+        return msgpack.packb(message, use_bin_type=True, default=str)
+    return json.dumps(message, default=str)
+
+def decode_message(frame: Union[str, bytes]) -> Dict[str, Any]:
+    """Decode a frame, using the frame type to tell the encodings apart"""
+    if isinstance(frame, (bytes, bytearray)):
+        if msgpack is None:
+            raise ValueError("Received binary frame but msgpack is not installed")
+        return msgpack.unpackb(frame, raw=False)
+    return json.loads(frame)
@@ -0,0 +1,74 @@
+import json
+import logging
+import os
+import uuid
+from pathlib import Path
+from typing import Dict, List
+
+logger = logging.getLogger(__name__)
+
+class Outbox:
+    """State messages not yet confirmed by the orchestrator, kept on disk.
+
+    Every message gets the next sequence number and is written to ``path``
+    before it is sent, so completions and failures survive both a lost
+    connection and a restart of the agent. The orchestrator confirms what it
+    applied with ``delivered``; the rest is replayed in order on reconnect.
+    ``id`` names the sequence, so the orchestrator starts over when the
+    state directory was wiped instead of taking new messages for replays.
+    """
+
+    def __init__(self, path: Path):
+        self.path = Path(path)
+        self.id = uuid.uuid4().hex
+        self.next_seq = 1
+        self.messages: List[Dict] = []
+        self._load()
+
+    def __len__(self) -> int:
+        return len(self.messages)
+
+    def add(self, message: Dict) -> Dict:
+        """Number message and store it; returns the message to send"""
+        message = dict(message, seq=self.next_seq)
+        self.next_seq += 1
+        self.messages.append(message)
+        self._save()
+        return message
+
+    def confirm(self, seq: int):
+        """Drop every message up to seq, the orchestrator has applied them"""
+        remaining = [message for message in self.messages if message['seq'] > seq]
+        if len(remaining) != len(self.messages):
+            self.messages = remaining
+            self._save()
+
+    def pending(self) -> List[Dict]:
+        return list(self.messages)
+
+    def _load(self):
+        try:
+            with open(self.path) as f:
+                state = json.load(f)
+            self.id = state['id']
+            self.next_seq = state['next_seq']
+            self.messages = state['messages']
+        except FileNotFoundError:
+            self._save()
+        except (OSError, ValueError, KeyError, TypeError) as e:
+            logger.error(f"Unreadable outbox {self.path}, starting a new one: {e}")
+            self._save()
+        if self.messages:
+            logger.info(f"Outbox holds {len(self.messages)} unconfirmed messages")
+
+    def _save(self):
+        tmp_path = self.path.with_suffix('.tmp')
+        try:
+            with open(tmp_path, 'w') as f:
+                json.dump({"id": self.id, "next_seq": self.next_seq, "messages": self.messages}, f)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, self.path)
+        except OSError as e:
+            # Still delivered while the agent keeps running, just not across a restart
+            logger.error(f"Failed to save outbox: {e}")
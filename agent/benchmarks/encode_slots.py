@@ -0,0 +1,98 @@
+"""Benchmark: aggregate fps of concurrent encodes with and without CPU pinning.
+
+Runs ``--slots`` ffmpeg encodes of a synthetic source at the same time,
+first unpinned (every process may run on every CPU), then with each one
+pinned to its own partition of the CPUs by ResourceManager, and reports the
+aggregate frames per second and the spread between the fastest and the
+slowest encode. Each mode runs ``--rounds`` times, alternating.
+
+Run from the agent directory:
+    python benchmarks/encode_slots.py --slots 4
+"""
+import argparse
+import asyncio
+import os
+import statistics
+import sys
+import time
+from typing import List, Optional
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.resources import EncodeSlot, ResourceManager, parse_cpu_list
+from app.transcoder import VIDEO_CODEC_ARGS
+
+async def encode(slot: EncodeSlot, args) -> float:
+    """Run one encode in slot; returns its wall-clock seconds"""
+    cmd = [
+        'ffmpeg', '-v', 'error', '-y',
+        '-f', 'lavfi', '-i', f"testsrc2=size={args.size}:rate=30",
+        '-frames:v', str(args.frames),
+        *VIDEO_CODEC_ARGS[args.codec]
+    ]
+    if args.preset and '-preset' in cmd:
+        cmd[cmd.index('-preset') + 1] = args.preset
+    cmd.extend(['-f', 'null', '-'])
+    started = time.monotonic()
+    process = await asyncio.create_subprocess_exec(
+        *slot.command(cmd),
+        stdout=asyncio.subprocess.DEVNULL,
+        stderr=asyncio.subprocess.PIPE
+    )
+    slot.attach(process.pid)
+    _, stderr = await process.communicate()
+    if process.returncode != 0:
+        raise RuntimeError(stderr.decode('utf-8', errors='ignore')[-500:])
+    return time.monotonic() - started
+
+async def run_round(manager: ResourceManager, args) -> List[float]:
+    slots = [manager.acquire(f"bench-{i}") for i in range(args.slots)]
+    try:
+        return await asyncio.gather(*(encode(slot, args) for slot in slots))
+    finally:
+        for slot in slots:
+            manager.release(slot)
+
+def summary(label: str, rounds: List[List[float]], args) -> Optional[float]:
+    aggregate = [args.slots * args.frames / max(times) for times in rounds]
+    per_encode = [args.frames / t for times in rounds for t in times]
+    fps = statistics.median(aggregate)
+    print(
+        f"{label:<9} aggregate {fps:7.1f} fps  "
+        f"per encode {min(per_encode):6.1f}-{max(per_encode):6.1f} fps  "
+        f"(median of {len(rounds)} rounds)"
+    )
+    return fps
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--slots", type=int, default=max(1, (os.cpu_count() or 1) // 2), help="concurrent encodes")
+    parser.add_argument("--cpus", help="CPUs to use, e.g. 0-7 (default: all)")
+    parser.add_argument("--codec", default="h264", choices=sorted(VIDEO_CODEC_ARGS))
+    parser.add_argument("--preset", default="veryfast")
+    parser.add_argument("--size", default="1280x720")
+    parser.add_argument("--frames", type=int, default=600)
+    parser.add_argument("--rounds", type=int, default=3)
+    args = parser.parse_args()
+
+    cpus = parse_cpu_list(args.cpus) if args.cpus else None
+    # Same priority for every encode, only the placement differs
+    common = dict(cpus=cpus, slots=args.slots, priority_nice={}, ionice=False)
+    unpinned = ResourceManager(pinning=False, **common)
+    pinned = ResourceManager(pinning=True, **common)
+    args.slots = pinned.slots
+    print(f"{args.slots} concurrent {args.codec} encodes of {args.frames} frames at {args.size} on CPUs {pinned.cpus}")
+    for index, partition in enumerate(pinned.partitions):
+        print(f"  slot {index}: CPUs {partition}")
+
+    results = {"unpinned": [], "pinned": []}
+    for _ in range(args.rounds):
+        results["unpinned"].append(await run_round(unpinned, args))
+        results["pinned"].append(await run_round(pinned, args))
+
+    baseline = summary("unpinned", results["unpinned"], args)
+    fps = summary("pinned", results["pinned"], args)
+    print(f"pinning: {100 * (fps / baseline - 1):+.1f}% aggregate fps")
+
+if __name__ == "__main__":
+    asyncio.run(main())
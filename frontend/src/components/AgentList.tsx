@@ -54,6 +54,16 @@ export default function AgentList({ agents }: AgentListProps) {
                       <span className="font-medium">Task:</span> #{agent.current_task_id.slice(0, 8)}
                     </p>
                   )}
+                  {agent.load && agent.load.cpu_percent != null && (
+                    <p className="text-xs">
+                      <span className="font-medium">Load:</span>{' '}
+                      CPU {agent.load.cpu_percent.toFixed(0)}%
+                      {agent.load.load_avg && ` · avg ${agent.load.load_avg[0].toFixed(2)}`}
+                      {agent.load.scratch_free_bytes != null &&
+                        ` · ${(agent.load.scratch_free_bytes / 1024 ** 3).toFixed(1)} GB free`}
+                      {!!agent.load.encode_fps && ` · ${agent.load.encode_fps.toFixed(0)} fps`}
+                    </p>
+                  )}
                   {agent.last_heartbeat && (
                     <p className="text-xs">
                       <span className="font-medium">Last seen:</span>{' '}
@@ -72,6 +82,19 @@ export default function AgentList({ agents }: AgentListProps) {
                       {agent.capabilities.formats && (
                         <p>Formats: {agent.capabilities.formats.join(', ')}</p>
                       )}
+                      {agent.capabilities.ffmpeg_version && (
+                        <p>ffmpeg {agent.capabilities.ffmpeg_version}</p>
+                      )}
+                      {agent.capabilities.calibration && Object.keys(agent.capabilities.calibration).length > 0 && (
+                        <p>
+                          Speed: {Object.entries(agent.capabilities.calibration)
+                            .map(([codec, result]: [string, any]) => `${codec} ${result.speed.toFixed(2)}x`)
+                            .join(', ')}
+                        </p>
+                      )}
+                      {agent.capabilities.missing_filters && agent.capabilities.missing_filters.length > 0 && (
+                        <p className="text-red-600">Missing filters: {agent.capabilities.missing_filters.join(', ')}</p>
+                      )}
                     </div>
                   </div>
                 )}
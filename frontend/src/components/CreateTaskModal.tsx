@@ -8,6 +8,7 @@ interface CreateTaskModalProps {
 
 export default function CreateTaskModal({ onClose }: CreateTaskModalProps) {
   const [priority, setPriority] = useState<TaskPriority>(TaskPriority.MEDIUM)
+  const [queue, setQueue] = useState('default')
   const [inputFiles, setInputFiles] = useState([
     { storage: 'shared', path: '' }
   ])
@@ -26,6 +27,7 @@ export default function CreateTaskModal({ onClose }: CreateTaskModalProps) {
     try {
       await taskService.createTask({
         priority,
+        queue: queue || 'default',
         input_files: inputFiles.filter(f => f.path),
         output_settings: outputSettings,
       })
@@ -73,6 +75,20 @@ export default function CreateTaskModal({ onClose }: CreateTaskModalProps) {
             </select>
           </div>
 
+          <div>
+            <label className="block text-sm font-medium text-gray-700 mb-1">
+              Queue
+            </label>
+            <input
+              type="text"
+              value={queue}
+              onChange={(e) => setQueue(e.target.value)}
+              placeholder="default"
+              maxLength={64}
+              className="w-full px-3 py-2 border rounded-lg"
+            />
+          </div>
+
           <div>
             <label className="block text-sm font-medium text-gray-700 mb-1">
               Input Files
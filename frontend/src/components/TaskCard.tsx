@@ -71,14 +71,26 @@ export default function TaskCard({ task, getStatusBadge, getPriorityBadge }: Tas
 
       <div className="text-sm text-gray-600 space-y-1">
         <p>
-          <span className="font-medium">Input:</span> {task.input_files.map(f => f.path).join(', ')}
+          <span className="font-medium">Input:</span> {task.input_files
+            .map(f => f.start != null || f.end != null ? `${f.path} [${f.start ?? 0}s-${f.end != null ? `${f.end}s` : 'end'}]` : f.path)
+            .join(', ')}
         </p>
         <p>
-          <span className="font-medium">Output:</span> {task.output_settings.path}
+          <span className="font-medium">Output:</span>{' '}
+          {task.output_settings.renditions
+            ? task.output_settings.renditions.map(r => r.path).join(', ')
+            : task.output_settings.path}
         </p>
         {task.agent_id && (
           <p>
             <span className="font-medium">Agent:</span> {task.agent_id}
+            {task.encode_speed != null && ` (${task.encode_speed.toFixed(2)}x)`}
+          </p>
+        )}
+        {task.speculative_agent_id && (
+          <p>
+            <span className="font-medium">Speculative copy:</span> {task.speculative_agent_id}
+            {` (${(task.speculative_progress ?? 0).toFixed(1)}%)`}
           </p>
         )}
       </div>
@@ -94,6 +106,16 @@ export default function TaskCard({ task, getStatusBadge, getPriorityBadge }: Tas
                 <span className="font-medium">Resolution:</span> {task.output_settings.resolution}
               </p>
             )}
+            {task.output_settings.renditions && (
+              <p>
+                <span className="font-medium">Renditions:</span>{' '}
+                {task.output_settings.renditions.map((r, i) => {
+                  const name = r.name || r.resolution || `rendition${i}`
+                  const state = task.rendition_progress?.[name]
+                  return state ? `${name} (${state.progress.toFixed(0)}%)` : name
+                }).join(', ')}
+              </p>
+            )}
             <p>
               <span className="font-medium">Created:</span> {format(new Date(task.created_at), 'PPp')}
             </p>
@@ -110,8 +132,15 @@ export default function TaskCard({ task, getStatusBadge, getPriorityBadge }: Tas
             {task.error_message && (
               <p className="text-red-600">
                 <span className="font-medium">Error:</span> {task.error_message}
+                {task.failure_kind && ` (${task.failure_kind}${task.failure_reason ? `: ${task.failure_reason}` : ''})`}
               </p>
             )}
+            {task.failure_stderr && task.failure_stderr.length > 0 && (
+              <details>
+                <summary className="cursor-pointer font-medium">FFmpeg output</summary>
+                <pre className="mt-1 max-h-48 overflow-auto bg-gray-50 p-2 text-xs">{task.failure_stderr.join('\n')}</pre>
+              </details>
+            )}
           </div>
 
           <div className="mt-3 flex space-x-2">
@@ -8,6 +8,7 @@ interface TaskListProps {
 export default function TaskList({ tasks }: TaskListProps) {
   const getStatusBadge = (status: TaskStatus) => {
     const colors = {
+      [TaskStatus.WAITING]: 'bg-purple-100 text-purple-700',
       [TaskStatus.PENDING]: 'bg-gray-200 text-gray-800',
       [TaskStatus.ASSIGNED]: 'bg-yellow-200 text-yellow-800',
       [TaskStatus.RUNNING]: 'bg-blue-200 text-blue-800',
@@ -1,5 +1,5 @@
 import React, { createContext, useContext, useEffect, useState, useCallback } from 'react'
-import { Task, Agent } from '../types'
+import { Task, Agent, FrontendMessage } from '../types'
 
 interface WebSocketContextType {
   tasks: Map<string, Task>
@@ -25,20 +25,30 @@ export const WebSocketProvider: React.FC<{ children: React.ReactNode }> = ({ chi
     }
 
     websocket.onmessage = (event) => {
-      const data = JSON.parse(event.data)
+      const data: FrontendMessage = JSON.parse(event.data)
 
-      if (data.type === 'task_update') {
+      if (data.type === 'snapshot') {
+        setTasks(new Map(data.tasks.map(task => [task.id, task])))
+        setAgents(new Map(Object.entries(data.agents)))
+      } else if (data.type === 'task') {
+        setTasks(prev => new Map(prev).set(data.task.id, data.task))
+      } else if (data.type === 'task_delta') {
+        // Only changed fields are sent; the rest may come from the REST listing
+        setTasks(prev => new Map(prev).set(data.task_id, { ...prev.get(data.task_id), ...data.changes } as Task))
+      } else if (data.type === 'task_removed') {
         setTasks(prev => {
           const newTasks = new Map(prev)
-          newTasks.set(data.task.id, data.task)
+          newTasks.delete(data.task_id)
           return newTasks
         })
-      } else if (data.type === 'agents_update') {
-        const agentsMap = new Map<string, Agent>()
-        Object.entries(data.agents).forEach(([id, agent]) => {
-          agentsMap.set(id, agent as Agent)
+      } else if (data.type === 'agent_delta') {
+        setAgents(prev => new Map(prev).set(data.agent_id, { ...prev.get(data.agent_id), ...data.changes } as Agent))
+      } else if (data.type === 'agent_removed') {
+        setAgents(prev => {
+          const newAgents = new Map(prev)
+          newAgents.delete(data.agent_id)
+          return newAgents
         })
-        setAgents(agentsMap)
       }
     }
 
@@ -27,7 +27,7 @@ export default function Dashboard() {
     if (initialTasks) {
       const mergedTasks = new Map<string, Task>()
       initialTasks.forEach(task => mergedTasks.set(task.id, task))
-      wsTasks.forEach((task, id) => mergedTasks.set(id, task))
+      wsTasks.forEach((task, id) => mergedTasks.set(id, { ...mergedTasks.get(id), ...task }))
       setTasks(Array.from(mergedTasks.values()).sort((a, b) =>
         new Date(b.created_at).getTime() - new Date(a.created_at).getTime()
       ))
@@ -18,7 +18,8 @@ export const taskService = {
 
   async createTask(data: {
     priority?: string
-    input_files: Array<{ storage: string; path: string }>
+    queue?: string
+    input_files: Array<{ storage: string; path: string; start?: number; end?: number }>
     output_settings: {
       storage: string
       path: string
@@ -1,4 +1,5 @@
 export enum TaskStatus {
+  WAITING = 'WAITING',
   PENDING = 'PENDING',
   ASSIGNED = 'ASSIGNED',
   RUNNING = 'RUNNING',
@@ -23,23 +24,81 @@ export enum AgentStatus {
 export interface Task {
   id: string
   priority: TaskPriority
+  queue: string
   status: TaskStatus
   agent_id?: string
   input_files: Array<{
     storage: string
     path: string
+    start?: number
+    end?: number
   }>
   output_settings: {
     storage: string
-    path: string
+    path?: string
     codec: string
     resolution?: string
+    renditions?: Rendition[]
+    format?: 'file' | 'hls' | 'dash'
+    segment_duration?: number
   }
   progress: number
+  rendition_progress?: Record<string, { progress: number; bytes_written?: number }>
   created_at: string
+  queued_at?: string
   started_at?: string
   completed_at?: string
+  io_timings?: {
+    stage_in_seconds: number
+    encode_seconds: number
+    publish_seconds: number
+    bytes_in: number
+    bytes_out: number
+    cache_hits: number
+  }
+  lease_expires_at?: string
+  requeue_count: number
+  retry_count: number
+  max_retries: number
+  failure_kind?: 'transient' | 'permanent' | 'unknown'
+  failure_reason?: string
+  failure_stderr?: string[]
+  next_attempt_at?: string
+  timeout_seconds: number
+  stall_timeout_seconds: number
+  preempt_count: number
+  resume_state?: { offset: number; parts: string[] }
+  speculative_agent_id?: string
+  speculative_progress?: number
+  encode_speed?: number
+  depends_on: string[]
+  on_dependency_failure: 'fail' | 'wait'
   error_message?: string
+  archived?: boolean
+  archived_at?: string
+}
+
+export interface TaskSegment {
+  id: number
+  task_id: string
+  rendition?: string
+  index: number
+  storage: string
+  path: string
+  duration?: number
+  size_bytes?: number
+  init: boolean
+  created_at: string
+}
+
+export interface Rendition {
+  name?: string
+  storage?: string
+  path: string
+  resolution?: string
+  codec?: string
+  bitrate?: string
+  audio_bitrate?: string
 }
 
 export interface Agent {
@@ -51,4 +110,44 @@ export interface Agent {
   last_heartbeat?: string
   storage_mappings: Record<string, string>
   capabilities: Record<string, any>
-}
\ No newline at end of file
+  load?: AgentLoad
+}
+
+export interface AgentLoad {
+  load_avg?: number[]
+  cpu_count?: number
+  cpu_percent?: number
+  own_cpu_percent?: number
+  external_cpu_percent?: number
+  memory_free_bytes?: number
+  memory_total_bytes?: number
+  scratch_free_bytes?: number
+  active_encodes?: number
+  ffmpeg_processes?: number
+  encode_fps?: number
+}
+export interface FrontendSubscription {
+  statuses: TaskStatus[]
+  agent_ids: string[]
+  task_ids: string[]
+  agents: boolean
+}
+
+// Messages on /ws/frontend: a snapshot, then per-field deltas. `seq` increases
+// by one per message on a connection.
+export type FrontendMessage = { seq: number } & (
+  | {
+      type: 'snapshot'
+      version: number
+      subscription: FrontendSubscription
+      agents: Record<string, Agent>
+      tasks: Task[]
+    }
+  | { type: 'task'; task: Task }
+  | { type: 'task_delta'; task_id: string; changes: Partial<Task> }
+  | { type: 'task_removed'; task_id: string }
+  | { type: 'agent_delta'; agent_id: string; changes: Partial<Agent> }
+  | { type: 'agent_removed'; agent_id: string }
+  | { type: 'segments_ready'; task_id: string; segments: TaskSegment[] }
+  | { type: 'error'; message: string }
+)
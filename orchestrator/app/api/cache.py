@@ -0,0 +1,62 @@
+import hashlib
+import time
+from typing import Any, Callable, Dict, Hashable, Optional
+
+from fastapi import Request, Response
+
+from app.serialization import json_bytes
+
+class CachedBody:
+    def __init__(self, body: bytes):
+        self.body = body
+        # Content hash: a rebuilt but unchanged body keeps its ETag
+        self.etag = '"' + hashlib.sha1(body).hexdigest() + '"'
+        self.built_at = time.monotonic()
+
+class ReadCache:
+    """Pre-serialized JSON bodies for the polled read endpoints.
+
+    Entries are dropped by the same events that are broadcast to the
+    frontend (task updates, agent status), and rebuilt at the latest after
+    ``ttl`` seconds to pick up changes that are never broadcast, such as
+    lease renewals or heartbeat load.
+    """
+
+    def __init__(self, ttl: float = 5.0):
+        self.ttl = ttl
+        self.entries: Dict[Hashable, CachedBody] = {}
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: Hashable, build: Callable[[], Any]) -> CachedBody:
+        entry = self.entries.get(key)
+        if entry and (not self.ttl or time.monotonic() - entry.built_at < self.ttl):
+            self.hits += 1
+            return entry
+        self.misses += 1
+        entry = CachedBody(json_bytes(build()))
+        self.entries[key] = entry
+        return entry
+
+    def invalidate_task(self, task_id: Optional[str] = None):
+        """Drop a task and every task listing it may appear in"""
+        for key in list(self.entries):
+            if key[0] == "tasks" or (key[0] == "task" and (task_id is None or key[1] == task_id)):
+                del self.entries[key]
+
+    def invalidate_agents(self):
+        self.entries.pop(("agents",), None)
+
+    def clear(self):
+        self.entries.clear()
+
+def cached_response(request: Request, entry: CachedBody) -> Response:
+    """The cached body, or 304 if the client already holds it"""
+    headers = {"ETag": entry.etag, "Cache-Control": "no-cache"}
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match:
+        # Weak comparison, as RFC 9110 requires for If-None-Match
+        tags = [tag.strip().removeprefix("W/") for tag in if_none_match.split(",")]
+        if "*" in tags or entry.etag in tags:
+            return Response(status_code=304, headers=headers)
+    return Response(content=entry.body, media_type="application/json", headers=headers)
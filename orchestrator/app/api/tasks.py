@@ -1,30 +1,220 @@
 from fastapi import APIRouter, Depends, HTTPException, Request
 from sqlalchemy.orm import Session
-from typing import List, Optional
+from typing import List, Optional, Tuple
 from pydantic import BaseModel
 from datetime import datetime
+import uuid
 
-from app.database import get_db, TaskOperations
+from app.api.cache import cached_response
+from app import config
+from app.database import get_db, TaskOperations, SegmentOperations, ArchiveOperations, DependencyOperations
 from app.models.task import TaskStatus, TaskPriority
 
 router = APIRouter()
 
 class CreateTaskRequest(BaseModel):
     priority: Optional[TaskPriority] = TaskPriority.MEDIUM
-    input_files: List[dict]  # [{"storage": "shared", "path": "..."}]
-    output_settings: dict  # {"storage": "shared", "path": "...", "codec": "h264", "resolution": "1920x1080"}
+    queue: str = "default"  # submitter/tenant tag agents are shared between
+    # [{"storage": "shared", "path": "..."}], optionally trimmed to seconds of the
+    # source: {"storage": "shared", "path": "...", "start": 3600, "end": 3630}
+    input_files: List[dict]
+    # {"storage": "shared", "path": "...", "codec": "h264", "resolution": "1920x1080"}
+    # or, for a ladder decoded once: {"storage": "shared", "codec": "h264",
+    #   "renditions": [{"name": "720p", "path": "...", "resolution": "1280x720", "bitrate": "3M"}, ...]}
+    # "crf": 23 sets the quality of outputs without a bitrate; "crf": "auto" lets the
+    # agent pick it per title to reach "quality_target" on "quality_metric" ("ssim"/"psnr")
+    output_settings: dict
+    depends_on: List[str] = []  # ids of tasks that must complete first
+    on_dependency_failure: str = "fail"  # "fail" or "wait" for the failed parent to be restarted
+    max_retries: Optional[int] = None  # retries of transient failures, TASK_DEFAULT_MAX_RETRIES if unset
+    # Seconds before the agent gives up on a run (0 = never), TASK_DEFAULT_TIMEOUT if unset
+    timeout_seconds: Optional[float] = None
+    # Seconds without progress before the agent gives up, TASK_DEFAULT_STALL_TIMEOUT if unset
+    stall_timeout_seconds: Optional[float] = None
+
+class GraphTaskRequest(CreateTaskRequest):
+    # Reference other tasks of the same graph use in depends_on
+    key: str
+
+class CreateGraphRequest(BaseModel):
+    tasks: List[GraphTaskRequest]
+
+OUTPUT_FORMATS = ("file", "hls", "dash")
+QUALITY_METRICS = ("ssim", "psnr")
+MAX_CRF = 63
+# Codecs the agents have encoder settings for
+VIDEO_CODECS = ("h264", "h265", "vp9")
+
+def validate_input_files(input_files: List[dict]):
+    for index, input_file in enumerate(input_files):
+        if not isinstance(input_file, dict) or not input_file.get("path"):
+            raise HTTPException(status_code=400, detail=f"input file {index} needs a path")
+        start, end = input_file.get("start"), input_file.get("end")
+        for name, value in (("start", start), ("end", end)):
+            if value is not None and (isinstance(value, bool) or not isinstance(value, (int, float)) or value < 0):
+                raise HTTPException(status_code=400, detail=f"input file {index}: {name} must be a non-negative number of seconds")
+        if end is not None and end <= (start or 0):
+            raise HTTPException(status_code=400, detail=f"input file {index}: end must be after start")
+
+def validate_crf(crf, where: str = "crf"):
+    if crf is None or crf == "auto":
+        return
+    # Encoders take whole CRFs, the agent would truncate a fraction
+    if isinstance(crf, bool) or not isinstance(crf, int) or not 0 <= crf <= MAX_CRF:
+        raise HTTPException(status_code=400, detail=f"{where} must be \"auto\" or an integer from 0 to {MAX_CRF}")
+
+def validate_codec(codec, where: str = "codec"):
+    if codec is not None and codec not in VIDEO_CODECS:
+        raise HTTPException(status_code=400, detail=f"{where} must be one of {', '.join(VIDEO_CODECS)}")
+
+def validate_output_settings(output_settings: dict):
+    output_format = output_settings.get("format", "file")
+    if output_format not in OUTPUT_FORMATS:
+        raise HTTPException(status_code=400, detail=f"format must be one of {', '.join(OUTPUT_FORMATS)}")
+    validate_codec(output_settings.get("codec"))
+    validate_crf(output_settings.get("crf"))
+    if output_settings.get("quality_metric", "ssim") not in QUALITY_METRICS:
+        raise HTTPException(status_code=400, detail=f"quality_metric must be one of {', '.join(QUALITY_METRICS)}")
+    target = output_settings.get("quality_target")
+    if target is not None and (isinstance(target, bool) or not isinstance(target, (int, float)) or target <= 0):
+        raise HTTPException(status_code=400, detail="quality_target must be a positive number")
+
+    renditions = output_settings.get("renditions")
+    if renditions is None:
+        if not output_settings.get("path"):
+            raise HTTPException(status_code=400, detail="output_settings needs a path or a list of renditions")
+        return
+    if not isinstance(renditions, list) or not renditions:
+        raise HTTPException(status_code=400, detail="renditions must be a non-empty list")
+    names = set()
+    for index, rendition in enumerate(renditions):
+        if not isinstance(rendition, dict) or not rendition.get("path"):
+            raise HTTPException(status_code=400, detail=f"rendition {index} needs a path")
+        validate_codec(rendition.get("codec"), f"rendition {index}: codec")
+        validate_crf(rendition.get("crf"), f"rendition {index}: crf")
+        name = rendition.get("name") or rendition.get("resolution") or f"rendition{index}"
+        if name in names:
+            raise HTTPException(status_code=400, detail=f"duplicate rendition name {name}")
+        names.add(name)
+
+DEPENDENCY_FAILURE_POLICIES = ("fail", "wait")
+MAX_QUEUE_NAME_LENGTH = 64
+
+def validate_queue(queue: str):
+    if not queue or len(queue) > MAX_QUEUE_NAME_LENGTH:
+        raise HTTPException(status_code=400, detail=f"queue must be 1 to {MAX_QUEUE_NAME_LENGTH} characters")
+
+def build_task_graph(
+    db: Session,
+    nodes: List[CreateTaskRequest],
+    keys: List[Optional[str]]
+) -> Tuple[List[dict], List[Optional[str]]]:
+    """Validate new tasks and their dependencies; returns the task rows in
+    creation (topological) order along with the matching keys.
+
+    depends_on entries name either the key of another node or the id of an
+    existing task. Nodes whose parents have not all completed start WAITING.
+    """
+    ids = {key: str(uuid.uuid4()) for key in keys if key is not None}
+    if len(ids) != len([key for key in keys if key is not None]):
+        raise HTTPException(status_code=400, detail="task keys must be unique")
+
+    external = {ref for node in nodes for ref in node.depends_on if ref not in ids}
+    external_statuses = DependencyOperations.parent_statuses(db, list(external)) if external else {}
+    unknown = external - external_statuses.keys()
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"unknown dependencies: {', '.join(sorted(unknown))}")
+
+    # Topological order; whatever is left unordered is part of a cycle
+    order = []
+    remaining = dict(zip(range(len(nodes)), nodes))
+    placed = set()
+    while remaining:
+        ready = [
+            index for index, node in remaining.items()
+            if all(ref in external or ref in placed for ref in node.depends_on)
+        ]
+        if not ready:
+            cycle = sorted(keys[index] for index in remaining)
+            raise HTTPException(status_code=400, detail=f"dependency cycle between: {', '.join(cycle)}")
+        for index in ready:
+            order.append(index)
+            placed.add(keys[index])
+            del remaining[index]
+
+    tasks = []
+    for index in order:
+        node = nodes[index]
+        validate_input_files(node.input_files)
+        validate_output_settings(node.output_settings)
+        validate_queue(node.queue)
+        if node.on_dependency_failure not in DEPENDENCY_FAILURE_POLICIES:
+            raise HTTPException(status_code=400, detail=f"on_dependency_failure must be one of {', '.join(DEPENDENCY_FAILURE_POLICIES)}")
+        if node.max_retries is not None and node.max_retries < 0:
+            raise HTTPException(status_code=400, detail="max_retries must not be negative")
+        for field in ("timeout_seconds", "stall_timeout_seconds"):
+            if (getattr(node, field) or 0) < 0:
+                raise HTTPException(status_code=400, detail=f"{field} must not be negative")
+
+        parents = [ids.get(ref, ref) for ref in node.depends_on]
+        status = TaskStatus.PENDING
+        for ref in node.depends_on:
+            if ref in ids:
+                status = TaskStatus.WAITING
+                continue
+            parent_status = external_statuses[ref]
+            if parent_status in (TaskStatus.FAILED, TaskStatus.CANCELLED) and node.on_dependency_failure == "fail":
+                raise HTTPException(status_code=400, detail=f"dependency {ref} is {parent_status.value}")
+            if parent_status != TaskStatus.COMPLETED:
+                status = TaskStatus.WAITING
+
+        task_data = {
+            "priority": node.priority,
+            "queue": node.queue,
+            "input_files": node.input_files,
+            "output_settings": node.output_settings,
+            "status": status,
+            "depends_on": parents or None,
+            "on_dependency_failure": node.on_dependency_failure,
+            "max_retries": config.TASK_DEFAULT_MAX_RETRIES if node.max_retries is None else node.max_retries,
+            "timeout_seconds": config.TASK_DEFAULT_TIMEOUT if node.timeout_seconds is None else node.timeout_seconds,
+            "stall_timeout_seconds": (
+                config.TASK_DEFAULT_STALL_TIMEOUT if node.stall_timeout_seconds is None else node.stall_timeout_seconds
+            )
+        }
+        if keys[index] is not None:
+            task_data["id"] = ids[keys[index]]
+        tasks.append(task_data)
+    return tasks, [keys[index] for index in order]
 
 class UpdateTaskRequest(BaseModel):
     priority: Optional[TaskPriority] = None
+    queue: Optional[str] = None
     status: Optional[TaskStatus] = None
 
 @router.get("/")
 async def list_tasks(
+    app_request: Request,
     status: Optional[TaskStatus] = None,
+    queue: Optional[str] = None,
+    include_archived: bool = False,
     db: Session = Depends(get_db)
 ):
-    tasks = TaskOperations.get_all_tasks(db, status)
-    return {"tasks": [task.to_dict() for task in tasks]}
+    def build():
+        tasks = [task.to_dict() for task in TaskOperations.get_all_tasks(db, status, queue)]
+        if include_archived:
+            # Hot tasks first (they are the newest), then the most recent archived ones
+            archived = ArchiveOperations.get_archived_tasks(db, status, limit=config.ARCHIVE_QUERY_LIMIT)
+            for task in archived:
+                task = task.to_dict()
+                # The queue isn't an archive column, only part of the payload
+                if not queue or task.get("queue", "default") == queue:
+                    tasks.append(task)
+        return {"tasks": tasks}
+
+    read_cache = app_request.app.state.manager.read_cache
+    key = ("tasks", status.value if status else None, queue, include_archived)
+    return cached_response(app_request, read_cache.get(key, build))
 
 @router.post("/")
 async def create_task(
@@ -32,32 +222,82 @@ async def create_task(
     app_request: Request,
     db: Session = Depends(get_db)
 ):
-    task_data = {
-        "priority": request.priority,
-        "input_files": request.input_files,
-        "output_settings": request.output_settings
-    }
+    task_data, _ = build_task_graph(db, [request], [None])
+    task = TaskOperations.create_tasks(db, task_data)[0]
 
-    task = TaskOperations.create_task(db, task_data)
-
-    # Try to assign the task immediately
-    scheduler = app_request.app.state.scheduler
     manager = app_request.app.state.manager
-
-    await scheduler.try_assign_tasks(db)
     await manager.broadcast_task_update(task.to_dict())
 
+    # Let the scheduler loop pick it up
+    if task.status == TaskStatus.PENDING:
+        app_request.app.state.scheduler.wake()
+
     return task.to_dict()
 
+@router.post("/graph")
+async def create_task_graph(
+    request: CreateGraphRequest,
+    app_request: Request,
+    db: Session = Depends(get_db)
+):
+    """Submit a whole dependency graph at once; depends_on may use node keys"""
+    if not request.tasks:
+        raise HTTPException(status_code=400, detail="tasks must not be empty")
+    task_data, order_keys = build_task_graph(db, request.tasks, [node.key for node in request.tasks])
+    tasks = TaskOperations.create_tasks(db, task_data)
+
+    manager = app_request.app.state.manager
+    for task in tasks:
+        await manager.broadcast_task_update(task.to_dict())
+    app_request.app.state.scheduler.wake()
+
+    return {
+        "tasks": [task.to_dict() for task in tasks],
+        "keys": {key: task["id"] for key, task in zip(order_keys, task_data)}
+    }
+
 @router.get("/{task_id}")
 async def get_task(
     task_id: str,
+    app_request: Request,
+    include_archived: bool = False,
+    db: Session = Depends(get_db)
+):
+    def build():
+        task = TaskOperations.get_task(db, task_id)
+        if not task and include_archived:
+            task = ArchiveOperations.get_archived_task(db, task_id)
+        if not task:
+            raise HTTPException(status_code=404, detail="Task not found")
+        return task.to_dict()
+
+    read_cache = app_request.app.state.manager.read_cache
+    return cached_response(app_request, read_cache.get(("task", task_id, include_archived), build))
+
+@router.get("/{task_id}/segments")
+async def get_task_segments(
+    task_id: str,
+    rendition: Optional[str] = None,
+    after_id: int = 0,
     db: Session = Depends(get_db)
 ):
+    """Finished segments of a segmented (HLS/DASH) task, usable while it still runs"""
     task = TaskOperations.get_task(db, task_id)
     if not task:
-        raise HTTPException(status_code=404, detail="Task not found")
-    return task.to_dict()
+        archived = ArchiveOperations.get_archived_task(db, task_id)
+        if not archived:
+            raise HTTPException(status_code=404, detail="Task not found")
+        segments = [
+            segment for segment in archived.segments()
+            if segment["id"] > after_id and (not rendition or segment["rendition"] == rendition)
+        ]
+        return {"task_id": task_id, "status": archived.status, "segments": segments}
+    segments = SegmentOperations.get_segments(db, task_id, rendition, after_id)
+    return {
+        "task_id": task_id,
+        "status": task.status.value,
+        "segments": [segment.to_dict() for segment in segments]
+    }
 
 @router.patch("/{task_id}")
 async def update_task(
@@ -72,19 +312,48 @@ async def update_task(
 
     if request.priority is not None:
         task.priority = request.priority
+    if request.queue is not None:
+        validate_queue(request.queue)
+        task.queue = request.queue
+    if task.status == TaskStatus.PENDING and (request.priority is not None or request.queue is not None):
+        # Picked up by the scheduler's next queue sync
+        task.queued_at = datetime.utcnow()
 
+    restarted = False
+    cancelled_on = []
     if request.status is not None:
         # Handle status changes
         if request.status == TaskStatus.CANCELLED:
+            if task.status in (TaskStatus.ASSIGNED, TaskStatus.RUNNING):
+                # The agent is told to stop and frees itself once it has
+                cancelled_on = [task.agent_id, task.speculative_agent_id]
+                task.lease_expires_at = None
+                SegmentOperations.clear_segments(db, task.id)
+            if task.status != TaskStatus.CANCELLED:
+                task.completed_at = datetime.utcnow()
             task.status = request.status
         elif request.status == TaskStatus.PENDING and task.status == TaskStatus.FAILED:
-            # Restarting a failed task
-            task.status = TaskStatus.PENDING
+            # Restarting a failed task; it waits again if a dependency isn't done
+            parents = DependencyOperations.parent_statuses(db, task.depends_on or [])
+            if all(parents.get(parent_id) == TaskStatus.COMPLETED for parent_id in task.depends_on or []):
+                task.status = TaskStatus.PENDING
+                task.queued_at = datetime.utcnow()
+            else:
+                task.status = TaskStatus.WAITING
+            restarted = True
             task.agent_id = None
             task.error_message = None
             task.progress = 0.0
             task.started_at = None
             task.completed_at = None
+            task.resume_state = None
+            task.requeue_count = 0
+            task.retry_count = 0
+            task.failure_kind = None
+            task.failure_reason = None
+            task.failure_stderr = None
+            task.next_attempt_at = None
+            SegmentOperations.clear_segments(db, task.id)
 
     db.commit()
     db.refresh(task)
@@ -93,16 +362,25 @@ async def update_task(
     manager = app_request.app.state.manager
     await manager.broadcast_task_update(task.to_dict())
 
+    dependencies = app_request.app.state.dependencies
+    if restarted:
+        await dependencies.task_restarted(db, task)
+    elif task.status == TaskStatus.CANCELLED:
+        await dependencies.task_finished(db, task)
+    for agent_id in cancelled_on:
+        # Agents connected to another instance hear about it through the cluster feed
+        await manager.cancel_on_agent(task.id, agent_id)
+
     # Try to assign if task is now pending
     if task.status == TaskStatus.PENDING:
-        scheduler = app_request.app.state.scheduler
-        await scheduler.try_assign_tasks(db)
+        app_request.app.state.scheduler.wake()
 
     return task.to_dict()
 
 @router.delete("/{task_id}")
 async def delete_task(
     task_id: str,
+    app_request: Request,
     db: Session = Depends(get_db)
 ):
     task = TaskOperations.get_task(db, task_id)
@@ -112,7 +390,13 @@ async def delete_task(
     if task.status in [TaskStatus.RUNNING, TaskStatus.ASSIGNED]:
         raise HTTPException(status_code=400, detail="Cannot delete running or assigned task")
 
+    if DependencyOperations.get_children(db, task.id, (TaskStatus.WAITING,)):
+        raise HTTPException(status_code=400, detail="Cannot delete a task other tasks are waiting on")
+
+    SegmentOperations.clear_segments(db, task.id)
+    DependencyOperations.remove_edges(db, task.id)
     db.delete(task)
     db.commit()
+    app_request.app.state.manager.read_cache.invalidate_task(task_id)
 
     return {"message": "Task deleted successfully"}
\ No newline at end of file
@@ -0,0 +1,3 @@
+from .feed import ChangeFeed
+
+__all__ = ['ChangeFeed']
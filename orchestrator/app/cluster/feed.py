@@ -0,0 +1,129 @@
+import asyncio
+import logging
+import time
+from datetime import datetime, timedelta
+from typing import Callable, Optional
+
+from app.database import SessionLocal, EventOperations
+from app.models.task import TaskStatus
+
+logger = logging.getLogger(__name__)
+
+class ChangeFeed:
+    """DB-backed change feed shared by orchestrator instances.
+
+    Every instance appends its frontend events to the ``change_events`` table
+    and polls for rows written by the other instances, re-broadcasting them to
+    its own frontend clients. Each instance periodically announces the agents
+    it owns so the others can show the whole fleet.
+    """
+
+    def __init__(
+        self,
+        manager,
+        instance_id: str,
+        on_task_pending: Optional[Callable[[], None]] = None,
+        poll_interval: float = 0.5,
+        retention_seconds: int = 600,
+        announce_interval: float = 10.0
+    ):
+        self.manager = manager
+        self.instance_id = instance_id
+        self.on_task_pending = on_task_pending
+        self.poll_interval = poll_interval
+        self.retention_seconds = retention_seconds
+        self.announce_interval = announce_interval
+        self.last_event_id = 0
+        self._task = None
+        self._last_announce = 0.0
+
+    def publish(self, event_type: str, payload: dict):
+        """Append an event for the other instances"""
+        db = SessionLocal()
+        try:
+            EventOperations.publish_event(db, self.instance_id, event_type, payload)
+        except Exception as e:
+            logger.error(f"Error publishing {event_type} to change feed: {e}")
+        finally:
+            db.close()
+
+    async def start(self):
+        db = SessionLocal()
+        try:
+            # Only events written after startup are relevant
+            self.last_event_id = EventOperations.get_last_event_id(db)
+        finally:
+            db.close()
+        self._task = asyncio.create_task(self._run())
+        logger.info(f"Change feed started for instance {self.instance_id}")
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            self._task = None
+        # Tell the other instances our agents are gone
+        self.publish("agents_update", {"agents": {}})
+
+    async def _run(self):
+        while True:
+            try:
+                await self._poll()
+                if time.monotonic() - self._last_announce >= self.announce_interval:
+                    await self._announce()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Change feed error: {e}")
+            await asyncio.sleep(self.poll_interval)
+
+    async def _poll(self):
+        db = SessionLocal()
+        try:
+            events = EventOperations.get_events_since(db, self.last_event_id, exclude_instance=self.instance_id)
+        finally:
+            db.close()
+
+        agents_changed = False
+        task_pending = False
+        for event in events:
+            self.last_event_id = event.id
+            if event.event_type == "task_update":
+                task = event.payload.get("task") or {}
+                await self.manager.broadcast_task_update(task, publish=False)
+                if task.get("status") == TaskStatus.PENDING.value:
+                    task_pending = True
+                elif task.get("status") == TaskStatus.CANCELLED.value:
+                    # Cancelled on another instance: stop it if its agent is ours
+                    for agent_id in (task.get("agent_id"), task.get("speculative_agent_id")):
+                        await self.manager.cancel_on_agent(task["id"], agent_id)
+            elif event.event_type == "agents_update":
+                self.manager.apply_remote_agents(event.instance_id, event.payload.get("agents", {}))
+                agents_changed = True
+            elif event.event_type == "segments_ready":
+                await self.manager.broadcast_segments(
+                    event.payload.get("task_id"), event.payload.get("segments", []), publish=False
+                )
+            else:
+                # Other frontend events are relayed as they are
+                await self.manager.broadcast_to_frontend(event.payload)
+
+        if agents_changed:
+            await self.manager.broadcast_agent_status(publish=False)
+
+        # Work queued through another instance may fit one of our agents
+        if task_pending and self.on_task_pending:
+            self.on_task_pending()
+
+    async def _announce(self):
+        self._last_announce = time.monotonic()
+        self.publish("agents_update", {"agents": self.manager.local_agents_dict()})
+
+        if self.manager.expire_remote_agents(self.announce_interval * 3):
+            await self.manager.broadcast_agent_status(publish=False)
+
+        db = SessionLocal()
+        try:
+            cutoff = datetime.utcnow() - timedelta(seconds=self.retention_seconds)
+            EventOperations.purge_events_before(db, cutoff)
+        finally:
+            db.close()
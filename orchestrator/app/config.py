@@ -0,0 +1,122 @@
+import json
+import os
+import socket
+
+def _env_flag(name: str, default: str = "false") -> bool:
+    return os.getenv(name, default).lower() in ("1", "true", "yes", "on")
+
+# Active-active mode: several orchestrator processes share one database,
+# each owning the agents connected to it
+CLUSTER_MODE = _env_flag("CLUSTER_MODE")
+INSTANCE_ID = os.getenv("INSTANCE_ID") or f"{socket.gethostname()}-{os.getpid()}"
+
+# DB-backed change feed used to fan events out to other instances
+CHANGE_FEED_POLL_INTERVAL = float(os.getenv("CHANGE_FEED_POLL_INTERVAL", "0.5"))
+CHANGE_FEED_RETENTION = int(os.getenv("CHANGE_FEED_RETENTION", "600"))  # seconds
+INSTANCE_ANNOUNCE_INTERVAL = float(os.getenv("INSTANCE_ANNOUNCE_INTERVAL", "10"))
+
+# Scheduler loop: wake-ups within the debounce window share one pass, and a
+# sweep runs anyway every sweep interval
+SCHEDULER_DEBOUNCE = float(os.getenv("SCHEDULER_DEBOUNCE", "0.05"))  # seconds
+SCHEDULER_SWEEP_INTERVAL = float(os.getenv("SCHEDULER_SWEEP_INTERVAL", "5"))  # seconds
+
+# Task leases: an assignment stays valid while the agent keeps renewing it
+# through heartbeats and progress updates
+TASK_LEASE_TTL = float(os.getenv("TASK_LEASE_TTL", "90"))  # seconds
+LEASE_REAPER_INTERVAL = float(os.getenv("LEASE_REAPER_INTERVAL", "10"))  # seconds
+TASK_MAX_REQUEUES = int(os.getenv("TASK_MAX_REQUEUES", "3"))
+# Agents keep encoding while disconnected: their tasks are requeued only if
+# they don't reconnect within the grace (0 requeues on disconnect). Leases
+# are extended by it on startup, agents could not renew them while the
+# orchestrator was down
+AGENT_RECONNECT_GRACE = float(os.getenv("AGENT_RECONNECT_GRACE", "300"))  # seconds
+
+# Load-aware dispatch: agents whose last heartbeat reports a host above these
+# limits get no new work (0 disables a limit)
+AGENT_MAX_EXTERNAL_CPU_PERCENT = float(os.getenv("AGENT_MAX_EXTERNAL_CPU_PERCENT", "80"))
+AGENT_MAX_LOAD_PER_CPU = float(os.getenv("AGENT_MAX_LOAD_PER_CPU", "0"))
+AGENT_MIN_FREE_MEMORY_MB = float(os.getenv("AGENT_MIN_FREE_MEMORY_MB", "512"))
+AGENT_MIN_FREE_SCRATCH_MB = float(os.getenv("AGENT_MIN_FREE_SCRATCH_MB", "2048"))
+
+# Frontend protocol: most tasks a snapshot carries
+FRONTEND_SNAPSHOT_LIMIT = int(os.getenv("FRONTEND_SNAPSHOT_LIMIT", "500"))
+# Dashboard clients with this many messages waiting, or taking longer than
+# FRONTEND_SEND_TIMEOUT seconds to receive one, are disconnected
+FRONTEND_MAX_PENDING = int(os.getenv("FRONTEND_MAX_PENDING", "1000"))
+FRONTEND_SEND_TIMEOUT = float(os.getenv("FRONTEND_SEND_TIMEOUT", "10"))
+
+# Cached read endpoints: bodies are rebuilt at the latest after this long to
+# pick up changes that are not broadcast (lease renewals, heartbeat load)
+READ_CACHE_TTL = float(os.getenv("READ_CACHE_TTL", "5"))  # seconds
+
+# Archival: finished tasks older than TASK_ARCHIVE_AFTER move to the
+# task_archive table in batches; archived tasks are deleted after
+# TASK_ARCHIVE_RETENTION (0 disables either step)
+TASK_ARCHIVE_AFTER = float(os.getenv("TASK_ARCHIVE_AFTER", str(7 * 24 * 3600)))  # seconds
+TASK_ARCHIVE_RETENTION = float(os.getenv("TASK_ARCHIVE_RETENTION", "0"))  # seconds
+TASK_ARCHIVE_INTERVAL = float(os.getenv("TASK_ARCHIVE_INTERVAL", "60"))  # seconds
+TASK_ARCHIVE_BATCH_SIZE = int(os.getenv("TASK_ARCHIVE_BATCH_SIZE", "500"))
+ARCHIVE_QUERY_LIMIT = int(os.getenv("ARCHIVE_QUERY_LIMIT", "1000"))
+
+# Preemption: with HIGH tasks waiting and no free agent, running LOW/MEDIUM
+# tasks are stopped (saving resumable progress) and requeued
+PREEMPTION_ENABLED = _env_flag("PREEMPTION_ENABLED", "true")
+PREEMPTION_MIN_RUNTIME = float(os.getenv("PREEMPTION_MIN_RUNTIME", "60"))  # seconds
+PREEMPTION_MAX_PER_TASK = int(os.getenv("PREEMPTION_MAX_PER_TASK", "2"))
+PREEMPTION_MAX_PROGRESS = float(os.getenv("PREEMPTION_MAX_PROGRESS", "90"))  # percent
+PREEMPTION_MAX_IN_FLIGHT = int(os.getenv("PREEMPTION_MAX_IN_FLIGHT", "2"))
+PREEMPTION_COOLDOWN = float(os.getenv("PREEMPTION_COOLDOWN", "30"))  # seconds
+
+# Queue ordering: "fair" shares agents between task queues by weight and
+# ages waiting tasks up one priority level every PRIORITY_AGING_SECONDS
+# (0 disables aging); "cost" does the same, but within a queue and priority
+# a task waits COST_POLICY_WEIGHT seconds longer per unit of estimated work
+# (see CAPACITY_DEFAULT_SOURCE_SECONDS); "fifo" is strict priority, then
+# oldest first
+SCHEDULING_POLICY = os.getenv("SCHEDULING_POLICY", "fair")
+COST_POLICY_WEIGHT = float(os.getenv("COST_POLICY_WEIGHT", "1.0"))  # seconds per unit of work
+QUEUE_WEIGHTS = json.loads(os.getenv("QUEUE_WEIGHTS", "{}"))  # {"queue": weight}, others weigh 1
+PRIORITY_AGING_SECONDS = float(os.getenv("PRIORITY_AGING_SECONDS", "900"))
+FAIR_SHARE_HALF_LIFE = float(os.getenv("FAIR_SHARE_HALF_LIFE", "300"))  # seconds
+QUEUE_RESYNC_INTERVAL = float(os.getenv("QUEUE_RESYNC_INTERVAL", "60"))  # seconds
+
+# Failed tasks: failures the agent classifies as transient (or unknown, if
+# RETRY_UNKNOWN_FAILURES) are retried up to the task's max_retries
+# (TASK_DEFAULT_MAX_RETRIES unless given), waiting RETRY_BACKOFF_BASE * 2^n
+# seconds, capped at RETRY_BACKOFF_MAX; permanent failures are not retried
+TASK_DEFAULT_MAX_RETRIES = int(os.getenv("TASK_DEFAULT_MAX_RETRIES", "2"))
+RETRY_UNKNOWN_FAILURES = _env_flag("RETRY_UNKNOWN_FAILURES")
+RETRY_BACKOFF_BASE = float(os.getenv("RETRY_BACKOFF_BASE", "30"))  # seconds
+RETRY_BACKOFF_MAX = float(os.getenv("RETRY_BACKOFF_MAX", "900"))  # seconds
+FAILURE_STDERR_LINES = int(os.getenv("FAILURE_STDERR_LINES", "50"))
+
+# Per-task limits the agent enforces on each run, unless the task sets its
+# own: wall-clock seconds (a permanent "timeout" failure) and seconds
+# without progress (a transient "stalled" failure); 0 means no limit
+TASK_DEFAULT_TIMEOUT = float(os.getenv("TASK_DEFAULT_TIMEOUT", "0"))
+TASK_DEFAULT_STALL_TIMEOUT = float(os.getenv("TASK_DEFAULT_STALL_TIMEOUT", "0"))
+
+# Speculative execution: with agents idle and nothing queued, a running task
+# encoding slower than SPECULATION_SLOWDOWN times the usual speed for its
+# codec and resolution (the median of the last SPECULATION_HISTORY completed
+# tasks, once there are SPECULATION_MIN_SAMPLES) gets a duplicate on an idle
+# agent if that would finish sooner; the first attempt to finish wins
+SPECULATION_ENABLED = _env_flag("SPECULATION_ENABLED", "true")
+SPECULATION_SLOWDOWN = float(os.getenv("SPECULATION_SLOWDOWN", "0.5"))
+SPECULATION_MIN_RUNTIME = float(os.getenv("SPECULATION_MIN_RUNTIME", "60"))  # seconds
+SPECULATION_MAX_IN_FLIGHT = int(os.getenv("SPECULATION_MAX_IN_FLIGHT", "2"))
+SPECULATION_MIN_SAMPLES = int(os.getenv("SPECULATION_MIN_SAMPLES", "3"))
+SPECULATION_HISTORY = int(os.getenv("SPECULATION_HISTORY", "50"))
+
+# Autoscaling signal (GET /api/capacity): agents needed to finish the backlog
+# within CAPACITY_DRAIN_SECONDS at the throughput observed over the last
+# CAPACITY_WINDOW seconds. Inputs without a trimmed length count as the
+# median recent source (CAPACITY_DEFAULT_SOURCE_SECONDS without any), and
+# CAPACITY_DEFAULT_THROUGHPUT (1080p h264 seconds per second) is assumed
+# until agents have completed or calibrated anything
+CAPACITY_DRAIN_SECONDS = float(os.getenv("CAPACITY_DRAIN_SECONDS", "1800"))
+CAPACITY_WINDOW = float(os.getenv("CAPACITY_WINDOW", "3600"))  # seconds
+CAPACITY_DEFAULT_SOURCE_SECONDS = float(os.getenv("CAPACITY_DEFAULT_SOURCE_SECONDS", "600"))
+CAPACITY_DEFAULT_THROUGHPUT = float(os.getenv("CAPACITY_DEFAULT_THROUGHPUT", "1.0"))
+CAPACITY_MIN_AGENTS = int(os.getenv("CAPACITY_MIN_AGENTS", "0"))
+CAPACITY_MAX_AGENTS = int(os.getenv("CAPACITY_MAX_AGENTS", "0"))  # 0 = no limit
@@ -1,4 +1,4 @@
-from .session import get_db, init_db, engine
-from .operations import TaskOperations
+from .session import get_db, init_db, engine, SessionLocal
+from .operations import TaskOperations, SegmentOperations, EventOperations, ArchiveOperations, DependencyOperations, DeliveryOperations
 
-__all__ = ['get_db', 'init_db', 'engine', 'TaskOperations']
\ No newline at end of file
+__all__ = ['get_db', 'init_db', 'engine', 'SessionLocal', 'TaskOperations', 'SegmentOperations', 'EventOperations', 'ArchiveOperations', 'DependencyOperations', 'DeliveryOperations']
\ No newline at end of file
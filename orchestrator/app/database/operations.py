@@ -1,7 +1,29 @@
-from typing import List, Optional
+from typing import Dict, List, Optional
+import posixpath
+from sqlalchemy import func, or_
+from sqlalchemy.exc import IntegrityError
 from sqlalchemy.orm import Session
-from datetime import datetime
+from datetime import datetime, timedelta
+from app import config
 from app.models.task import Task, TaskStatus, TaskPriority
+from app.models.event import ChangeEvent
+from app.models.segment import TaskSegment
+from app.models.archive import ArchivedTask
+from app.models.dependency import TaskDependency
+from app.models.delivery import AgentDelivery
+
+IN_FLIGHT_STATUSES = (TaskStatus.ASSIGNED, TaskStatus.RUNNING)
+ACTIVE_STATUSES = (TaskStatus.WAITING, TaskStatus.PENDING) + IN_FLIGHT_STATUSES
+FINISHED_STATUSES = (TaskStatus.COMPLETED, TaskStatus.FAILED, TaskStatus.CANCELLED)
+
+# Urgency of each priority, higher is more urgent
+PRIORITY_RANK = {TaskPriority.LOW: 0, TaskPriority.MEDIUM: 1, TaskPriority.HIGH: 2}
+
+FAILURE_KINDS = ("transient", "permanent", "unknown")
+
+def retry_delay(attempt: int) -> float:
+    """Backoff before retry number attempt + 1"""
+    return min(config.RETRY_BACKOFF_BASE * 2 ** attempt, config.RETRY_BACKOFF_MAX)
 
 class TaskOperations:
     @staticmethod
@@ -12,71 +34,752 @@ class TaskOperations:
         db.refresh(task)
         return task
 
+    @staticmethod
+    def create_tasks(db: Session, tasks_data: List[dict]) -> List[Task]:
+        """Create several tasks (and their dependency edges) in one transaction"""
+        tasks = [Task(**task_data) for task_data in tasks_data]
+        for task in tasks:
+            db.add(task)
+        db.flush()
+        for task in tasks:
+            DependencyOperations.add_edges(db, task)
+        db.commit()
+        for task in tasks:
+            db.refresh(task)
+        return tasks
+
     @staticmethod
     def get_task(db: Session, task_id: str) -> Optional[Task]:
         return db.query(Task).filter(Task.id == task_id).first()
 
     @staticmethod
-    def get_all_tasks(db: Session, status: Optional[TaskStatus] = None) -> List[Task]:
+    def get_all_tasks(db: Session, status: Optional[TaskStatus] = None, queue: Optional[str] = None) -> List[Task]:
         query = db.query(Task)
         if status:
             query = query.filter(Task.status == status)
+        if queue:
+            query = query.filter(Task.queue == queue)
         return query.order_by(Task.created_at.desc()).all()
 
     @staticmethod
-    def get_next_pending_task(db: Session) -> Optional[Task]:
-        # Priority order: HIGH > MEDIUM > LOW, then by created_at
-        return db.query(Task).filter(
+    def find_tasks(
+        db: Session,
+        statuses: Optional[List[TaskStatus]] = None,
+        agent_ids: Optional[List[str]] = None,
+        task_ids: Optional[List[str]] = None,
+        limit: Optional[int] = None
+    ) -> List[Task]:
+        """Tasks matching every given filter, newest first"""
+        query = db.query(Task)
+        if statuses:
+            query = query.filter(Task.status.in_(statuses))
+        if agent_ids:
+            query = query.filter(Task.agent_id.in_(agent_ids))
+        if task_ids:
+            query = query.filter(Task.id.in_(task_ids))
+        query = query.order_by(Task.created_at.desc())
+        if limit:
+            query = query.limit(limit)
+        return query.all()
+
+    @staticmethod
+    def get_queue_entries(db: Session, changed_since: Optional[datetime] = None) -> list:
+        """Pending tasks as (id, queue, priority, created_at, queued_at, next_attempt_at, output_settings, input_files) rows.
+
+        Feeds the scheduler's in-memory queue; with changed_since only the
+        tasks (re)queued since then are returned.
+        """
+        query = db.query(
+            Task.id, Task.queue, Task.priority, Task.created_at, Task.queued_at, Task.next_attempt_at,
+            Task.output_settings, Task.input_files
+        ).filter(
             Task.status == TaskStatus.PENDING
-        ).order_by(
-            Task.priority.desc(),
-            Task.created_at.asc()
-        ).first()
+        )
+        if changed_since is not None:
+            query = query.filter(Task.queued_at >= changed_since)
+        return query.all()
+
+    @staticmethod
+    def get_pending_output_settings(db: Session, priority: Optional[TaskPriority] = None) -> List[Dict]:
+        """output_settings of the pending tasks that may run now"""
+        query = db.query(Task.output_settings).filter(
+            Task.status == TaskStatus.PENDING,
+            or_(Task.next_attempt_at.is_(None), Task.next_attempt_at <= datetime.utcnow())
+        )
+        if priority:
+            query = query.filter(Task.priority == priority)
+        return [output_settings for output_settings, in query.all()]
 
     @staticmethod
-    def assign_task(db: Session, task_id: str, agent_id: str) -> Optional[Task]:
+    def get_in_flight_tasks(db: Session, agent_ids: Optional[List[str]] = None) -> List[Task]:
+        query = db.query(Task).filter(Task.status.in_(IN_FLIGHT_STATUSES))
+        if agent_ids is not None:
+            query = query.filter(Task.agent_id.in_(agent_ids))
+        return query.all()
+
+    @staticmethod
+    def preempt_task(db: Session, task_id: str, agent_id: str, resume_state: Optional[dict] = None) -> Optional[Task]:
+        """Requeue a task its agent stopped for higher-priority work.
+
+        With resume_state the next attempt continues from the saved offset,
+        otherwise it starts over. Returns None if agent_id no longer holds it.
+        """
         task = TaskOperations.get_task(db, task_id)
-        if task and task.status == TaskStatus.PENDING:
-            task.status = TaskStatus.ASSIGNED
-            task.agent_id = agent_id
-            task.started_at = datetime.utcnow()
+        if not task or task.agent_id != agent_id or task.status not in IN_FLIGHT_STATUSES:
+            return None
+        values = {
+            Task.status: TaskStatus.PENDING,
+            Task.queued_at: datetime.utcnow(),
+            Task.agent_id: None,
+            Task.started_at: None,
+            Task.lease_expires_at: None,
+            Task.preempt_count: (task.preempt_count or 0) + 1,
+            Task.resume_state: resume_state,
+            Task.error_message: "Preempted by higher-priority work"
+        }
+        if not resume_state:
+            values[Task.progress] = 0.0
+            values[Task.rendition_progress] = None
+        updated = db.query(Task).filter(
+            Task.id == task_id,
+            Task.agent_id == agent_id,
+            Task.status.in_(IN_FLIGHT_STATUSES)
+        ).update(values, synchronize_session=False)
+        if updated and not resume_state:
+            db.query(TaskSegment).filter(TaskSegment.task_id == task_id).delete(synchronize_session=False)
+        db.commit()
+        if not updated:
+            return None
+        db.refresh(task)
+        return task
+
+    @staticmethod
+    def assign_task(db: Session, task_id: str, agent_id: str, lease_seconds: float = None) -> Optional[Task]:
+        # Conditional UPDATE so that concurrent schedulers (possibly in other
+        # orchestrator instances) can never claim the same task twice
+        now = datetime.utcnow()
+        lease_seconds = config.TASK_LEASE_TTL if lease_seconds is None else lease_seconds
+        claimed = db.query(Task).filter(
+            Task.id == task_id,
+            Task.status == TaskStatus.PENDING
+        ).update({
+            Task.status: TaskStatus.ASSIGNED,
+            Task.agent_id: agent_id,
+            Task.started_at: now,
+            Task.lease_expires_at: now + timedelta(seconds=lease_seconds)
+        }, synchronize_session=False)
+        db.commit()
+        if not claimed:
+            return None
+        task = TaskOperations.get_task(db, task_id)
+        db.refresh(task)
+        return task
+
+    @staticmethod
+    def release_task(db: Session, task_id: str, agent_id: str) -> Optional[Task]:
+        """Return an assigned task to the queue if it is still held by agent_id"""
+        released = db.query(Task).filter(
+            Task.id == task_id,
+            Task.agent_id == agent_id,
+            Task.status == TaskStatus.ASSIGNED
+        ).update({
+            Task.status: TaskStatus.PENDING,
+            Task.queued_at: datetime.utcnow(),
+            Task.agent_id: None,
+            Task.started_at: None,
+            Task.lease_expires_at: None
+        }, synchronize_session=False)
+        db.commit()
+        if not released:
+            return None
+        task = TaskOperations.get_task(db, task_id)
+        db.refresh(task)
+        return task
+
+    @staticmethod
+    def renew_leases(db: Session, agent_id: str, lease_seconds: float = None) -> int:
+        """Extend the leases of every in-flight task held by agent_id, or speculatively run by it"""
+        lease_seconds = config.TASK_LEASE_TTL if lease_seconds is None else lease_seconds
+        renewed = db.query(Task).filter(
+            or_(Task.agent_id == agent_id, Task.speculative_agent_id == agent_id),
+            Task.status.in_(IN_FLIGHT_STATUSES)
+        ).update({
+            Task.lease_expires_at: datetime.utcnow() + timedelta(seconds=lease_seconds)
+        }, synchronize_session=False)
+        db.commit()
+        return renewed
+
+    @staticmethod
+    def extend_leases(db: Session, lease_seconds: float, agent_id: Optional[str] = None) -> int:
+        """Make in-flight leases (all, or agent_id's) last at least lease_seconds from now"""
+        until = datetime.utcnow() + timedelta(seconds=lease_seconds)
+        query = db.query(Task).filter(
+            Task.status.in_(IN_FLIGHT_STATUSES),
+            or_(Task.lease_expires_at.is_(None), Task.lease_expires_at < until)
+        )
+        if agent_id is not None:
+            query = query.filter(or_(Task.agent_id == agent_id, Task.speculative_agent_id == agent_id))
+        extended = query.update({Task.lease_expires_at: until}, synchronize_session=False)
+        db.commit()
+        return extended
+
+    @staticmethod
+    def reclaim_task(db: Session, task_id: str, agent_id: str, lease_seconds: float = None) -> Optional[Task]:
+        """Let a reconnected agent carry on with a task it is still running.
+
+        The agent keeps a task it still holds (or runs a speculative copy
+        of), and takes back one requeued while it was away that no other
+        agent claimed since. Returns None if the task has moved on.
+        """
+        lease_seconds = config.TASK_LEASE_TTL if lease_seconds is None else lease_seconds
+        now = datetime.utcnow()
+        task = TaskOperations.get_task(db, task_id)
+        if not task:
+            return None
+        if task.status in IN_FLIGHT_STATUSES and agent_id in (task.agent_id, task.speculative_agent_id):
+            task.lease_expires_at = now + timedelta(seconds=lease_seconds)
             db.commit()
             db.refresh(task)
             return task
-        return None
+        reclaimed = db.query(Task).filter(
+            Task.id == task_id,
+            Task.status == TaskStatus.PENDING,
+            Task.agent_id.is_(None)
+        ).update({
+            Task.status: TaskStatus.RUNNING,
+            Task.agent_id: agent_id,
+            Task.started_at: now,
+            Task.next_attempt_at: None,
+            Task.lease_expires_at: now + timedelta(seconds=lease_seconds),
+            Task.error_message: None
+        }, synchronize_session=False)
+        db.commit()
+        if not reclaimed:
+            return None
+        db.refresh(task)
+        return task
+
+    @staticmethod
+    def get_agent_tasks(db: Session, agent_id: str) -> List[Task]:
+        """In-flight tasks held by agent_id, or speculatively run by it"""
+        return db.query(Task).filter(
+            or_(Task.agent_id == agent_id, Task.speculative_agent_id == agent_id),
+            Task.status.in_(IN_FLIGHT_STATUSES)
+        ).all()
+
+    @staticmethod
+    def get_expired_leases(db: Session, now: Optional[datetime] = None) -> List[Task]:
+        now = now or datetime.utcnow()
+        return db.query(Task).filter(
+            Task.status.in_(IN_FLIGHT_STATUSES),
+            Task.lease_expires_at < now
+        ).all()
 
     @staticmethod
-    def update_task_progress(db: Session, task_id: str, progress: float) -> Optional[Task]:
+    def requeue_task(db: Session, task_id: str, agent_id: str, reason: str, max_requeues: int = None) -> Optional[Task]:
+        """Take an in-flight task away from agent_id and put it back in the queue.
+
+        Fails the task instead once it has been requeued max_requeues times.
+        A speculative copy on another agent carries on instead, and losing
+        the copy just ends the speculation. Returns None if the task is no
+        longer held by agent_id.
+        """
+        max_requeues = config.TASK_MAX_REQUEUES if max_requeues is None else max_requeues
+        task = TaskOperations.get_task(db, task_id)
+        if task and task.status in IN_FLIGHT_STATUSES and task.speculative_agent_id:
+            if agent_id in (task.agent_id, task.speculative_agent_id):
+                return TaskOperations.drop_attempt(db, task, agent_id)
+        if not task or task.agent_id != agent_id or task.status not in IN_FLIGHT_STATUSES:
+            return None
+
+        requeue_count = task.requeue_count or 0
+        if requeue_count >= max_requeues:
+            values = {
+                Task.status: TaskStatus.FAILED,
+                Task.error_message: f"{reason} (gave up after {requeue_count} requeues)",
+                Task.lease_expires_at: None,
+                Task.completed_at: datetime.utcnow()
+            }
+        else:
+            values = {
+                Task.status: TaskStatus.PENDING,
+                Task.queued_at: datetime.utcnow(),
+                Task.agent_id: None,
+                Task.progress: 0.0,
+                Task.rendition_progress: None,
+                Task.started_at: None,
+                Task.lease_expires_at: None,
+                Task.requeue_count: requeue_count + 1,
+                Task.error_message: reason
+            }
+
+        # Conditional on the holder so a concurrent completion or another
+        # reaper instance wins cleanly
+        updated = db.query(Task).filter(
+            Task.id == task_id,
+            Task.agent_id == agent_id,
+            Task.status.in_(IN_FLIGHT_STATUSES)
+        ).update(values, synchronize_session=False)
+        if updated and values[Task.status] == TaskStatus.PENDING:
+            # The next attempt rewrites its segments from the start
+            db.query(TaskSegment).filter(TaskSegment.task_id == task_id).delete(synchronize_session=False)
+        db.commit()
+        if not updated:
+            return None
+        db.refresh(task)
+        return task
+
+    @staticmethod
+    def update_task_progress(
+        db: Session,
+        task_id: str,
+        progress: float,
+        agent_id: Optional[str] = None,
+        renditions: Optional[dict] = None,
+        speed: Optional[float] = None
+    ) -> Optional[Task]:
         task = TaskOperations.get_task(db, task_id)
-        if task:
+        if task and agent_id is not None and task.speculative_agent_id == agent_id:
+            if task.status in IN_FLIGHT_STATUSES:
+                task.speculative_progress = progress
+                db.commit()
+                db.refresh(task)
+                return task
+            return None
+        if task and (agent_id is None or task.agent_id == agent_id):
             task.progress = progress
+            if renditions:
+                task.rendition_progress = renditions
+            if speed:
+                task.encode_speed = speed
             if task.status == TaskStatus.ASSIGNED:
                 task.status = TaskStatus.RUNNING
+            if task.status in IN_FLIGHT_STATUSES:
+                task.lease_expires_at = datetime.utcnow() + timedelta(seconds=config.TASK_LEASE_TTL)
             db.commit()
             db.refresh(task)
             return task
         return None
 
     @staticmethod
-    def complete_task(db: Session, task_id: str) -> Optional[Task]:
+    def start_speculation(db: Session, task_id: str, agent_id: str) -> Optional[Task]:
+        """Record a speculative copy of a running task on agent_id; None if the task moved on"""
+        started = db.query(Task).filter(
+            Task.id == task_id,
+            Task.status == TaskStatus.RUNNING,
+            Task.speculative_agent_id.is_(None),
+            Task.agent_id != agent_id
+        ).update({
+            Task.speculative_agent_id: agent_id,
+            Task.speculative_progress: 0.0
+        }, synchronize_session=False)
+        db.commit()
+        if not started:
+            return None
         task = TaskOperations.get_task(db, task_id)
-        if task:
+        db.refresh(task)
+        return task
+
+    @staticmethod
+    def drop_attempt(db: Session, task: Task, agent_id: str) -> Task:
+        """One of two attempts of a speculated task is gone; the other one carries on"""
+        if task.agent_id == agent_id:
+            task.agent_id = task.speculative_agent_id
+            task.progress = task.speculative_progress or 0.0
+            task.rendition_progress = None
+            task.encode_speed = None
+            task.lease_expires_at = datetime.utcnow() + timedelta(seconds=config.TASK_LEASE_TTL)
+        task.speculative_agent_id = None
+        task.speculative_progress = None
+        db.commit()
+        db.refresh(task)
+        return task
+
+    @staticmethod
+    def get_recent_speeds(db: Session, limit: int = 1000) -> List[tuple]:
+        """(output_settings, encode_speed) of the most recently completed tasks, newest first"""
+        return db.query(Task.output_settings, Task.encode_speed).filter(
+            Task.status == TaskStatus.COMPLETED,
+            Task.encode_speed.isnot(None)
+        ).order_by(Task.completed_at.desc()).limit(limit).all()
+
+    @staticmethod
+    def get_backlog(db: Session) -> List[tuple]:
+        """(status, priority, progress, input_files, output_settings) of every unfinished task"""
+        return db.query(
+            Task.status, Task.priority, Task.progress, Task.input_files, Task.output_settings
+        ).filter(Task.status.in_(ACTIVE_STATUSES)).all()
+
+    @staticmethod
+    def get_recent_completions(db: Session, since: datetime, limit: int = 1000) -> List[tuple]:
+        """(agent_id, input_files, output_settings, encode_speed, io_timings) of tasks completed since, newest first"""
+        return db.query(
+            Task.agent_id, Task.input_files, Task.output_settings, Task.encode_speed, Task.io_timings
+        ).filter(
+            Task.status == TaskStatus.COMPLETED,
+            Task.completed_at >= since
+        ).order_by(Task.completed_at.desc()).limit(limit).all()
+
+    @staticmethod
+    def complete_task(
+        db: Session,
+        task_id: str,
+        agent_id: Optional[str] = None,
+        io_timings: Optional[dict] = None
+    ) -> Optional[Task]:
+        task = TaskOperations.get_task(db, task_id)
+        if task and agent_id is not None and task.speculative_agent_id == agent_id \
+                and task.status in IN_FLIGHT_STATUSES:
+            # The speculative copy finished first
+            task.agent_id = agent_id
+            task.encode_speed = None
+        # Requeued while its agent was disconnected, which finished it anyway
+        # (reported from the agent's outbox) before anyone else claimed it
+        requeued = task is not None and agent_id is not None \
+            and task.status == TaskStatus.PENDING and task.agent_id is None
+        if requeued:
+            task.agent_id = agent_id
+        # A task cancelled or reassigned meanwhile keeps its new state
+        if task and (requeued or task.status in IN_FLIGHT_STATUSES) and (agent_id is None or task.agent_id == agent_id):
             task.status = TaskStatus.COMPLETED
+            task.speculative_agent_id = None
+            task.speculative_progress = None
+            task.io_timings = io_timings
+            task.resume_state = None
             task.progress = 100.0
+            if task.rendition_progress:
+                task.rendition_progress = {
+                    name: dict(state, progress=100.0)
+                    for name, state in task.rendition_progress.items()
+                }
             task.completed_at = datetime.utcnow()
+            task.lease_expires_at = None
             db.commit()
             db.refresh(task)
             return task
         return None
 
     @staticmethod
-    def fail_task(db: Session, task_id: str, error_message: str) -> Optional[Task]:
+    def fail_task(
+        db: Session,
+        task_id: str,
+        error_message: str,
+        agent_id: Optional[str] = None,
+        failure: Optional[dict] = None
+    ) -> Optional[Task]:
+        """Fail a task, or requeue it with backoff while it has retries left.
+
+        failure is the agent's classification ({"kind", "reason", "stderr"});
+        permanent failures are never retried.
+        """
         task = TaskOperations.get_task(db, task_id)
-        if task:
+        if task and task.status in IN_FLIGHT_STATUSES and task.speculative_agent_id \
+                and agent_id in (task.agent_id, task.speculative_agent_id):
+            # The other attempt is still running, it decides
+            return TaskOperations.drop_attempt(db, task, agent_id)
+        if task and task.status in IN_FLIGHT_STATUSES and (agent_id is None or task.agent_id == agent_id):
+            failure = failure or {}
+            kind = failure.get("kind") if failure.get("kind") in FAILURE_KINDS else "unknown"
+            task.failure_kind = kind
+            task.failure_reason = failure.get("reason")
+            task.failure_stderr = (failure.get("stderr") or [])[-config.FAILURE_STDERR_LINES:] or None
+
+            retry_count = task.retry_count or 0
+            retryable = kind == "transient" or (kind == "unknown" and config.RETRY_UNKNOWN_FAILURES)
+            if retryable and retry_count < (task.max_retries or 0):
+                now = datetime.utcnow()
+                delay = retry_delay(retry_count)
+                task.status = TaskStatus.PENDING
+                task.queued_at = now
+                task.next_attempt_at = now + timedelta(seconds=delay)
+                task.agent_id = None
+                task.progress = 0.0
+                task.rendition_progress = None
+                task.started_at = None
+                task.lease_expires_at = None
+                task.retry_count = retry_count + 1
+                task.resume_state = None
+                task.error_message = (
+                    f"Retry {retry_count + 1}/{task.max_retries} in {delay:.0f}s after {kind} failure: {error_message}"
+                )
+                db.query(TaskSegment).filter(TaskSegment.task_id == task_id).delete(synchronize_session=False)
+                db.commit()
+                db.refresh(task)
+                return task
             task.status = TaskStatus.FAILED
             task.error_message = error_message
             task.completed_at = datetime.utcnow()
+            task.lease_expires_at = None
+            task.next_attempt_at = None
             db.commit()
             db.refresh(task)
             return task
-        return None
\ No newline at end of file
+        return None
+
+DEPENDENCY_FAILED_PREFIX = "Dependency failed: "
+
+class DependencyOperations:
+    @staticmethod
+    def parent_statuses(db: Session, parent_ids: List[str]) -> dict:
+        """Status of each parent, looked up in the hot table and then the archive"""
+        statuses = {
+            task_id: status
+            for task_id, status in db.query(Task.id, Task.status).filter(Task.id.in_(parent_ids))
+        }
+        missing = [task_id for task_id in parent_ids if task_id not in statuses]
+        if missing:
+            for task_id, status in db.query(ArchivedTask.id, ArchivedTask.status).filter(ArchivedTask.id.in_(missing)):
+                statuses[task_id] = TaskStatus(status)
+        return statuses
+
+    @staticmethod
+    def add_edges(db: Session, task: Task):
+        for parent_id in task.depends_on or []:
+            db.add(TaskDependency(task_id=task.id, depends_on_id=parent_id))
+
+    @staticmethod
+    def remove_edges(db: Session, task_id: str):
+        db.query(TaskDependency).filter(TaskDependency.task_id == task_id).delete(synchronize_session=False)
+
+    @staticmethod
+    def get_children(db: Session, task_id: str, statuses: Optional[tuple] = None) -> List[Task]:
+        query = db.query(Task).join(TaskDependency, TaskDependency.task_id == Task.id).filter(
+            TaskDependency.depends_on_id == task_id
+        )
+        if statuses:
+            query = query.filter(Task.status.in_(statuses))
+        return query.all()
+
+    @staticmethod
+    def release_dependents(db: Session, task_id: str) -> List[Task]:
+        """Move waiting children whose parents have all completed to PENDING"""
+        released = []
+        for child in DependencyOperations.get_children(db, task_id, (TaskStatus.WAITING,)):
+            statuses = DependencyOperations.parent_statuses(db, child.depends_on or [])
+            if all(statuses.get(parent_id) == TaskStatus.COMPLETED for parent_id in child.depends_on or []):
+                # Conditional so two instances releasing the same child don't both report it
+                updated = db.query(Task).filter(
+                    Task.id == child.id,
+                    Task.status == TaskStatus.WAITING
+                ).update({
+                    Task.status: TaskStatus.PENDING,
+                    Task.queued_at: datetime.utcnow()
+                }, synchronize_session=False)
+                if updated:
+                    released.append(child)
+        db.commit()
+        for child in released:
+            db.refresh(child)
+        return released
+
+    @staticmethod
+    def fail_dependents(db: Session, task_id: str) -> List[Task]:
+        """Cascade a failure to every descendant whose policy is "fail".
+
+        Children with the "wait" policy stay WAITING, so restarting the
+        failed parent still lets them run.
+        """
+        failed = []
+        queue = [task_id]
+        now = datetime.utcnow()
+        while queue:
+            parent_id = queue.pop()
+            for child in DependencyOperations.get_children(db, parent_id, (TaskStatus.WAITING,)):
+                if (child.on_dependency_failure or "fail") != "fail":
+                    continue
+                child.status = TaskStatus.FAILED
+                child.error_message = f"{DEPENDENCY_FAILED_PREFIX}{parent_id}"
+                child.completed_at = now
+                failed.append(child)
+                queue.append(child.id)
+        db.commit()
+        return failed
+
+    @staticmethod
+    def reset_dependents(db: Session, task_id: str) -> List[Task]:
+        """Undo a cascade when the task that caused it is restarted"""
+        reset = []
+        queue = [task_id]
+        while queue:
+            parent_id = queue.pop()
+            for child in DependencyOperations.get_children(db, parent_id, (TaskStatus.FAILED,)):
+                if not (child.error_message or "").startswith(DEPENDENCY_FAILED_PREFIX):
+                    continue
+                child.status = TaskStatus.WAITING
+                child.error_message = None
+                child.completed_at = None
+                reset.append(child)
+                queue.append(child.id)
+        db.commit()
+        return reset
+
+class SegmentOperations:
+    @staticmethod
+    def add_segments(db: Session, task: Task, segments: List[dict]) -> List[TaskSegment]:
+        """Record segments reported by the agent.
+
+        The agent reports file names relative to the playlist; they are stored
+        relative to the storage, next to the playlist they belong to.
+        """
+        settings = task.output_settings or {}
+        playlists = {None: settings.get("path")}
+        for index, rendition in enumerate(settings.get("renditions") or []):
+            name = rendition.get("name") or rendition.get("resolution") or f"rendition{index}"
+            playlists[name] = rendition.get("path")
+
+        rows = []
+        for segment in segments:
+            playlist = playlists.get(segment.get("rendition")) or ""
+            row = TaskSegment(
+                task_id=task.id,
+                rendition=segment.get("rendition"),
+                index=segment.get("index", 0),
+                storage=settings.get("storage"),
+                path=posixpath.join(posixpath.dirname(playlist), segment["name"]),
+                duration=segment.get("duration"),
+                size_bytes=segment.get("bytes"),
+                is_init=bool(segment.get("init"))
+            )
+            db.add(row)
+            rows.append(row)
+        db.commit()
+        return rows
+
+    @staticmethod
+    def get_segments(
+        db: Session,
+        task_id: str,
+        rendition: Optional[str] = None,
+        after_id: int = 0
+    ) -> List[TaskSegment]:
+        query = db.query(TaskSegment).filter(TaskSegment.task_id == task_id, TaskSegment.id > after_id)
+        if rendition:
+            query = query.filter(TaskSegment.rendition == rendition)
+        return query.order_by(TaskSegment.id.asc()).all()
+
+    @staticmethod
+    def clear_segments(db: Session, task_id: str) -> int:
+        deleted = db.query(TaskSegment).filter(
+            TaskSegment.task_id == task_id
+        ).delete(synchronize_session=False)
+        db.commit()
+        return deleted
+
+class EventOperations:
+    @staticmethod
+    def publish_event(db: Session, instance_id: str, event_type: str, payload: dict) -> ChangeEvent:
+        event = ChangeEvent(instance_id=instance_id, event_type=event_type, payload=payload)
+        db.add(event)
+        db.commit()
+        return event
+
+    @staticmethod
+    def get_last_event_id(db: Session) -> int:
+        return db.query(func.max(ChangeEvent.id)).scalar() or 0
+
+    @staticmethod
+    def get_events_since(db: Session, last_id: int, exclude_instance: Optional[str] = None, limit: int = 500) -> List[ChangeEvent]:
+        query = db.query(ChangeEvent).filter(ChangeEvent.id > last_id)
+        if exclude_instance:
+            query = query.filter(ChangeEvent.instance_id != exclude_instance)
+        return query.order_by(ChangeEvent.id.asc()).limit(limit).all()
+
+    @staticmethod
+    def purge_events_before(db: Session, cutoff: datetime) -> int:
+        deleted = db.query(ChangeEvent).filter(
+            ChangeEvent.created_at < cutoff
+        ).delete(synchronize_session=False)
+        db.commit()
+        return deleted
+
+class DeliveryOperations:
+    @staticmethod
+    def open_outbox(db: Session, agent_id: str, outbox: Optional[str]) -> int:
+        """Last applied seq of the agent's outbox, starting over at 0 for a new outbox"""
+        delivery = db.query(AgentDelivery).filter(AgentDelivery.agent_id == agent_id).first()
+        if delivery and delivery.outbox == outbox:
+            return delivery.seq
+        if delivery:
+            delivery.outbox = outbox
+            delivery.seq = 0
+        else:
+            db.add(AgentDelivery(agent_id=agent_id, outbox=outbox, seq=0))
+        try:
+            db.commit()
+        except IntegrityError:
+            # Registered by another instance meanwhile
+            db.rollback()
+            return DeliveryOperations.open_outbox(db, agent_id, outbox)
+        return 0
+
+    @staticmethod
+    def confirm(db: Session, agent_id: str, seq: int):
+        """Record seq as applied; never moves back"""
+        db.query(AgentDelivery).filter(
+            AgentDelivery.agent_id == agent_id,
+            AgentDelivery.seq < seq
+        ).update({AgentDelivery.seq: seq, AgentDelivery.updated_at: datetime.utcnow()}, synchronize_session=False)
+        db.commit()
+
+class ArchiveOperations:
+    @staticmethod
+    def archive_finished_tasks(db: Session, cutoff: datetime, batch_size: int = 500) -> List[str]:
+        """Move up to batch_size tasks finished before cutoff into the archive.
+
+        Copy and delete happen in one transaction, so a task is always in
+        exactly one of the two tables.
+        """
+        tasks = db.query(Task).filter(
+            Task.status.in_(FINISHED_STATUSES),
+            Task.completed_at < cutoff
+        ).order_by(Task.completed_at.asc()).limit(batch_size).all()
+        if not tasks:
+            return []
+
+        task_ids = [task.id for task in tasks]
+        segments = {}
+        for segment in db.query(TaskSegment).filter(TaskSegment.task_id.in_(task_ids)).order_by(TaskSegment.id.asc()):
+            segments.setdefault(segment.task_id, []).append(segment.to_dict())
+
+        try:
+            for task in tasks:
+                db.add(ArchivedTask.from_task(task, segments.get(task.id)))
+            db.query(TaskSegment).filter(TaskSegment.task_id.in_(task_ids)).delete(synchronize_session=False)
+            db.query(TaskDependency).filter(TaskDependency.task_id.in_(task_ids)).delete(synchronize_session=False)
+            db.query(Task).filter(Task.id.in_(task_ids)).delete(synchronize_session=False)
+            db.commit()
+        except IntegrityError:
+            # Another orchestrator instance archived the same batch first
+            db.rollback()
+            return []
+        return task_ids
+
+    @staticmethod
+    def get_archived_task(db: Session, task_id: str) -> Optional[ArchivedTask]:
+        return db.query(ArchivedTask).filter(ArchivedTask.id == task_id).first()
+
+    @staticmethod
+    def get_archived_tasks(
+        db: Session,
+        status: Optional[TaskStatus] = None,
+        limit: Optional[int] = None
+    ) -> List[ArchivedTask]:
+        query = db.query(ArchivedTask)
+        if status:
+            query = query.filter(ArchivedTask.status == status.value)
+        query = query.order_by(ArchivedTask.created_at.desc())
+        if limit:
+            query = query.limit(limit)
+        return query.all()
+
+    @staticmethod
+    def purge_archive_before(db: Session, cutoff: datetime, batch_size: int = 500) -> int:
+        """Delete up to batch_size archived tasks archived before cutoff"""
+        ids = db.query(ArchivedTask.id).filter(
+            ArchivedTask.archived_at < cutoff
+        ).order_by(ArchivedTask.archived_at.asc()).limit(batch_size).subquery()
+        deleted = db.query(ArchivedTask).filter(
+            ArchivedTask.id.in_(ids.select())
+        ).delete(synchronize_session=False)
+        db.commit()
+        return deleted
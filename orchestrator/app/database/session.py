@@ -1,16 +1,36 @@
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, event, inspect, text
+from sqlalchemy.exc import OperationalError
 from sqlalchemy.orm import sessionmaker, Session
 from sqlalchemy.ext.declarative import declarative_base
 import os
+import logging
 from typing import Generator
 
+from app.serialization import json_loads, json_text
+
+logger = logging.getLogger(__name__)
+
 DATABASE_URL = os.getenv("DATABASE_URL", "sqlite:///./orchestrator.db")
 
 engine = create_engine(
     DATABASE_URL,
-    connect_args={"check_same_thread": False} if "sqlite" in DATABASE_URL else {}
+    connect_args={"check_same_thread": False} if "sqlite" in DATABASE_URL else {},
+    # JSON columns (settings, payloads of the change feed) use the fast encoder too
+    json_serializer=json_text,
+    json_deserializer=json_loads
 )
 
+if "sqlite" in DATABASE_URL:
+    @event.listens_for(engine, "connect")
+    def _set_sqlite_pragmas(dbapi_connection, connection_record):
+        # WAL lets several orchestrator processes read while one writes,
+        # busy_timeout makes concurrent writers wait instead of failing
+        cursor = dbapi_connection.cursor()
+        cursor.execute("PRAGMA journal_mode=WAL")
+        cursor.execute("PRAGMA synchronous=NORMAL")
+        cursor.execute("PRAGMA busy_timeout=5000")
+        cursor.close()
+
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
 def get_db() -> Generator[Session, None, None]:
@@ -20,6 +40,50 @@ def get_db() -> Generator[Session, None, None]:
     finally:
         db.close()
 
+def _add_missing_columns(base):
+    """Add columns introduced after a table was first created.
+
+    create_all only creates missing tables, so new nullable/defaulted
+    columns on existing tables are added here with ALTER TABLE.
+    """
+    inspector = inspect(engine)
+    with engine.begin() as connection:
+        for table in base.metadata.sorted_tables:
+            if not inspector.has_table(table.name):
+                continue
+            existing = {column["name"] for column in inspector.get_columns(table.name)}
+            for column in table.columns:
+                if column.name in existing:
+                    continue
+                column_type = column.type.compile(dialect=engine.dialect)
+                ddl = f"ALTER TABLE {table.name} ADD COLUMN {column.name} {column_type}"
+                default = column.default.arg if column.default is not None and column.default.is_scalar else None
+                if default is not None:
+                    if hasattr(default, "value"):
+                        default = default.value
+                    ddl += f" DEFAULT {default!r}" if isinstance(default, str) else f" DEFAULT {default}"
+                connection.execute(text(ddl))
+                if column.index:
+                    connection.execute(text(
+                        f"CREATE INDEX IF NOT EXISTS ix_{table.name}_{column.name} ON {table.name} ({column.name})"
+                    ))
+                logger.info(f"Added column {table.name}.{column.name}")
+
 def init_db():
     from app.models.task import Base
-    Base.metadata.create_all(bind=engine)
\ No newline at end of file
+    from app.models.event import ChangeEvent  # noqa: F401 - registers the table
+    from app.models.segment import TaskSegment  # noqa: F401 - registers the table
+    from app.models.archive import ArchivedTask  # noqa: F401 - registers the table
+    from app.models.dependency import TaskDependency  # noqa: F401 - registers the table
+    from app.models.delivery import AgentDelivery  # noqa: F401 - registers the table
+    for attempt in range(5):
+        try:
+            Base.metadata.create_all(bind=engine)
+            _add_missing_columns(Base)
+            return
+        except OperationalError as e:
+            # Another orchestrator instance sharing the database changed the
+            # schema between our existence check and the DDL; look again
+            if attempt == 4:
+                raise
+            logger.info(f"Schema changed concurrently, retrying: {e.orig}")
@@ -1,16 +1,23 @@
-from fastapi import FastAPI, WebSocket, WebSocketDisconnect, Depends, HTTPException
+from fastapi import FastAPI, WebSocket, WebSocketDisconnect, Depends, HTTPException, Request
 from fastapi.middleware.cors import CORSMiddleware
 from sqlalchemy.orm import Session
 from typing import List, Optional
 import json
 import logging
-from datetime import datetime
+from datetime import datetime, timedelta
 
-from app.database import init_db, get_db, TaskOperations
-from app.websocket import ConnectionManager, AgentMessage, OrchestratorMessage, OrchestratorMessageType, AgentMessageType
+from app import config
+from app.cluster import ChangeFeed
+from app.database import init_db, get_db, TaskOperations, SegmentOperations, DeliveryOperations
+from app.database.operations import ACTIVE_STATUSES
+from app.websocket import ConnectionManager, Subscription, AgentMessage, OrchestratorMessage, OrchestratorMessageType, AgentMessageType, negotiate_encoding, encode_message, decode_message
 from app.models.task import Task, TaskStatus, TaskPriority
 from app.api import tasks
-from app.scheduler import TaskScheduler
+from app.api.cache import cached_response
+from app.scheduler import (
+    TaskScheduler, LeaseReaper, TaskArchiver, DependencyResolver, PreemptionLimits,
+    TaskQueue, SpeculationLimits, SpeedModel, CapacityPlanner, build_policy
+)
 
 # Configure logging
 logging.basicConfig(
@@ -33,11 +40,47 @@ app.add_middleware(
 
 # Initialize components
 manager = ConnectionManager()
-scheduler = TaskScheduler(manager)
+scheduler = TaskScheduler(
+    manager,
+    debounce=config.SCHEDULER_DEBOUNCE,
+    sweep_interval=config.SCHEDULER_SWEEP_INTERVAL,
+    preemption=PreemptionLimits(
+        min_runtime=config.PREEMPTION_MIN_RUNTIME,
+        max_per_task=config.PREEMPTION_MAX_PER_TASK,
+        max_progress=config.PREEMPTION_MAX_PROGRESS,
+        max_in_flight=config.PREEMPTION_MAX_IN_FLIGHT,
+        cooldown=config.PREEMPTION_COOLDOWN
+    ) if config.PREEMPTION_ENABLED else None,
+    queue=TaskQueue(build_policy(config.SCHEDULING_POLICY)),
+    resync_interval=config.QUEUE_RESYNC_INTERVAL,
+    speculation=SpeculationLimits(
+        slowdown=config.SPECULATION_SLOWDOWN,
+        min_runtime=config.SPECULATION_MIN_RUNTIME,
+        max_in_flight=config.SPECULATION_MAX_IN_FLIGHT,
+        min_samples=config.SPECULATION_MIN_SAMPLES
+    ) if config.SPECULATION_ENABLED else None,
+    speeds=SpeedModel(history=config.SPECULATION_HISTORY)
+)
+dependencies = DependencyResolver(manager, scheduler)
+reaper = LeaseReaper(manager, scheduler, interval=config.LEASE_REAPER_INTERVAL, dependencies=dependencies)
+capacity = CapacityPlanner(
+    default_source_seconds=config.CAPACITY_DEFAULT_SOURCE_SECONDS,
+    default_throughput=config.CAPACITY_DEFAULT_THROUGHPUT,
+    min_agents=config.CAPACITY_MIN_AGENTS,
+    max_agents=config.CAPACITY_MAX_AGENTS
+)
+archiver = TaskArchiver(
+    manager,
+    archive_after=config.TASK_ARCHIVE_AFTER,
+    interval=config.TASK_ARCHIVE_INTERVAL,
+    batch_size=config.TASK_ARCHIVE_BATCH_SIZE,
+    retention=config.TASK_ARCHIVE_RETENTION
+)
 
 # Make manager and scheduler available globally
 app.state.manager = manager
 app.state.scheduler = scheduler
+app.state.dependencies = dependencies
 
 # Include API routers
 app.include_router(tasks.router, prefix="/api/tasks", tags=["tasks"])
@@ -46,19 +89,192 @@ app.include_router(tasks.router, prefix="/api/tasks", tags=["tasks"])
 async def startup_event():
     init_db()
     logger.info("Database initialized")
+    if config.AGENT_RECONNECT_GRACE > 0:
+        # Agents kept encoding while this instance was down, give them time to reconnect
+        held = reaper.hold(config.AGENT_RECONNECT_GRACE)
+        if held:
+            logger.info(f"Holding {held} in-flight tasks for {config.AGENT_RECONNECT_GRACE:.0f}s for their agents to reconnect")
+
+    if config.CLUSTER_MODE:
+        manager.feed = ChangeFeed(
+            manager,
+            config.INSTANCE_ID,
+            on_task_pending=scheduler.wake,
+            poll_interval=config.CHANGE_FEED_POLL_INTERVAL,
+            retention_seconds=config.CHANGE_FEED_RETENTION,
+            announce_interval=config.INSTANCE_ANNOUNCE_INTERVAL
+        )
+        await manager.feed.start()
+        logger.info(f"Cluster mode enabled, instance {config.INSTANCE_ID}")
+
+    await scheduler.start()
+    await reaper.start()
+    await archiver.start()
+    # Pick up tasks left pending by a previous run
+    scheduler.wake()
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    await archiver.stop()
+    await reaper.stop()
+    await scheduler.stop()
+    if manager.feed:
+        await manager.feed.stop()
 
 @app.get("/")
 async def root():
     return {"message": "Hydra Transcode Orchestrator API", "version": "1.0.0"}
 
+@app.get("/api/queues")
+async def get_queues():
+    """Pending tasks and recent share of every task queue, and the pending
+    tasks no connected agent can encode, as seen by this instance"""
+    return {"policy": config.SCHEDULING_POLICY, **scheduler.queue_stats()}
+
+@app.get("/api/capacity")
+async def get_capacity(drain_seconds: Optional[float] = None, db: Session = Depends(get_db)):
+    """Agents needed to finish the current backlog within drain_seconds, for autoscalers"""
+    drain_seconds = drain_seconds or config.CAPACITY_DRAIN_SECONDS
+    if drain_seconds <= 0:
+        raise HTTPException(status_code=400, detail="drain_seconds must be positive")
+    now = datetime.utcnow()
+    completions = TaskOperations.get_recent_completions(db, now - timedelta(seconds=config.CAPACITY_WINDOW))
+    return capacity.plan(
+        TaskOperations.get_backlog(db),
+        completions,
+        manager.agents_snapshot(),
+        drain_seconds,
+        config.CAPACITY_WINDOW,
+        now
+    )
+
 @app.get("/api/agents")
-async def get_agents():
-    return {
-        "agents": {
-            agent_id: agent.to_dict()
-            for agent_id, agent in manager.agents.items()
-        }
-    }
+async def get_agents(request: Request):
+    entry = manager.read_cache.get(("agents",), lambda: {"agents": manager.agents_snapshot()})
+    return cached_response(request, entry)
+
+async def receive_agent_message(websocket: WebSocket) -> AgentMessage:
+    """Receive one agent frame, text (JSON) or binary (msgpack)"""
+    frame = await websocket.receive()
+    if frame["type"] == "websocket.disconnect":
+        raise WebSocketDisconnect(frame.get("code", 1000))
+    payload = frame.get("bytes")
+    if payload is None:
+        payload = frame.get("text")
+    return AgentMessage(**decode_message(payload))
+
+async def handle_agent_message(agent_id: str, msg: AgentMessage, db: Session):
+    """Apply a single (already unbatched) agent message"""
+    if msg.type == AgentMessageType.HEARTBEAT:
+        recovered = manager.record_heartbeat(agent_id, msg.data.get("load"))
+        TaskOperations.renew_leases(db, agent_id)
+        if recovered:
+            await manager.broadcast_agent_status()
+        # Fresh load figures may have given a saturated idle host headroom again
+        if recovered or manager.is_available(agent_id):
+            scheduler.wake()
+
+    elif msg.type == AgentMessageType.PROGRESS:
+        if msg.task_id:
+            progress = msg.data.get("progress", 0)
+            renditions = msg.data.get("renditions")
+            speed = msg.data.get("speed")
+            task = TaskOperations.update_task_progress(db, msg.task_id, progress, agent_id, renditions, speed)
+            if task:
+                await manager.broadcast_task_update(task.to_dict())
+
+    elif msg.type == AgentMessageType.SEGMENT:
+        if msg.task_id:
+            task = TaskOperations.get_task(db, msg.task_id)
+            if task and task.agent_id == agent_id:
+                rows = SegmentOperations.add_segments(db, task, msg.data.get("segments", []))
+                await manager.broadcast_segments(task.id, [row.to_dict() for row in rows])
+
+    elif msg.type == AgentMessageType.COMPLETE:
+        if msg.task_id:
+            attempt = TaskOperations.get_task(db, msg.task_id)
+            loser = None
+            if attempt and attempt.speculative_agent_id:
+                loser = attempt.speculative_agent_id if attempt.agent_id == agent_id else attempt.agent_id
+            task = TaskOperations.complete_task(db, msg.task_id, agent_id, msg.data.get("timings"))
+            scheduler.preemption_done(msg.task_id)
+            if task:
+                scheduler.task_completed(task)
+                if loser:
+                    logger.info(f"Task {task.id} finished first on agent {agent_id}, stopping the copy on {loser}")
+                    await manager.cancel_on_agent(task.id, loser, reason="superseded")
+                await manager.broadcast_task_update(task.to_dict())
+                await dependencies.task_finished(db, task)
+            # Replayed from the outbox or sent by a losing copy, the report can
+            # come after the agent was given its next task
+            manager.free_agent(agent_id, msg.task_id)
+            await manager.broadcast_agent_status()
+            # Try to assign next task
+            scheduler.wake()
+
+    elif msg.type == AgentMessageType.FAILED:
+        if msg.task_id:
+            error = msg.data.get("error", "Unknown error")
+            task = TaskOperations.fail_task(db, msg.task_id, error, agent_id, msg.data.get("failure"))
+            scheduler.preemption_done(msg.task_id)
+            if task:
+                await manager.broadcast_task_update(task.to_dict())
+                await dependencies.task_finished(db, task)
+            manager.free_agent(agent_id, msg.task_id)
+            await manager.broadcast_agent_status()
+            # Try to assign next task
+            scheduler.wake()
+
+    elif msg.type == AgentMessageType.PREEMPTED:
+        if msg.task_id:
+            task = TaskOperations.preempt_task(db, msg.task_id, agent_id, msg.data.get("resume"))
+            scheduler.preemption_done(msg.task_id)
+            if task:
+                resumed = f" (resumable at {task.resume_state['offset']:.1f}s)" if task.resume_state else ""
+                logger.info(f"Task {task.id} preempted on agent {agent_id}{resumed}")
+                await manager.broadcast_task_update(task.to_dict())
+            # A late report must not free an agent already given its next task
+            manager.free_agent(agent_id, msg.task_id)
+            await manager.broadcast_agent_status()
+            # The freed agent goes to the waiting HIGH task
+            scheduler.wake()
+
+    elif msg.type == AgentMessageType.CANCELLED:
+        # The agent stopped a cancelled task and removed its partial outputs
+        if msg.task_id:
+            scheduler.preemption_done(msg.task_id)
+            logger.info(f"Task {msg.task_id} stopped on agent {agent_id}")
+            manager.free_agent(agent_id, msg.task_id)
+            await manager.broadcast_agent_status()
+            scheduler.wake()
+
+    elif msg.type == AgentMessageType.RECONNECT:
+        # Handle reconnection with existing task
+        task_id = msg.task_id
+        status = msg.data.get("status")
+        if task_id and status == "running":
+            task = TaskOperations.reclaim_task(db, task_id, agent_id)
+            if task:
+                # Continue monitoring the task
+                logger.info(f"Agent {agent_id} is still running task {task_id}")
+                manager.assign_task_to_agent(agent_id, task_id)
+                scheduler.queue.discard(task_id)
+                await manager.broadcast_task_update(task.to_dict())
+            else:
+                # Cancelled, failed, or taken over by another attempt while the agent was away
+                task = TaskOperations.get_task(db, task_id)
+                reason = "superseded" if task and task.status != TaskStatus.CANCELLED \
+                    and task.status != TaskStatus.FAILED else "cancel"
+                logger.info(f"Task {task_id} moved on while agent {agent_id} was away, stopping it ({reason})")
+                await manager.cancel_on_agent(task_id, agent_id, reason=reason)
+        elif task_id and status:
+            task = TaskOperations.get_task(db, task_id)
+            if task and status == "failed":
+                error = msg.data.get("error", "Agent crashed")
+                if TaskOperations.fail_task(db, task_id, error, agent_id):
+                    await dependencies.task_finished(db, task)
+            if task:
+                await manager.broadcast_task_update(task.to_dict())
 
 @app.websocket("/ws/agent")
 async def agent_websocket(websocket: WebSocket, db: Session = Depends(get_db)):
@@ -68,101 +284,102 @@ async def agent_websocket(websocket: WebSocket, db: Session = Depends(get_db)):
         await websocket.accept()
 
         # Wait for initial connect message
-        data = await websocket.receive_json()
-        msg = AgentMessage(**data)
+        msg = await receive_agent_message(websocket)
 
         if msg.type != AgentMessageType.CONNECT:
             await websocket.close(code=1003, reason="First message must be CONNECT")
             return
 
+        # Agents offer the encodings they speak; older agents offer none and stay on JSON
+        encoding = negotiate_encoding(msg.data.get("encodings"))
+
         agent_id = msg.agent_id
-        await manager.connect_agent(websocket, agent_id)
+        # What of its outbox was applied, possibly by another instance before a restart
+        delivered = DeliveryOperations.open_outbox(db, agent_id, msg.data.get("outbox"))
+        await manager.connect_agent(websocket, agent_id, encoding, msg.data.get("capabilities"), delivered)
+        running = msg.data.get("tasks") or []
+        if running:
+            # Busy until its reconnect messages are checked, so nothing else is assigned to it
+            manager.assign_task_to_agent(agent_id, running[0])
 
-        # Send acknowledgment
-        ack = OrchestratorMessage(type=OrchestratorMessageType.ACK, message="Connected")
-        await websocket.send_json(ack.dict())
+        # Send acknowledgment (always JSON, the agent switches encoding on receipt)
+        ack = OrchestratorMessage(
+            type=OrchestratorMessageType.ACK,
+            message="Connected",
+            encoding=encoding.value
+        )
+        await websocket.send_text(encode_message(ack.to_wire()))
 
         # Check if there's a pending task to assign
-        await scheduler.try_assign_tasks(db)
+        scheduler.wake()
 
         # Handle messages from agent
         while True:
-            data = await websocket.receive_json()
-            msg = AgentMessage(**data)
-
-            if msg.type == AgentMessageType.HEARTBEAT:
-                manager.active_connections[agent_id].last_heartbeat = datetime.utcnow()
-
-            elif msg.type == AgentMessageType.PROGRESS:
-                if msg.task_id:
-                    progress = msg.data.get("progress", 0)
-                    task = TaskOperations.update_task_progress(db, msg.task_id, progress)
-                    if task:
-                        await manager.broadcast_task_update(task.to_dict())
-
-            elif msg.type == AgentMessageType.COMPLETE:
-                if msg.task_id:
-                    task = TaskOperations.complete_task(db, msg.task_id)
-                    if task:
-                        await manager.broadcast_task_update(task.to_dict())
-                    manager.free_agent(agent_id)
-                    await manager.broadcast_agent_status()
-                    # Try to assign next task
-                    await scheduler.try_assign_tasks(db)
-
-            elif msg.type == AgentMessageType.FAILED:
-                if msg.task_id:
-                    error = msg.data.get("error", "Unknown error")
-                    task = TaskOperations.fail_task(db, msg.task_id, error)
-                    if task:
-                        await manager.broadcast_task_update(task.to_dict())
-                    manager.free_agent(agent_id)
-                    await manager.broadcast_agent_status()
-                    # Try to assign next task
-                    await scheduler.try_assign_tasks(db)
-
-            elif msg.type == AgentMessageType.RECONNECT:
-                # Handle reconnection with existing task
-                task_id = msg.task_id
-                status = msg.data.get("status")
-                if task_id and status:
-                    task = TaskOperations.get_task(db, task_id)
-                    if task:
-                        if status == "failed":
-                            error = msg.data.get("error", "Agent crashed")
-                            TaskOperations.fail_task(db, task_id, error)
-                        elif status == "running":
-                            # Continue monitoring the task
-                            manager.assign_task_to_agent(agent_id, task_id)
-                        await manager.broadcast_task_update(task.to_dict())
+            msg = await receive_agent_message(websocket)
+            for item in msg.unbatch():
+                if item.seq is None:
+                    await handle_agent_message(agent_id, item, db)
+                    continue
+                # Outbox messages are replayed until confirmed, apply each once
+                if not manager.is_delivered(agent_id, item.seq):
+                    await handle_agent_message(agent_id, item, db)
+                    DeliveryOperations.confirm(db, agent_id, item.seq)
+                await manager.confirm_delivery(agent_id, item.seq)
 
     except WebSocketDisconnect:
         if agent_id:
-            manager.disconnect_agent(agent_id)
-            await manager.broadcast_agent_status()
+            await handle_agent_disconnect(agent_id)
     except Exception as e:
         logger.error(f"Error in agent websocket: {e}")
         if agent_id:
-            manager.disconnect_agent(agent_id)
-            await manager.broadcast_agent_status()
+            await handle_agent_disconnect(agent_id)
+
+async def handle_agent_disconnect(agent_id: str):
+    manager.disconnect_agent(agent_id)
+    await manager.broadcast_agent_status()
+    if config.AGENT_RECONNECT_GRACE > 0:
+        # The agent keeps encoding and reports from its outbox when it is back;
+        # the reaper requeues its tasks if it doesn't reconnect in time
+        reaper.hold(config.AGENT_RECONNECT_GRACE, agent_id)
+    else:
+        await reaper.release_agent(agent_id, f"Agent {agent_id} disconnected")
 
 @app.websocket("/ws/frontend")
-async def frontend_websocket(websocket: WebSocket):
-    await manager.connect_frontend(websocket)
+async def frontend_websocket(websocket: WebSocket, db: Session = Depends(get_db)):
+    client = await manager.connect_frontend(websocket)
+
+    def load_tasks(subscription: Subscription) -> List[dict]:
+        # Without explicit filters the snapshot only carries active tasks
+        statuses = subscription.statuses or (None if subscription.task_ids else ACTIVE_STATUSES)
+        tasks = TaskOperations.find_tasks(
+            db,
+            statuses=list(statuses) if statuses else None,
+            agent_ids=list(subscription.agent_ids),
+            task_ids=list(subscription.task_ids),
+            limit=config.FRONTEND_SNAPSHOT_LIMIT
+        )
+        return [task.to_dict() for task in tasks]
+
     try:
         # Send initial state
-        agents_status = {
-            "type": "agents_update",
-            "agents": {
-                agent_id: agent.to_dict()
-                for agent_id, agent in manager.agents.items()
-            }
-        }
-        await websocket.send_json(agents_status)
-
-        # Keep connection alive
+        await manager.frontend.send_snapshot(client, load_tasks, manager.agents_snapshot())
+
         while True:
-            await websocket.receive_text()
+            try:
+                data = json.loads(await websocket.receive_text())
+            except json.JSONDecodeError:
+                client.send(json.dumps({"type": "error", "message": "Invalid JSON"}))
+                continue
+
+            if data.get("type") == "subscribe":
+                try:
+                    client.subscription = Subscription.from_message(data)
+                except ValueError as e:
+                    client.send(json.dumps({"type": "error", "message": str(e)}))
+                    continue
+                # A new subscription starts from a fresh snapshot
+                db.expire_all()
+                await manager.frontend.send_snapshot(client, load_tasks, manager.agents_snapshot())
 
     except WebSocketDisconnect:
         manager.disconnect_frontend(websocket)
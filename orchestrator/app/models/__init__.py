@@ -1,4 +1,9 @@
 from .task import Task, TaskStatus, TaskPriority
 from .agent import Agent, AgentStatus
+from .event import ChangeEvent
+from .segment import TaskSegment
+from .archive import ArchivedTask
+from .dependency import TaskDependency
+from .delivery import AgentDelivery
 
-__all__ = ['Task', 'TaskStatus', 'TaskPriority', 'Agent', 'AgentStatus']
\ No newline at end of file
+__all__ = ['Task', 'TaskStatus', 'TaskPriority', 'Agent', 'AgentStatus', 'ChangeEvent', 'TaskSegment', 'ArchivedTask', 'TaskDependency', 'AgentDelivery']
\ No newline at end of file
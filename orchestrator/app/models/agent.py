@@ -1,6 +1,6 @@
 from enum import Enum
 from datetime import datetime
-from typing import Optional, Dict, Any
+from typing import Optional, Dict, Any, Iterable
 from pydantic import BaseModel
 
 class AgentStatus(str, Enum):
@@ -18,6 +18,56 @@ class Agent(BaseModel):
     last_heartbeat: Optional[datetime] = None
     storage_mappings: Dict[str, str] = {}
     capabilities: Dict[str, Any] = {}
+    load: Dict[str, Any] = {}
+
+    def saturation_reason(
+        self,
+        max_external_cpu_percent: float = 0,
+        max_load_per_cpu: float = 0,
+        min_free_memory_mb: float = 0,
+        min_free_scratch_mb: float = 0
+    ) -> Optional[str]:
+        """Why the host should not take new work right now, or None.
+
+        Uses the load reported with the last heartbeat; agents that don't
+        report load are never considered saturated. A limit of 0 is disabled.
+        """
+        load = self.load or {}
+
+        external_cpu = load.get("external_cpu_percent")
+        if max_external_cpu_percent and external_cpu is not None and external_cpu > max_external_cpu_percent:
+            return f"external CPU {external_cpu:.0f}% > {max_external_cpu_percent:.0f}%"
+
+        load_avg = load.get("load_avg")
+        cpu_count = load.get("cpu_count") or 1
+        if max_load_per_cpu and load_avg and load_avg[0] / cpu_count > max_load_per_cpu:
+            return f"load {load_avg[0]:.2f} on {cpu_count} CPUs"
+
+        free_memory = load.get("memory_free_bytes")
+        if min_free_memory_mb and free_memory is not None and free_memory < min_free_memory_mb * 1024 * 1024:
+            return f"free memory {free_memory // (1024 * 1024)} MB"
+
+        free_scratch = load.get("scratch_free_bytes")
+        if min_free_scratch_mb and free_scratch is not None and free_scratch < min_free_scratch_mb * 1024 * 1024:
+            return f"free scratch disk {free_scratch // (1024 * 1024)} MB"
+
+        return None
+
+    def supports_codecs(self, codecs: Iterable[str]) -> bool:
+        """Whether the agent's ffmpeg has an encoder for every codec; agents
+        that don't advertise codecs are assumed to support anything"""
+        advertised = (self.capabilities or {}).get("codecs")
+        if advertised is None:
+            return True
+        return all(codec in advertised for codec in codecs)
+
+    def codec_speed(self, codecs: Iterable[str]) -> float:
+        """Calibrated speed of the slowest of codecs on this host, 0 if unknown"""
+        calibration = (self.capabilities or {}).get("calibration") or {}
+        speeds = [(calibration.get(codec) or {}).get("speed") for codec in codecs]
+        if not speeds or not all(speeds):
+            return 0.0
+        return min(speeds)
 
     def to_dict(self) -> Dict[str, Any]:
         return {
@@ -28,5 +78,6 @@ class Agent(BaseModel):
             "current_task_id": self.current_task_id,
             "last_heartbeat": self.last_heartbeat.isoformat() if self.last_heartbeat else None,
             "storage_mappings": self.storage_mappings,
-            "capabilities": self.capabilities
+            "capabilities": self.capabilities,
+            "load": self.load
         }
\ No newline at end of file
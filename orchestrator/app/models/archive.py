@@ -0,0 +1,53 @@
+import zlib
+from datetime import datetime
+from typing import Dict, Any, List, Optional
+from sqlalchemy import Column, String, DateTime, LargeBinary
+
+from app.models.task import Base, Task
+from app.serialization import json_bytes, json_loads
+
+class ArchivedTask(Base):
+    """Finished task moved out of the hot ``tasks`` table.
+
+    Only the columns archive queries filter on are kept as columns; the full
+    task (and its segments, if any) is stored as zlib-compressed JSON.
+    """
+    __tablename__ = "task_archive"
+
+    id = Column(String, primary_key=True)
+    status = Column(String, nullable=False, index=True)
+    priority = Column(String, nullable=True)
+    agent_id = Column(String, nullable=True)
+    created_at = Column(DateTime, nullable=False, index=True)
+    completed_at = Column(DateTime, nullable=True)
+    archived_at = Column(DateTime, default=datetime.utcnow, nullable=False, index=True)
+    payload = Column(LargeBinary, nullable=False)
+
+    @classmethod
+    def from_task(cls, task: Task, segments: Optional[List[Dict[str, Any]]] = None) -> 'ArchivedTask':
+        # The task's payload is shared, extend a copy
+        data = dict(task.to_dict())
+        if segments:
+            data["segments"] = segments
+        return cls(
+            id=task.id,
+            status=task.status.value,
+            priority=task.priority.value if task.priority else None,
+            agent_id=task.agent_id,
+            created_at=task.created_at,
+            completed_at=task.completed_at,
+            payload=zlib.compress(json_bytes(data))
+        )
+
+    def data(self) -> Dict[str, Any]:
+        return json_loads(zlib.decompress(self.payload))
+
+    def to_dict(self) -> Dict[str, Any]:
+        data = self.data()
+        data.pop("segments", None)
+        data["archived"] = True
+        data["archived_at"] = self.archived_at.isoformat() if self.archived_at else None
+        return data
+
+    def segments(self) -> List[Dict[str, Any]]:
+        return self.data().get("segments", [])
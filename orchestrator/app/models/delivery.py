@@ -0,0 +1,18 @@
+from datetime import datetime
+from sqlalchemy import Column, Integer, String, DateTime
+
+from app.models.task import Base
+
+class AgentDelivery(Base):
+    """Last outbox message of an agent that was applied.
+
+    Kept in the database so a restarted orchestrator, or another instance
+    the agent reconnects to, doesn't apply the outbox's replays again.
+    """
+    __tablename__ = "agent_deliveries"
+
+    agent_id = Column(String, primary_key=True)
+    # Id of the agent's outbox; a new one (the agent lost its state) numbers from 1 again
+    outbox = Column(String, nullable=True)
+    seq = Column(Integer, default=0, nullable=False)
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow, nullable=False)
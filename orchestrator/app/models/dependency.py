@@ -0,0 +1,14 @@
+from sqlalchemy import Column, String, ForeignKey
+
+from app.models.task import Base
+
+class TaskDependency(Base):
+    """Edge of a task graph: task_id runs after depends_on_id completes.
+
+    Mirrors ``Task.depends_on`` with an index on the parent so finishing a
+    task finds its children without scanning the tasks table.
+    """
+    __tablename__ = "task_dependencies"
+
+    task_id = Column(String, ForeignKey("tasks.id", ondelete="CASCADE"), primary_key=True)
+    depends_on_id = Column(String, primary_key=True, index=True)
@@ -0,0 +1,24 @@
+from datetime import datetime
+from typing import Dict, Any
+from sqlalchemy import Column, Integer, String, DateTime, JSON
+
+from app.models.task import Base
+
+class ChangeEvent(Base):
+    """Row in the change feed shared by all orchestrator instances"""
+    __tablename__ = "change_events"
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    instance_id = Column(String, nullable=False, index=True)
+    event_type = Column(String, nullable=False)
+    payload = Column(JSON, nullable=False)
+    created_at = Column(DateTime, default=datetime.utcnow, nullable=False, index=True)
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "id": self.id,
+            "instance_id": self.instance_id,
+            "event_type": self.event_type,
+            "payload": self.payload,
+            "created_at": self.created_at.isoformat() if self.created_at else None
+        }
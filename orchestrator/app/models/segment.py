@@ -0,0 +1,34 @@
+from datetime import datetime
+from typing import Dict, Any
+from sqlalchemy import Column, Integer, String, Float, Boolean, DateTime, ForeignKey
+
+from app.models.task import Base
+
+class TaskSegment(Base):
+    """A finished HLS/DASH segment, readable before its task completes"""
+    __tablename__ = "task_segments"
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    task_id = Column(String, ForeignKey("tasks.id", ondelete="CASCADE"), nullable=False, index=True)
+    rendition = Column(String, nullable=True)
+    index = Column(Integer, nullable=False)
+    storage = Column(String, nullable=False)
+    path = Column(String, nullable=False)  # relative to the storage, like output_settings.path
+    duration = Column(Float, nullable=True)
+    size_bytes = Column(Integer, nullable=True)
+    is_init = Column(Boolean, default=False, nullable=False)
+    created_at = Column(DateTime, default=datetime.utcnow, nullable=False)
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "id": self.id,
+            "task_id": self.task_id,
+            "rendition": self.rendition,
+            "index": self.index,
+            "storage": self.storage,
+            "path": self.path,
+            "duration": self.duration,
+            "size_bytes": self.size_bytes,
+            "init": self.is_init,
+            "created_at": self.created_at.isoformat() if self.created_at else None
+        }
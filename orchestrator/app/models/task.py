@@ -1,13 +1,16 @@
 from enum import Enum
 from datetime import datetime
 from typing import Optional, List, Dict, Any
-from sqlalchemy import Column, String, Float, DateTime, JSON, Enum as SQLEnum
+from sqlalchemy import Column, String, Float, Integer, DateTime, JSON, Enum as SQLEnum, event, inspect
 from sqlalchemy.ext.declarative import declarative_base
 import uuid
 
+from app.serialization import EncodedDict
+
 Base = declarative_base()
 
 class TaskStatus(str, Enum):
+    WAITING = "WAITING"  # dependencies not completed yet
     PENDING = "PENDING"
     ASSIGNED = "ASSIGNED"
     RUNNING = "RUNNING"
@@ -25,6 +28,8 @@ class Task(Base):
 
     id = Column(String, primary_key=True, default=lambda: str(uuid.uuid4()))
     priority = Column(SQLEnum(TaskPriority), default=TaskPriority.MEDIUM, nullable=False)
+    # Submitter/tenant tag the scheduler shares agents between
+    queue = Column(String, default="default", nullable=False, index=True)
     status = Column(SQLEnum(TaskStatus), default=TaskStatus.PENDING, nullable=False)
     agent_id = Column(String, nullable=True)
 
@@ -34,26 +39,114 @@ class Task(Base):
 
     # Progress tracking
     progress = Column(Float, default=0.0)
+    rendition_progress = Column(JSON, nullable=True)  # {"720p": {"progress": 42.0, "bytes_written": ...}}
 
     # Timestamps
     created_at = Column(DateTime, default=datetime.utcnow, nullable=False)
+    # Last time the task entered PENDING (or changed while pending), so the
+    # scheduler only has to load what changed since its last look
+    queued_at = Column(DateTime, default=datetime.utcnow, nullable=True, index=True)
     started_at = Column(DateTime, nullable=True)
     completed_at = Column(DateTime, nullable=True)
+    # Agent-side staging: {"stage_in_seconds", "encode_seconds", "publish_seconds", "bytes_in", ...}
+    io_timings = Column(JSON, nullable=True)
+
+    # Dependency graph: parent task ids that must complete before this task
+    # is released to the queue, and what to do if one of them fails
+    # ("fail" cascades the failure, "wait" keeps waiting for a restart)
+    depends_on = Column(JSON, nullable=True)
+    on_dependency_failure = Column(String, default="fail", nullable=False)
+    # Failures reported by an agent are retried this many times, unless the
+    # agent classified them as permanent
+    max_retries = Column(Integer, default=0, nullable=False)
+    # Last failure: "transient", "permanent" or "unknown", the agent's reason
+    # ("out_of_memory", "invalid_input", ...) and the tail of ffmpeg's stderr
+    failure_kind = Column(String, nullable=True)
+    failure_reason = Column(String, nullable=True)
+    failure_stderr = Column(JSON, nullable=True)
+    # A retry waits in PENDING until this time (backoff)
+    next_attempt_at = Column(DateTime, nullable=True)
+    # Enforced by the agent per run: total wall-clock seconds and seconds
+    # without progress before it stops ffmpeg (0 = no limit)
+    timeout_seconds = Column(Float, default=0.0, nullable=False)
+    stall_timeout_seconds = Column(Float, default=0.0, nullable=False)
+
+    # Preemption: how often the task was stopped for higher-priority work and
+    # what the next attempt can resume from ({"offset": seconds, "parts": [...]})
+    preempt_count = Column(Integer, default=0, nullable=False)
+    resume_state = Column(JSON, nullable=True)
+
+    # Speculative execution: a second agent running a copy of a straggling
+    # task (the first attempt to finish wins), and the last encode speed the
+    # agent reported (source seconds per second)
+    speculative_agent_id = Column(String, nullable=True, index=True)
+    speculative_progress = Column(Float, nullable=True)
+    encode_speed = Column(Float, nullable=True)
+
+    # Lease held by the assigned agent, renewed by heartbeats and progress
+    lease_expires_at = Column(DateTime, nullable=True)
+    # Requeues after a lost lease or agent (limited by TASK_MAX_REQUEUES),
+    # separate from the retries after failures (limited by max_retries)
+    requeue_count = Column(Integer, default=0, nullable=False)
+    retry_count = Column(Integer, default=0, nullable=False)
 
     # Error handling
     error_message = Column(String, nullable=True)
 
     def to_dict(self) -> Dict[str, Any]:
+        """The task's payload, built once per loaded state of the row.
+
+        Sending, broadcasting and publishing a task share one dict, and its
+        JSON encoding (see EncodedDict), so it must not be changed in place;
+        copy it to extend it. Setting a column, or expiring or reloading the
+        row (every commit does), rebuilds both.
+        """
+        payload = self.__dict__.get("_payload")
+        if payload is None:
+            payload = EncodedDict(self._build_dict())
+            self.__dict__["_payload"] = payload
+        return payload
+
+    def _build_dict(self) -> Dict[str, Any]:
         return {
             "id": self.id,
             "priority": self.priority.value if self.priority else None,
+            "queue": self.queue or "default",
             "status": self.status.value if self.status else None,
             "agent_id": self.agent_id,
             "input_files": self.input_files,
             "output_settings": self.output_settings,
             "progress": self.progress,
+            "rendition_progress": self.rendition_progress,
             "created_at": self.created_at.isoformat() if self.created_at else None,
+            "queued_at": self.queued_at.isoformat() if self.queued_at else None,
             "started_at": self.started_at.isoformat() if self.started_at else None,
             "completed_at": self.completed_at.isoformat() if self.completed_at else None,
+            "io_timings": self.io_timings,
+            "lease_expires_at": self.lease_expires_at.isoformat() if self.lease_expires_at else None,
+            "requeue_count": self.requeue_count or 0,
+            "retry_count": self.retry_count or 0,
+            "max_retries": self.max_retries or 0,
+            "failure_kind": self.failure_kind,
+            "failure_reason": self.failure_reason,
+            "failure_stderr": self.failure_stderr,
+            "next_attempt_at": self.next_attempt_at.isoformat() if self.next_attempt_at else None,
+            "timeout_seconds": self.timeout_seconds or 0.0,
+            "stall_timeout_seconds": self.stall_timeout_seconds or 0.0,
+            "depends_on": self.depends_on or [],
+            "on_dependency_failure": self.on_dependency_failure or "fail",
+            "preempt_count": self.preempt_count or 0,
+            "resume_state": self.resume_state,
+            "speculative_agent_id": self.speculative_agent_id,
+            "speculative_progress": self.speculative_progress,
+            "encode_speed": self.encode_speed,
             "error_message": self.error_message
-        }
\ No newline at end of file
+        }
+
+def _drop_payload(task: Task, *args):
+    task.__dict__.pop("_payload", None)
+
+for _event in ("load", "refresh", "refresh_flush", "expire"):
+    event.listen(Task, _event, _drop_payload)
+for _column in inspect(Task).column_attrs:
+    event.listen(getattr(Task, _column.key), "set", _drop_payload)
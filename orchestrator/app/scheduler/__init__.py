@@ -1,3 +1,16 @@
 from .scheduler import TaskScheduler
+from .reaper import LeaseReaper
+from .archiver import TaskArchiver
+from .dependencies import DependencyResolver
+from .preemption import PreemptionLimits, select_preemption_victims, plan_preemptions
+from .queue import (
+    TaskQueue, QueuedTask, PriorityFifoPolicy, FairSharePolicy, CostAwarePolicy, build_policy, required_codecs, pick_agent,
+    place_tasks
+)
+from .speculation import SpeculationLimits, SpeedModel, select_stragglers
+from .capacity import CapacityPlanner, output_cost, task_work
 
-__all__ = ['TaskScheduler']
\ No newline at end of file
+__all__ = ['TaskScheduler', 'LeaseReaper', 'TaskArchiver', 'DependencyResolver', 'PreemptionLimits', 'select_preemption_victims',
+           'plan_preemptions',
+           'TaskQueue', 'QueuedTask', 'PriorityFifoPolicy', 'FairSharePolicy', 'CostAwarePolicy', 'build_policy', 'required_codecs', 'pick_agent', 'place_tasks',
+           'SpeculationLimits', 'SpeedModel', 'select_stragglers', 'CapacityPlanner', 'output_cost', 'task_work']
\ No newline at end of file
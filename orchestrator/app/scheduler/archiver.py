@@ -0,0 +1,90 @@
+import asyncio
+import logging
+from datetime import datetime, timedelta
+from typing import Optional
+
+from app.database import SessionLocal, ArchiveOperations
+
+logger = logging.getLogger(__name__)
+
+class TaskArchiver:
+    """Moves finished tasks out of the hot table and enforces archive retention.
+
+    Work is done in batches of ``batch_size`` rows, one transaction each,
+    yielding to the event loop in between so agents and the API are never
+    blocked behind a long write.
+    """
+
+    def __init__(
+        self,
+        connection_manager,
+        archive_after: float,
+        interval: float = 60.0,
+        batch_size: int = 500,
+        retention: float = 0,
+        max_batches: int = 20
+    ):
+        self.manager = connection_manager
+        self.archive_after = archive_after
+        self.interval = interval
+        self.batch_size = batch_size
+        self.retention = retention
+        self.max_batches = max_batches
+        self._task: Optional[asyncio.Task] = None
+
+    async def start(self):
+        if self.archive_after <= 0 and self.retention <= 0:
+            return
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            self._task = None
+
+    async def _run(self):
+        while True:
+            try:
+                await self.run_once()
+            except Exception as e:
+                logger.error(f"Task archiver error: {e}")
+            await asyncio.sleep(self.interval)
+
+    async def run_once(self) -> int:
+        """Archive up to max_batches batches, then purge expired archive rows"""
+        archived = 0
+        if self.archive_after > 0:
+            cutoff = datetime.utcnow() - timedelta(seconds=self.archive_after)
+            for _ in range(self.max_batches):
+                db = SessionLocal()
+                try:
+                    task_ids = ArchiveOperations.archive_finished_tasks(db, cutoff, self.batch_size)
+                finally:
+                    db.close()
+                archived += len(task_ids)
+                if len(task_ids) < self.batch_size:
+                    break
+                await asyncio.sleep(0)
+
+        if archived:
+            logger.info(f"Archived {archived} finished tasks")
+            self.manager.read_cache.invalidate_task()
+
+        if self.retention > 0:
+            cutoff = datetime.utcnow() - timedelta(seconds=self.retention)
+            purged = 0
+            for _ in range(self.max_batches):
+                db = SessionLocal()
+                try:
+                    deleted = ArchiveOperations.purge_archive_before(db, cutoff, self.batch_size)
+                finally:
+                    db.close()
+                purged += deleted
+                if deleted < self.batch_size:
+                    break
+                await asyncio.sleep(0)
+            if purged:
+                logger.info(f"Purged {purged} archived tasks past retention")
+                self.manager.read_cache.invalidate_task()
+
+        return archived
@@ -0,0 +1,197 @@
+import math
+from datetime import datetime
+from statistics import median
+from typing import Dict, Iterable, List, Optional
+
+from app.models.task import TaskPriority, TaskStatus
+
+# Encode cost per codec relative to h264 at the same size and preset
+CODEC_COST = {"h264": 1.0, "h265": 2.5, "vp9": 3.0}
+# One unit of work is one second of source encoded to 1080p h264
+REFERENCE_PIXELS = 1920 * 1080
+# Size of the agents' calibration encode (CapabilityProbe.calibration_size)
+CALIBRATION_PIXELS = 1280 * 720
+
+PRIORITY_ORDER = (TaskPriority.HIGH, TaskPriority.MEDIUM, TaskPriority.LOW)
+
+def _pixel_factor(resolution: Optional[str]) -> float:
+    try:
+        width, height = (int(part) for part in resolution.lower().split("x"))
+    except (AttributeError, ValueError):
+        # Source size: unknown here, assume 1080p
+        return 1.0
+    return width * height / REFERENCE_PIXELS
+
+def output_cost(output_settings: Optional[Dict]) -> float:
+    """Work per second of source: every rendition's size times its codec cost"""
+    settings = output_settings or {}
+    default = settings.get("codec", "h264")
+    outputs = settings.get("renditions") or [settings]
+    return sum(
+        CODEC_COST.get(output.get("codec", default), 1.0) * _pixel_factor(output.get("resolution"))
+        for output in outputs
+    )
+
+def source_seconds(input_files: Optional[List[Dict]]) -> Optional[float]:
+    """Length of the (trimmed) inputs, None unless every input has an end"""
+    total = 0.0
+    for item in input_files or []:
+        end = item.get("end") if isinstance(item, dict) else None
+        if end is None:
+            return None
+        total += max(float(end) - float(item.get("start") or 0.0), 0.0)
+    return total or None
+
+def task_work(input_files: Optional[List[Dict]], output_settings: Optional[Dict], default_source_seconds: float) -> float:
+    """Estimated work of a task, its source taken as default_source_seconds long unless trimmed"""
+    return (source_seconds(input_files) or default_source_seconds) * output_cost(output_settings)
+
+class CapacityPlanner:
+    """Agents needed to finish the backlog within a target drain time.
+
+    The backlog is every waiting, pending and in-flight task, in units of
+    work: seconds of source times ``output_cost`` (1080p h264 = 1 per
+    second, scaled by pixels and codec). Inputs without a trimmed length
+    are assumed to be as long as the median source completed recently, or
+    ``default_source_seconds``.
+
+    Throughput is what each agent actually delivered over the recent
+    completions: work per second of encoding, the median per agent and
+    then across agents, so one odd task or host doesn't skew it. Without
+    completions the agents' calibration speeds stand in, then
+    ``default_throughput``. Only ffmpeg time counts, staging is not part of
+    the estimate.
+    """
+
+    def __init__(
+        self,
+        default_source_seconds: float = 600.0,
+        default_throughput: float = 1.0,
+        min_agents: int = 0,
+        max_agents: int = 0
+    ):
+        self.default_source_seconds = default_source_seconds
+        self.default_throughput = default_throughput
+        self.min_agents = min_agents
+        self.max_agents = max_agents  # 0 = no limit
+
+    @staticmethod
+    def _completion_stats(completions: Iterable) -> Dict:
+        """Per-agent throughput and source lengths of completed task rows
+        (agent_id, input_files, output_settings, encode_speed, io_timings)"""
+        per_agent: Dict[str, List[float]] = {}
+        lengths = []
+        count = 0
+        for agent_id, input_files, output_settings, speed, timings in completions:
+            count += 1
+            encode_seconds = (timings or {}).get("encode_seconds") or 0.0
+            length = source_seconds(input_files)
+            if length is None and speed and encode_seconds:
+                length = speed * encode_seconds
+            if length:
+                lengths.append(length)
+            if speed:
+                rate = speed
+            elif length and encode_seconds:
+                rate = length / encode_seconds
+            else:
+                continue
+            per_agent.setdefault(agent_id or "unknown", []).append(rate * output_cost(output_settings))
+        return {
+            "completed": count,
+            "agents": {agent_id: median(rates) for agent_id, rates in per_agent.items()},
+            "source_seconds": median(lengths) if lengths else None
+        }
+
+    @staticmethod
+    def _calibrated_throughput(agents: Dict[str, Dict]) -> Optional[float]:
+        speeds = []
+        for agent in agents.values():
+            calibration = (agent.get("capabilities") or {}).get("calibration") or {}
+            speed = (calibration.get("h264") or {}).get("speed")
+            if speed:
+                speeds.append(speed * CALIBRATION_PIXELS / REFERENCE_PIXELS)
+        return median(speeds) if speeds else None
+
+    def _agents_for(self, work: float, tasks: int, throughput: float, drain_seconds: float) -> int:
+        # A task runs on one agent, more agents than tasks don't help
+        return min(math.ceil(work / (throughput * drain_seconds)), tasks) if work > 0 else 0
+
+    def plan(
+        self,
+        backlog: Iterable,
+        completions: Iterable,
+        agents: Dict[str, Dict],
+        drain_seconds: float,
+        window_seconds: float,
+        now: Optional[datetime] = None
+    ) -> Dict:
+        """The sizing signal for backlog rows (status, priority, progress,
+        input_files, output_settings), completions within the last
+        window_seconds and the agents snapshot"""
+        now = now or datetime.utcnow()
+        completed = self._completion_stats(completions)
+        if completed["agents"]:
+            throughput, source = median(completed["agents"].values()), "observed"
+        else:
+            throughput = self._calibrated_throughput(agents)
+            source = "calibration"
+            if not throughput:
+                throughput, source = self.default_throughput, "default"
+        default_length = completed["source_seconds"] or self.default_source_seconds
+
+        priorities = {priority: {"tasks": 0, "work": 0.0} for priority in PRIORITY_ORDER}
+        statuses = {status.value: 0 for status in (TaskStatus.WAITING, TaskStatus.PENDING, TaskStatus.ASSIGNED, TaskStatus.RUNNING)}
+        longest = 0.0
+        for status, priority, progress, input_files, output_settings in backlog:
+            work = task_work(input_files, output_settings, default_length)
+            if status in (TaskStatus.ASSIGNED, TaskStatus.RUNNING):
+                work *= max(100.0 - (progress or 0.0), 0.0) / 100.0
+            statuses[status.value] += 1
+            entry = priorities[priority]
+            entry["tasks"] += 1
+            entry["work"] += work
+            longest = max(longest, work)
+
+        # Cumulative: agents to drain HIGH, then HIGH and MEDIUM, then everything
+        by_priority = {}
+        tasks, work = 0, 0.0
+        for priority in PRIORITY_ORDER:
+            tasks += priorities[priority]["tasks"]
+            work += priorities[priority]["work"]
+            by_priority[priority.value] = {
+                "tasks": priorities[priority]["tasks"],
+                "work": round(priorities[priority]["work"], 1),
+                "agents_to_drain": self._agents_for(work, tasks, throughput, drain_seconds)
+            }
+
+        recommended = max(self._agents_for(work, tasks, throughput, drain_seconds), self.min_agents)
+        if self.max_agents:
+            recommended = min(recommended, self.max_agents)
+        connected = [agent for agent in agents.values() if agent.get("status") in ("ONLINE", "BUSY")]
+        busy = sum(1 for agent in connected if agent.get("status") == "BUSY")
+        return {
+            "generated_at": now.isoformat(),
+            "drain_seconds": drain_seconds,
+            "recommended_agents": recommended,
+            "agents": {"connected": len(connected), "busy": busy, "delta": recommended - len(connected)},
+            "backlog": {
+                "tasks": tasks,
+                "statuses": statuses,
+                "work": round(work, 1),
+                # With every agent on it, the backlog takes at least its longest task
+                "longest_task_seconds": round(longest / throughput, 1),
+                "drain_seconds_at_current_size": round(
+                    max(work / (throughput * len(connected)), longest / throughput), 1
+                ) if connected else None
+            },
+            "by_priority": by_priority,
+            "throughput": {
+                "per_agent": round(throughput, 3),
+                "source": source,
+                "agents": {agent_id: round(rate, 3) for agent_id, rate in completed["agents"].items()},
+                "completed": completed["completed"],
+                "completions_per_hour": round(completed["completed"] * 3600 / window_seconds, 1) if window_seconds else None,
+                "assumed_source_seconds": round(default_length, 1)
+            }
+        }
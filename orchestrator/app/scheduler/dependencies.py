@@ -0,0 +1,33 @@
+import logging
+
+from sqlalchemy.orm import Session
+
+from app.database import DependencyOperations
+from app.models.task import Task, TaskStatus
+
+logger = logging.getLogger(__name__)
+
+class DependencyResolver:
+    """Releases or fails the children of a task once it reaches a final state"""
+
+    def __init__(self, connection_manager, scheduler):
+        self.manager = connection_manager
+        self.scheduler = scheduler
+
+    async def task_finished(self, db: Session, task: Task):
+        if task.status == TaskStatus.COMPLETED:
+            released = DependencyOperations.release_dependents(db, task.id)
+            for child in released:
+                logger.info(f"Task {child.id} released, dependencies of {task.id} completed")
+                await self.manager.broadcast_task_update(child.to_dict())
+            if released:
+                self.scheduler.wake()
+        elif task.status in (TaskStatus.FAILED, TaskStatus.CANCELLED):
+            for child in DependencyOperations.fail_dependents(db, task.id):
+                logger.info(f"Task {child.id} failed, dependency {task.id} is {task.status.value}")
+                await self.manager.broadcast_task_update(child.to_dict())
+
+    async def task_restarted(self, db: Session, task: Task):
+        """A failed task runs again: descendants failed by its cascade wait for it again"""
+        for child in DependencyOperations.reset_dependents(db, task.id):
+            await self.manager.broadcast_task_update(child.to_dict())
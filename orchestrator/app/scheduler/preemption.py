@@ -0,0 +1,84 @@
+from datetime import datetime
+from typing import Callable, Collection, Iterable, List, Optional
+
+from app.database.operations import PRIORITY_RANK
+from app.models.task import Task, TaskPriority
+
+class PreemptionLimits:
+    """Guards against preemption thrash (0 disables a limit)"""
+
+    def __init__(
+        self,
+        min_runtime: float = 60.0,
+        max_per_task: int = 2,
+        max_progress: float = 90.0,
+        max_in_flight: int = 2,
+        cooldown: float = 30.0
+    ):
+        self.min_runtime = min_runtime  # seconds a victim must have been running
+        self.max_per_task = max_per_task  # times a single task may be preempted
+        self.max_progress = max_progress  # tasks this far along are left to finish
+        self.max_in_flight = max_in_flight  # preemptions waiting for their agent at once
+        self.cooldown = cooldown  # seconds between two rounds of preemption
+
+def select_preemption_victims(
+    running: Iterable[Task],
+    count: int,
+    waiting_priority: TaskPriority,
+    limits: PreemptionLimits,
+    exclude: Iterable[str] = (),
+    now: Optional[datetime] = None
+) -> List[Task]:
+    """Pick up to count running tasks to stop for work of waiting_priority.
+
+    Only strictly lower priorities are eligible. The lowest priority goes
+    first, then the task with the least progress, so the least work is put
+    off.
+    """
+    now = now or datetime.utcnow()
+    excluded = set(exclude)
+    rank = PRIORITY_RANK[waiting_priority]
+    candidates = []
+    for task in running:
+        if task.id in excluded or PRIORITY_RANK[task.priority] >= rank:
+            continue
+        if task.speculative_agent_id:
+            # Two agents on it already; it is about to free one of them
+            continue
+        if limits.max_per_task and (task.preempt_count or 0) >= limits.max_per_task:
+            continue
+        if limits.max_progress and (task.progress or 0) >= limits.max_progress:
+            continue
+        if limits.min_runtime and (not task.started_at or (now - task.started_at).total_seconds() < limits.min_runtime):
+            continue
+        candidates.append(task)
+    candidates.sort(key=lambda task: (PRIORITY_RANK[task.priority], task.progress or 0))
+    return candidates[:max(count, 0)]
+
+
+def plan_preemptions(
+    waiting: Callable[[], int],
+    running: Callable[[], Iterable[Task]],
+    preempting: Collection[str],
+    limits: PreemptionLimits,
+    now: datetime,
+    last_preemption: Optional[datetime] = None
+) -> List[Task]:
+    """One round of preemption for HIGH tasks that found no free agent, as
+    TaskScheduler and the simulator run it.
+
+    No round starts within ``limits.cooldown`` of the last one. Every
+    preemption still in flight (``preempting``) will free an agent for one
+    of the ``waiting()`` tasks already, and at most ``limits.max_in_flight``
+    may be in flight at once. Victims are picked from ``running()`` by
+    select_preemption_victims. Both are only loaded when a round is due.
+    """
+    if limits.cooldown and last_preemption is not None \
+            and (now - last_preemption).total_seconds() < limits.cooldown:
+        return []
+    needed = waiting() - len(preempting)
+    if limits.max_in_flight:
+        needed = min(needed, limits.max_in_flight - len(preempting))
+    if needed <= 0:
+        return []
+    return select_preemption_victims(running(), needed, TaskPriority.HIGH, limits, exclude=preempting, now=now)
@@ -0,0 +1,321 @@
+import heapq
+from datetime import datetime, timedelta
+from typing import Callable, Dict, FrozenSet, Iterable, List, Optional, Tuple
+
+from app import config
+from app.database.operations import PRIORITY_RANK
+from app.models.agent import Agent
+from app.models.task import TaskPriority
+
+DEFAULT_QUEUE = "default"
+TOP_RANK = max(PRIORITY_RANK.values())
+
+def required_codecs(output_settings: Optional[Dict]) -> FrozenSet[str]:
+    """Video codecs an agent must be able to encode to run a task"""
+    settings = output_settings or {}
+    # Agents encode h264 unless told otherwise
+    default = settings.get("codec", "h264")
+    renditions = settings.get("renditions")
+    if renditions:
+        return frozenset(rendition.get("codec", default) for rendition in renditions)
+    return frozenset([default])
+
+def pick_agent(agents: Dict[str, Agent], agent_ids: List[str], codecs: FrozenSet[str]) -> Optional[str]:
+    """The agent of agent_ids that encodes codecs fastest; ties keep the given order"""
+    best, best_speed = None, -1.0
+    for agent_id in agent_ids:
+        agent = agents.get(agent_id)
+        if not agent or not agent.supports_codecs(codecs):
+            continue
+        speed = agent.codec_speed(codecs)
+        if speed > best_speed:
+            best, best_speed = agent_id, speed
+    return best
+
+class QueuedTask:
+    """What the scheduler needs to know about a pending task"""
+
+    __slots__ = ("id", "queue", "priority", "created_at", "not_before", "codecs", "cost")
+
+    def __init__(
+        self,
+        task_id: str,
+        queue: Optional[str],
+        priority: TaskPriority,
+        created_at: datetime,
+        not_before: Optional[datetime] = None,
+        codecs: FrozenSet[str] = frozenset(),
+        cost: float = 0.0
+    ):
+        self.id = task_id
+        self.queue = queue or DEFAULT_QUEUE
+        self.priority = priority
+        self.created_at = created_at
+        # Retry backoff: not eligible before this time
+        self.not_before = not_before
+        # Only agents with encoders for these can run it
+        self.codecs = codecs
+        # Estimated work (see capacity.task_work), for cost-aware ordering
+        self.cost = cost
+
+    def key(self) -> Tuple:
+        return (self.queue, self.priority, self.created_at, self.not_before, self.cost)
+
+class PriorityFifoPolicy:
+    """Strict priority, then oldest first: the order before fair sharing"""
+
+    def level(self, task: QueuedTask, now: datetime) -> int:
+        return PRIORITY_RANK[task.priority]
+
+    def order(self, task: QueuedTask) -> datetime:
+        """Position of a task among those of its queue and priority"""
+        return task.created_at
+
+    def select(self, heads: List[QueuedTask], now: datetime) -> QueuedTask:
+        return min(heads, key=lambda task: (-self.level(task, now), self.order(task)))
+
+    def charge(self, queue: str, now: datetime):
+        pass
+
+    def stats(self, now: datetime) -> Dict[str, Dict]:
+        return {}
+
+class FairSharePolicy(PriorityFifoPolicy):
+    """Weighted fair sharing between queues, with priority aging.
+
+    A task gains one priority level for every ``aging_seconds`` it has
+    waited, up to HIGH, so LOW work is never starved for good. Among the
+    queues whose best task has the highest level, the one that received the
+    least service relative to its weight goes next. Service is the number of
+    assignments, decayed with ``half_life`` so past bursts are forgiven.
+    """
+
+    def __init__(
+        self,
+        weights: Optional[Dict[str, float]] = None,
+        aging_seconds: float = 900.0,
+        half_life: float = 300.0
+    ):
+        self.weights = dict(weights or {})
+        self.aging_seconds = aging_seconds
+        self.half_life = half_life
+        # Queue -> (decayed assignment count, time it was last decayed)
+        self.usage: Dict[str, Tuple[float, datetime]] = {}
+
+    def level(self, task: QueuedTask, now: datetime) -> int:
+        rank = PRIORITY_RANK[task.priority]
+        if self.aging_seconds <= 0:
+            return rank
+        waited = max((now - task.created_at).total_seconds(), 0.0)
+        return min(rank + int(waited // self.aging_seconds), TOP_RANK)
+
+    def weight(self, queue: str) -> float:
+        return self.weights.get(queue, 1.0)
+
+    def decayed_usage(self, queue: str, now: datetime) -> float:
+        if queue not in self.usage:
+            return 0.0
+        value, at = self.usage[queue]
+        if self.half_life <= 0:
+            return value
+        elapsed = max((now - at).total_seconds(), 0.0)
+        return value * 0.5 ** (elapsed / self.half_life)
+
+    def select(self, heads: List[QueuedTask], now: datetime) -> QueuedTask:
+        return min(heads, key=lambda task: (
+            -self.level(task, now),
+            self.decayed_usage(task.queue, now) / self.weight(task.queue),
+            self.order(task)
+        ))
+
+    def charge(self, queue: str, now: datetime):
+        self.usage[queue] = (self.decayed_usage(queue, now) + 1.0, now)
+
+    def stats(self, now: datetime) -> Dict[str, Dict]:
+        return {
+            queue: {"usage": round(self.decayed_usage(queue, now), 3), "weight": self.weight(queue)}
+            for queue in self.usage
+        }
+
+class CostAwarePolicy(FairSharePolicy):
+    """Fair sharing and aging, with cheap tasks ahead of expensive ones.
+
+    Tasks are ordered by a virtual arrival time: their creation plus
+    ``cost_weight`` seconds per unit of estimated work, so a short encode
+    overtakes long ones submitted shortly before it. A task is only ever
+    overtaken by tasks arriving within its own shift, so even the most
+    expensive one can't be starved by a stream of cheap ones.
+    """
+
+    def __init__(
+        self,
+        weights: Optional[Dict[str, float]] = None,
+        aging_seconds: float = 900.0,
+        half_life: float = 300.0,
+        cost_weight: float = 1.0
+    ):
+        super().__init__(weights, aging_seconds, half_life)
+        self.cost_weight = cost_weight
+
+    def order(self, task: QueuedTask) -> datetime:
+        return task.created_at + timedelta(seconds=task.cost * self.cost_weight)
+
+def build_policy(name: str) -> PriorityFifoPolicy:
+    """The queue policy called name ("fifo", "fair" or "cost"), set up from config"""
+    if name == "fifo":
+        return PriorityFifoPolicy()
+    if name == "cost":
+        return CostAwarePolicy(
+            weights=config.QUEUE_WEIGHTS,
+            aging_seconds=config.PRIORITY_AGING_SECONDS,
+            half_life=config.FAIR_SHARE_HALF_LIFE,
+            cost_weight=config.COST_POLICY_WEIGHT
+        )
+    return FairSharePolicy(
+        weights=config.QUEUE_WEIGHTS,
+        aging_seconds=config.PRIORITY_AGING_SECONDS,
+        half_life=config.FAIR_SHARE_HALF_LIFE
+    )
+
+class TaskQueue:
+    """In-memory index of pending tasks, ordered by a pluggable policy.
+
+    Tasks are kept in one heap per (queue, priority), in the policy's order
+    (oldest first by default), so the policy only has to compare the head
+    of each heap to pick the next task.
+    Removal is lazy: stale heap items are skipped when they reach the top.
+    Tasks backing off before a retry wait in a separate heap ordered by
+    ``not_before`` and join their queue once due.
+    """
+
+    def __init__(self, policy: Optional[PriorityFifoPolicy] = None):
+        self.policy = policy or PriorityFifoPolicy()
+        self.entries: Dict[str, QueuedTask] = {}
+        self.heaps: Dict[Tuple[str, TaskPriority], List[Tuple[datetime, str]]] = {}
+        self.delayed: List[Tuple[datetime, str]] = []
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    def __contains__(self, task_id: str) -> bool:
+        return task_id in self.entries
+
+    def push(self, task: QueuedTask):
+        """Add a task, or update it if its queue, priority or backoff changed"""
+        current = self.entries.get(task.id)
+        self.entries[task.id] = task
+        if current and current.key() == task.key():
+            return
+        if task.not_before:
+            heapq.heappush(self.delayed, (task.not_before, task.id))
+        else:
+            self._enqueue(task)
+
+    def _enqueue(self, task: QueuedTask):
+        heapq.heappush(self.heaps.setdefault((task.queue, task.priority), []), (self.policy.order(task), task.id))
+
+    def extend(self, tasks: Iterable[QueuedTask]):
+        for task in tasks:
+            self.push(task)
+
+    def discard(self, task_id: str):
+        self.entries.pop(task_id, None)
+
+    def clear(self):
+        self.entries.clear()
+        self.heaps.clear()
+        self.delayed.clear()
+
+    def _promote(self, now: datetime):
+        """Move tasks whose backoff has expired into their queue"""
+        while self.delayed and self.delayed[0][0] <= now:
+            not_before, task_id = heapq.heappop(self.delayed)
+            task = self.entries.get(task_id)
+            if task and task.not_before == not_before:
+                self._enqueue(task)
+
+    def _head(self, key: Tuple[str, TaskPriority], now: datetime) -> Optional[QueuedTask]:
+        heap = self.heaps[key]
+        while heap:
+            order, task_id = heap[0]
+            task = self.entries.get(task_id)
+            if task and (task.queue, task.priority, self.policy.order(task)) == (key[0], key[1], order) \
+                    and (task.not_before is None or task.not_before <= now):
+                return task
+            heapq.heappop(heap)
+        del self.heaps[key]
+        return None
+
+    def peek(self, now: Optional[datetime] = None) -> Optional[QueuedTask]:
+        now = now or datetime.utcnow()
+        self._promote(now)
+        heads = [head for head in (self._head(key, now) for key in list(self.heaps)) if head]
+        if not heads:
+            return None
+        return self.policy.select(heads, now)
+
+    def pop(self, now: Optional[datetime] = None) -> Optional[QueuedTask]:
+        """Remove and return the task the policy picks next.
+
+        The caller charges the task's queue with charge() once the task is
+        actually placed, so lost claims don't count against the queue.
+        """
+        task = self.peek(now)
+        if task:
+            self.discard(task.id)
+        return task
+
+    def charge(self, task: QueuedTask, now: Optional[datetime] = None):
+        self.policy.charge(task.queue, now or datetime.utcnow())
+
+    def stats(self, now: Optional[datetime] = None) -> Dict[str, Dict]:
+        """Pending tasks per queue and the policy's view of each queue"""
+        now = now or datetime.utcnow()
+        stats = self.policy.stats(now)
+        for task in self.entries.values():
+            queue = stats.setdefault(task.queue, {})
+            queue["pending"] = queue.get("pending", 0) + 1
+            if task.not_before and task.not_before > now:
+                queue["backing_off"] = queue.get("backing_off", 0) + 1
+        for queue in stats.values():
+            queue.setdefault("pending", 0)
+            queue.setdefault("backing_off", 0)
+        return stats
+
+def place_tasks(
+    queue: TaskQueue,
+    agents: Dict[str, Agent],
+    free_agents: List[str],
+    claim: Callable[[QueuedTask, str], bool],
+    now: Optional[datetime] = None
+) -> List[Tuple[QueuedTask, str]]:
+    """Hand queued tasks to free agents in the policy's order: the
+    assignment step of a scheduling pass, shared by TaskScheduler and the
+    simulator.
+
+    Each task goes to the free agent that encodes its codecs fastest (see
+    pick_agent); tasks no free agent can encode stay queued without holding
+    up the others. claim(task, agent_id) records an assignment and returns
+    False if the task can no longer be claimed, which keeps the agent free
+    for the next one. Returns the (task, agent_id) pairs claimed.
+    """
+    now = now or datetime.utcnow()
+    placed: List[Tuple[QueuedTask, str]] = []
+    unplaceable: List[QueuedTask] = []
+    agent_ids = list(free_agents)
+    while agent_ids:
+        entry = queue.pop(now)
+        if not entry:
+            break
+        agent_id = pick_agent(agents, agent_ids, entry.codecs)
+        if not agent_id:
+            # Wait for an agent that can encode it
+            unplaceable.append(entry)
+            continue
+        if not claim(entry, agent_id):
+            continue
+        queue.charge(entry, now)
+        agent_ids.remove(agent_id)
+        placed.append((entry, agent_id))
+    queue.extend(unplaceable)
+    return placed
@@ -0,0 +1,88 @@
+import asyncio
+import logging
+from typing import Optional
+
+from app.database import SessionLocal, TaskOperations
+
+logger = logging.getLogger(__name__)
+
+class LeaseReaper:
+    """Requeues tasks whose agent stopped renewing its lease"""
+
+    def __init__(self, connection_manager, scheduler, interval: float = 10.0, dependencies=None):
+        self.manager = connection_manager
+        self.scheduler = scheduler
+        self.dependencies = dependencies
+        self.interval = interval
+        self._task: Optional[asyncio.Task] = None
+
+    async def start(self):
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            self._task = None
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                await self.reap_expired()
+            except Exception as e:
+                logger.error(f"Lease reaper error: {e}")
+
+    async def reap_expired(self) -> int:
+        """Requeue every task with an expired lease and mark its agent unhealthy"""
+        db = SessionLocal()
+        try:
+            requeued = 0
+            for task in TaskOperations.get_expired_leases(db):
+                agent_id = task.agent_id
+                task = TaskOperations.requeue_task(db, task.id, agent_id, f"Lease expired on agent {agent_id}")
+                if not task:
+                    continue
+                logger.warning(f"Lease of task {task.id} on agent {agent_id} expired, task is now {task.status.value}")
+                self.manager.mark_unhealthy(agent_id)
+                # Its ffmpeg may still be running; the agent frees itself once it is stopped
+                await self.manager.cancel_on_agent(task.id, agent_id, reason="superseded")
+                await self.manager.broadcast_task_update(task.to_dict())
+                if self.dependencies:
+                    await self.dependencies.task_finished(db, task)
+                requeued += 1
+
+            if requeued:
+                await self.manager.broadcast_agent_status()
+                self.scheduler.wake()
+            return requeued
+        finally:
+            db.close()
+
+    def hold(self, seconds: float, agent_id: Optional[str] = None) -> int:
+        """Keep in-flight tasks (all, or agent_id's) from being reaped for seconds,
+        so their agents can reconnect and report them"""
+        db = SessionLocal()
+        try:
+            return TaskOperations.extend_leases(db, seconds, agent_id)
+        finally:
+            db.close()
+
+    async def release_agent(self, agent_id: str, reason: str) -> int:
+        """Requeue all in-flight tasks of an agent right away (e.g. on disconnect)"""
+        db = SessionLocal()
+        try:
+            requeued = 0
+            for task in TaskOperations.get_agent_tasks(db, agent_id):
+                task = TaskOperations.requeue_task(db, task.id, agent_id, reason)
+                if task:
+                    logger.info(f"Task {task.id} released from agent {agent_id}: {reason}")
+                    await self.manager.broadcast_task_update(task.to_dict())
+                    if self.dependencies:
+                        await self.dependencies.task_finished(db, task)
+                    requeued += 1
+
+            if requeued:
+                self.scheduler.wake()
+            return requeued
+        finally:
+            db.close()
@@ -1,49 +1,332 @@
+import asyncio
 import logging
+import time
+from datetime import datetime, timedelta
+from typing import Dict, FrozenSet, List, Optional, Set, Tuple
 from sqlalchemy.orm import Session
+from app import config
+from app.database import SessionLocal
 from app.database.operations import TaskOperations
+from app.models.task import Task, TaskPriority
+from app.scheduler.preemption import PreemptionLimits, plan_preemptions
+from app.scheduler.capacity import task_work
+from app.scheduler.queue import QueuedTask, TaskQueue, pick_agent, place_tasks, required_codecs
+from app.scheduler.speculation import SpeculationLimits, SpeedModel, select_stragglers
 from app.websocket.messages import OrchestratorMessage, OrchestratorMessageType
 
 logger = logging.getLogger(__name__)
 
+# Incremental queue syncs look this far behind the previous one, for tasks
+# requeued by transactions that committed after it had started
+QUEUE_SYNC_OVERLAP = timedelta(seconds=5)
+
 class TaskScheduler:
-    def __init__(self, connection_manager):
+    """Single background scheduling loop.
+
+    Callers never assign tasks themselves, they call ``wake()``. Wake-ups
+    arriving within ``debounce`` seconds are coalesced into one pass, which
+    claims as many pending tasks as there are free agents and sends all the
+    assignments concurrently. A periodic sweep catches anything that changed
+    without an explicit wake-up (e.g. a saturated host getting headroom).
+
+    Pending tasks are ordered in memory by ``queue`` (a TaskQueue and its
+    policy). Each pass only loads the tasks requeued since the previous one,
+    plus a full reload every ``resync_interval`` seconds to drop tasks that
+    left PENDING without this instance noticing.
+
+    With ``preemption`` limits set, a pass that leaves HIGH tasks waiting
+    with no free agent asks agents running lower-priority work to stop; the
+    task is requeued when the agent reports it preempted.
+
+    With ``speculation`` limits set, agents still idle once the queue is
+    empty run duplicates of stragglers, tasks encoding far slower than
+    ``speeds`` expects for their codec and resolution. Whichever attempt
+    finishes first completes the task and the other one is cancelled.
+
+    Tasks only go to agents whose ffmpeg advertised encoders for all their
+    codecs, preferring the agent that calibrated fastest for them. A task
+    no free agent can encode stays queued without holding up the others;
+    one no connected agent can encode neither triggers preemption nor
+    holds off speculation, and is listed by ``queue_stats()``.
+    """
+
+    def __init__(
+        self,
+        connection_manager,
+        debounce: float = 0.05,
+        sweep_interval: float = 5.0,
+        preemption: Optional[PreemptionLimits] = None,
+        queue: Optional[TaskQueue] = None,
+        resync_interval: float = 60.0,
+        speculation: Optional[SpeculationLimits] = None,
+        speeds: Optional[SpeedModel] = None
+    ):
         self.manager = connection_manager
+        self.debounce = debounce
+        self.sweep_interval = sweep_interval
+        self.queue = queue if queue is not None else TaskQueue()
+        self.resync_interval = resync_interval
+        self._queue_watermark: Optional[datetime] = None
+        self._queue_resynced_at = 0.0
+        self.preemption = preemption
+        # Task id -> time the preempting cancel was sent
+        self.preempting: Dict[str, datetime] = {}
+        self._last_preemption: Optional[datetime] = None
+        self.speculation = speculation
+        self.speeds = speeds if speeds is not None else SpeedModel()
+        # Running tasks that already had their one speculative copy
+        self.speculated: Set[str] = set()
+        self._wakeup = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+
+    def wake(self):
+        """Request a scheduling pass"""
+        self._wakeup.set()
+
+    async def start(self):
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            self._task = None
 
-    async def try_assign_tasks(self, db: Session):
-        """Try to assign pending tasks to available agents"""
+    async def _run(self):
         while True:
-            # Get next pending task
-            task = TaskOperations.get_next_pending_task(db)
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.sweep_interval)
+                # Let a burst of wake-ups (bulk task creation, several agents
+                # finishing together) settle into a single pass
+                await asyncio.sleep(self.debounce)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+
+            db = SessionLocal()
+            try:
+                await self.run_pass(db)
+            except Exception as e:
+                logger.error(f"Scheduling pass failed: {e}")
+            finally:
+                db.close()
+
+    async def run_pass(self, db: Session) -> int:
+        """Assign pending tasks to every available agent; returns the number assigned"""
+        assigned = await self._assign_pending(db)
+        if self.preemption:
+            await self._preempt_for_waiting(db)
+        if self.speculation:
+            await self._speculate(db)
+        return assigned
+
+    async def _assign_pending(self, db: Session) -> int:
+        free_agents = [agent_id for agent_id in list(self.manager.agents) if self.manager.is_available(agent_id)]
+        if not free_agents:
+            return 0
+
+        self.sync_queue(db)
+        claimed: List[Tuple[Task, str, QueuedTask]] = []
+
+        def claim(entry: QueuedTask, agent_id: str) -> bool:
+            task = TaskOperations.assign_task(db, entry.id, agent_id)
             if not task:
-                break
+                # Claimed concurrently (another instance) or no longer pending
+                return False
+            self.manager.assign_task_to_agent(agent_id, task.id)
+            claimed.append((task, agent_id, entry))
+            return True
 
-            # Get available agent
-            agent_id = self.manager.get_available_agent()
-            if not agent_id:
+        place_tasks(self.queue, self.manager.agents, free_agents, claim)
+
+        if not claimed:
+            return 0
+
+        results = await asyncio.gather(*(
+            self._send_assignment(task, agent_id) for task, agent_id, _ in claimed
+        ))
+
+        assigned = 0
+        for (task, agent_id, entry), success in zip(claimed, results):
+            if success:
+                logger.info(f"Assigned task {task.id} to agent {agent_id}")
+                assigned += 1
+            else:
+                # Failed to send, revert assignment
+                if TaskOperations.release_task(db, task.id, agent_id):
+                    self.queue.push(entry)
+                # A failed send disconnected the agent, which must stay OFFLINE
+                if agent_id in self.manager.active_connections:
+                    self.manager.free_agent(agent_id, task.id)
+
+        await self.manager.broadcast_agent_status()
+        return assigned
+
+    def sync_queue(self, db: Session):
+        """Bring the in-memory queue up to date with the tasks table"""
+        started = datetime.utcnow()
+        if self._queue_watermark is None or time.monotonic() - self._queue_resynced_at >= self.resync_interval:
+            rows = TaskOperations.get_queue_entries(db)
+            self.queue.clear()
+            self._queue_resynced_at = time.monotonic()
+        else:
+            rows = TaskOperations.get_queue_entries(db, self._queue_watermark - QUEUE_SYNC_OVERLAP)
+        for task_id, queue, priority, created_at, _, next_attempt_at, output_settings, input_files in rows:
+            self.queue.push(QueuedTask(
+                task_id, queue, priority, created_at, next_attempt_at, required_codecs(output_settings),
+                task_work(input_files, output_settings, config.CAPACITY_DEFAULT_SOURCE_SECONDS)
+            ))
+        self._queue_watermark = started
+
+    def _pick_agent(self, agent_ids: List[str], codecs: FrozenSet[str]) -> Optional[str]:
+        """The free agent that encodes codecs fastest; ties keep the given order"""
+        return pick_agent(self.manager.agents, agent_ids, codecs)
+
+    def _placeable(self, codecs: FrozenSet[str], agent_ids: Optional[List[str]] = None) -> bool:
+        """Whether any of agent_ids (every connected agent by default) can encode codecs"""
+        if agent_ids is None:
+            agent_ids = list(self.manager.active_connections)
+        return pick_agent(self.manager.agents, agent_ids, codecs) is not None
+
+    def queue_stats(self) -> Dict[str, Dict]:
+        """The queue's stats, with the pending tasks no connected agent can encode"""
+        stats = self.queue.stats()
+        for queue in stats.values():
+            queue["unplaceable"] = 0
+        unplaceable = []
+        for entry in list(self.queue.entries.values()):
+            if not self._placeable(entry.codecs):
+                stats[entry.queue]["unplaceable"] += 1
+                unplaceable.append({"id": entry.id, "queue": entry.queue, "codecs": sorted(entry.codecs)})
+        return {"queues": stats, "unplaceable": unplaceable}
+
+    async def _preempt_for_waiting(self, db: Session) -> int:
+        """Stop lower-priority work for HIGH tasks that found no free agent"""
+        limits = self.preemption
+        now = datetime.utcnow()
+        # Agents that never answered are left to the lease reaper
+        self.preempting = {
+            task_id: sent for task_id, sent in self.preempting.items()
+            if (now - sent).total_seconds() < config.TASK_LEASE_TTL
+        }
+        if any(self.manager.is_available(agent_id) for agent_id in list(self.manager.agents)):
+            return 0
+
+        def waiting() -> int:
+            # Tasks no connected agent can encode would only idle the freed agent
+            return sum(
+                1 for output_settings in TaskOperations.get_pending_output_settings(db, TaskPriority.HIGH)
+                if self._placeable(required_codecs(output_settings))
+            )
+
+        victims = plan_preemptions(
+            waiting,
+            # Only tasks on agents connected to this instance can be reached
+            lambda: TaskOperations.get_in_flight_tasks(db, list(self.manager.active_connections)),
+            self.preempting, limits, now, self._last_preemption
+        )
+
+        preempted = 0
+        for task in victims:
+            message = OrchestratorMessage(
+                type=OrchestratorMessageType.CANCEL,
+                task={"id": task.id},
+                reason="preempt"
+            )
+            if await self.manager.send_to_agent(task.agent_id, message):
+                logger.info(f"Preempting {task.priority.value} task {task.id} on agent {task.agent_id}")
+                self.preempting[task.id] = now
+                preempted += 1
+        if preempted:
+            self._last_preemption = now
+        return preempted
+
+    def load_speeds(self, db: Session):
+        """Seed the speed model from recently completed tasks (once)"""
+        if self.speeds.loaded:
+            return
+        rows = TaskOperations.get_recent_speeds(db, self.speeds.history * 20)
+        for output_settings, speed in reversed(rows):
+            self.speeds.observe(output_settings, speed)
+        self.speeds.loaded = True
+
+    def task_completed(self, task: Task):
+        """Learn the speed of a finished task"""
+        self.speeds.observe(task.output_settings, task.encode_speed)
+
+    async def _speculate(self, db: Session) -> int:
+        """Start duplicates of stragglers on agents nothing else needs"""
+        free_agents = [
+            agent_id for agent_id in list(self.manager.active_connections)
+            if self.manager.is_available(agent_id)
+        ]
+        if not free_agents:
+            return 0
+        # Tasks the free agents could take come first; ones they can't encode don't hold them back
+        now = datetime.utcnow()
+        if any(
+            (entry.not_before is None or entry.not_before <= now) and self._placeable(entry.codecs, free_agents)
+            for entry in list(self.queue.entries.values())
+        ):
+            return 0
+        self.load_speeds(db)
+
+        limits = self.speculation
+        running = TaskOperations.get_in_flight_tasks(db, list(self.manager.active_connections))
+        self.speculated &= {task.id for task in running}
+        budget = len(free_agents)
+        if limits.max_in_flight:
+            budget = min(budget, limits.max_in_flight - sum(1 for task in running if task.speculative_agent_id))
+
+        started = 0
+        for task in select_stragglers(running, self.speeds, limits):
+            if started >= budget:
                 break
+            if task.id in self.speculated:
+                continue
+            agent_id = self._pick_agent(
+                [agent for agent in free_agents if agent != task.agent_id],
+                required_codecs(task.output_settings)
+            )
+            if not agent_id:
+                continue
+            expected = self.speeds.expected(task.output_settings)
+            task = TaskOperations.start_speculation(db, task.id, agent_id)
+            if not task:
+                continue
+            free_agents.remove(agent_id)
+            self.speculated.add(task.id)
+            self.manager.assign_task_to_agent(agent_id, task.id)
+            task_dict = task.to_dict()
+            message = OrchestratorMessage(
+                type=OrchestratorMessageType.ASSIGN,
+                task=dict(task_dict, speculative=True)
+            )
+            if not await self.manager.send_to_agent(agent_id, message):
+                TaskOperations.drop_attempt(db, task, agent_id)
+                if agent_id in self.manager.active_connections:
+                    self.manager.free_agent(agent_id, task.id)
+                continue
+            logger.info(
+                f"Task {task.id} on agent {task.agent_id} encodes at {task.encode_speed:.2f}x "
+                f"(usually {expected:.2f}x), running a copy on agent {agent_id}"
+            )
+            await self.manager.broadcast_task_update(task_dict)
+            started += 1
+        if started:
+            await self.manager.broadcast_agent_status()
+        return started
+
+    def preemption_done(self, task_id: str):
+        """The agent stopped a preempted task (or it finished first)"""
+        self.preempting.pop(task_id, None)
 
-            # Assign task to agent
-            task = TaskOperations.assign_task(db, task.id, agent_id)
-            if task:
-                self.manager.assign_task_to_agent(agent_id, task.id)
-
-                # Send task to agent
-                message = OrchestratorMessage(
-                    type=OrchestratorMessageType.ASSIGN,
-                    task=task.to_dict()
-                )
-
-                success = await self.manager.send_to_agent(agent_id, message)
-                if success:
-                    logger.info(f"Assigned task {task.id} to agent {agent_id}")
-                    await self.manager.broadcast_task_update(task.to_dict())
-                    await self.manager.broadcast_agent_status()
-                else:
-                    # Failed to send, revert assignment
-                    from app.models.task import TaskStatus
-                    task.status = TaskStatus.PENDING
-                    task.agent_id = None
-                    task.started_at = None
-                    db.commit()
-                    self.manager.free_agent(agent_id)
-                    break
\ No newline at end of file
+    async def _send_assignment(self, task: Task, agent_id: str) -> bool:
+        task_dict = task.to_dict()
+        message = OrchestratorMessage(
+            type=OrchestratorMessageType.ASSIGN,
+            task=task_dict
+        )
+        success = await self.manager.send_to_agent(agent_id, message)
+        if success:
+            await self.manager.broadcast_task_update(task_dict)
+        return success
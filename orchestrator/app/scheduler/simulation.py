@@ -0,0 +1,393 @@
+import heapq
+import math
+from datetime import datetime, timedelta
+from statistics import mean
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from app import config
+from app.database.operations import retry_delay
+from app.models.agent import Agent, AgentStatus
+from app.models.task import TaskPriority
+from app.scheduler.capacity import CALIBRATION_PIXELS, CODEC_COST, REFERENCE_PIXELS, output_cost
+from app.scheduler.preemption import PreemptionLimits, plan_preemptions
+from app.scheduler.queue import PriorityFifoPolicy, QueuedTask, TaskQueue, pick_agent, place_tasks, required_codecs
+
+# Virtual time 0 of every simulation
+EPOCH = datetime(2000, 1, 1)
+
+class SimulatedTask:
+    """One task of a workload trace.
+
+    ``duration`` is the source length in seconds, its work follows from the
+    output settings (see capacity.output_cost). The first ``failures``
+    attempts fail transiently after ``fail_at`` of their run, or the first
+    attempt fails for good with ``permanent``.
+    """
+
+    def __init__(
+        self,
+        task_id: str,
+        arrival: float,
+        duration: float,
+        priority: TaskPriority = TaskPriority.MEDIUM,
+        queue: str = "default",
+        output_settings: Optional[Dict] = None,
+        failures: int = 0,
+        fail_at: float = 0.5,
+        permanent: bool = False,
+        max_retries: Optional[int] = None
+    ):
+        self.id = task_id
+        self.arrival = arrival
+        self.duration = duration
+        self.priority = priority
+        self.queue = queue
+        self.output_settings = output_settings or {"codec": "h264"}
+        self.failures = failures
+        self.fail_at = fail_at
+        self.permanent = permanent
+        self.max_retries = config.TASK_DEFAULT_MAX_RETRIES if max_retries is None else max_retries
+        self.work = duration * output_cost(self.output_settings)
+
+    @classmethod
+    def from_dict(cls, data: Dict) -> 'SimulatedTask':
+        """A trace entry: id, arrival, duration, priority, queue, output_settings
+        (or codec and resolution), failures, fail_at, permanent, max_retries"""
+        settings = data.get("output_settings") or {
+            key: data[key] for key in ("codec", "resolution") if data.get(key)
+        }
+        return cls(
+            str(data["id"]),
+            float(data.get("arrival", 0.0)),
+            float(data["duration"]),
+            TaskPriority(data.get("priority", "MEDIUM")),
+            data.get("queue") or "default",
+            settings,
+            int(data.get("failures", 0)),
+            float(data.get("fail_at", 0.5)),
+            bool(data.get("permanent", False)),
+            data.get("max_retries")
+        )
+
+    def to_dict(self) -> Dict:
+        return {
+            "id": self.id,
+            "arrival": round(self.arrival, 3),
+            "duration": round(self.duration, 3),
+            "priority": self.priority.value,
+            "queue": self.queue,
+            "output_settings": self.output_settings,
+            "failures": self.failures,
+            "fail_at": self.fail_at,
+            "permanent": self.permanent,
+            "max_retries": self.max_retries
+        }
+
+class SimulatedAgent:
+    """An agent encoding ``speed`` units of work per second (1 = 1080p h264
+    in realtime), with encoders for ``codecs``"""
+
+    def __init__(self, agent_id: str, speed: float = 1.0, codecs: Iterable[str] = tuple(CODEC_COST)):
+        self.id = agent_id
+        self.speed = speed
+        self.codecs = list(codecs)
+        # What the agent would advertise: calibration speeds in the units of
+        # the real 720p calibration encode, so pick_agent ranks it correctly
+        self.model = Agent(
+            id=agent_id,
+            host="simulated",
+            status=AgentStatus.ONLINE,
+            capabilities={
+                "codecs": self.codecs,
+                "calibration": {
+                    codec: {"speed": round(speed * REFERENCE_PIXELS / CALIBRATION_PIXELS / CODEC_COST[codec], 3)}
+                    for codec in self.codecs if codec in CODEC_COST
+                }
+            }
+        )
+
+class _Running:
+    """The fields of a running Task that select_preemption_victims reads"""
+
+    __slots__ = ("id", "priority", "progress", "started_at", "preempt_count", "speculative_agent_id")
+
+    def __init__(self, task_id: str, priority: TaskPriority, progress: float, started_at: datetime, preempt_count: int):
+        self.id = task_id
+        self.priority = priority
+        self.progress = progress
+        self.started_at = started_at
+        self.preempt_count = preempt_count
+        self.speculative_agent_id = None
+
+class _Run:
+    """Simulation state of one task"""
+
+    def __init__(self, task: SimulatedTask):
+        self.task = task
+        self.codecs = required_codecs(task.output_settings)
+        self.remaining = task.work
+        self.failures_left = task.failures
+        self.retries = 0
+        self.preempt_count = 0
+        self.attempt = 0
+        self.agent_id: Optional[str] = None
+        self.started = 0.0  # start of the current attempt
+        self.queued_since: Optional[float] = None
+        self.first_start: Optional[float] = None
+        self.wait = 0.0  # seconds eligible but waiting, over all attempts
+        self.longest_wait = 0.0
+        self.finished: Optional[float] = None
+        self.status = "WAITING"
+
+    def entry(self, not_before: Optional[float] = None) -> QueuedTask:
+        task = self.task
+        return QueuedTask(
+            task.id, task.queue, task.priority, EPOCH + timedelta(seconds=task.arrival),
+            EPOCH + timedelta(seconds=not_before) if not_before is not None else None,
+            self.codecs, task.work
+        )
+
+def percentile(values: List[float], fraction: float) -> float:
+    """Nearest-rank percentile, 0 for no values"""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, max(math.ceil(fraction * len(ordered)) - 1, 0))]
+
+class Simulator:
+    """Discrete-event simulation of the scheduler on a virtual clock.
+
+    Replays a workload trace against synthetic agents with the scheduler's
+    own queue and policy, and the same assignment and preemption steps
+    (place_tasks, plan_preemptions) and retry backoff, so a policy can be
+    compared against another offline. Like the real scheduler, each event
+    (arrival, completion, failure, a preempted task stopping, a backoff
+    expiring) triggers a pass that fills every free agent, then preempts
+    for waiting HIGH work; while HIGH work waits without a victim, a sweep
+    every ``sweep_interval`` seconds tries again. Preempted tasks resume
+    where they stopped after ``preempt_delay`` seconds. Dispatch and
+    staging take no time, agents never saturate and speculative copies are
+    not simulated.
+    """
+
+    def __init__(
+        self,
+        agents: List[SimulatedAgent],
+        policy: Optional[PriorityFifoPolicy] = None,
+        preemption: Optional[PreemptionLimits] = None,
+        preempt_delay: float = 1.0,
+        starvation_seconds: float = 3600.0,
+        sweep_interval: float = 5.0
+    ):
+        self.agents = {agent.id: agent for agent in agents}
+        self.models = {agent.id: agent.model for agent in agents}
+        self.queue = TaskQueue(policy)
+        self.preemption = preemption
+        self.preempt_delay = preempt_delay
+        self.starvation_seconds = starvation_seconds
+        self.sweep_interval = sweep_interval
+        self.now = 0.0
+        self.events: List[Tuple[float, int, str, object]] = []
+        self._seq = 0
+        self.runs: Dict[str, _Run] = {}
+        self.free: List[str] = list(self.agents)
+        self.running: Dict[str, _Run] = {}  # agent id -> run
+        self.preempting: Dict[str, float] = {}  # task id -> time the stop was requested
+        self.pending_high: Dict[str, _Run] = {}
+        self._last_preemption: Optional[datetime] = None
+        self._wake_pending = False
+        self.busy_seconds = 0.0
+        self.wasted_work = 0.0
+        self.preemptions = 0
+        self.passes = 0
+
+    def _at(self, when: float, kind: str, payload: object = None):
+        self._seq += 1
+        heapq.heappush(self.events, (when, self._seq, kind, payload))
+
+    def run(self, tasks: Iterable[SimulatedTask]) -> Dict:
+        for task in tasks:
+            self.runs[task.id] = _Run(task)
+            self._at(task.arrival, "arrive", task.id)
+        first_arrival = min((run.task.arrival for run in self.runs.values()), default=0.0)
+        while self.events:
+            self.now = self.events[0][0]
+            # Everything happening at the same instant is seen by one pass
+            while self.events and self.events[0][0] == self.now:
+                _, _, kind, payload = heapq.heappop(self.events)
+                getattr(self, f"_on_{kind}")(payload)
+            self._pass()
+        return self.report(first_arrival)
+
+    def _enqueue(self, run: _Run, not_before: Optional[float] = None):
+        run.status = "PENDING"
+        run.queued_since = self.now if not_before is None else not_before
+        if run.task.priority == TaskPriority.HIGH:
+            self.pending_high[run.task.id] = run
+        self.queue.push(run.entry(not_before))
+        if not_before is not None:
+            self._at(not_before, "wake")
+
+    def _on_arrive(self, task_id: str):
+        self._enqueue(self.runs[task_id])
+
+    def _on_wake(self, _):
+        self._wake_pending = False
+
+    def _stop(self, run: _Run) -> float:
+        """End the running attempt of run; returns the work it got done"""
+        agent = self.agents[run.agent_id]
+        elapsed = self.now - run.started
+        self.busy_seconds += elapsed
+        del self.running[run.agent_id]
+        self.free.append(run.agent_id)
+        run.agent_id = None
+        run.attempt += 1
+        self.preempting.pop(run.task.id, None)
+        return min(elapsed * agent.speed, run.remaining)
+
+    def _on_finish(self, item: Tuple[str, int]):
+        task_id, attempt = item
+        run = self.runs[task_id]
+        if run.attempt != attempt:
+            return
+        self._stop(run)
+        run.remaining = 0.0
+        run.status = "COMPLETED"
+        run.finished = self.now
+
+    def _on_fail(self, item: Tuple[str, int]):
+        task_id, attempt = item
+        run = self.runs[task_id]
+        if run.attempt != attempt:
+            return
+        self.wasted_work += self._stop(run)
+        run.remaining = run.task.work
+        task = run.task
+        if task.permanent or run.retries >= task.max_retries:
+            run.status = "FAILED"
+            run.finished = self.now
+            return
+        run.failures_left -= 1
+        delay = retry_delay(run.retries)
+        run.retries += 1
+        self._enqueue(run, self.now + delay)
+
+    def _on_stopped(self, item: Tuple[str, int]):
+        task_id, attempt = item
+        run = self.runs[task_id]
+        if run.attempt != attempt:
+            # Finished (or failed) before the agent got to stop it
+            return
+        run.remaining -= self._stop(run)
+        run.preempt_count += 1
+        self._enqueue(run)
+
+    def _start(self, run: _Run, agent_id: str):
+        agent = self.agents[agent_id]
+        self.free.remove(agent_id)
+        self.running[agent_id] = run
+        self.pending_high.pop(run.task.id, None)
+        waited = self.now - run.queued_since
+        run.wait += waited
+        run.longest_wait = max(run.longest_wait, waited)
+        if run.first_start is None:
+            run.first_start = self.now
+        run.status = "RUNNING"
+        run.agent_id = agent_id
+        run.started = self.now
+        seconds = run.remaining / agent.speed
+        if run.task.permanent or run.failures_left > 0:
+            self._at(self.now + seconds * run.task.fail_at, "fail", (run.task.id, run.attempt))
+        else:
+            self._at(self.now + seconds, "finish", (run.task.id, run.attempt))
+
+    def _pass(self):
+        """One scheduling pass, as TaskScheduler.run_pass"""
+        self.passes += 1
+        now = EPOCH + timedelta(seconds=self.now)
+        place_tasks(self.queue, self.models, self.free, self._claim, now)
+        if self.preemption and not self.free:
+            self._preempt_for_waiting(now)
+
+    def _claim(self, entry: QueuedTask, agent_id: str) -> bool:
+        self._start(self.runs[entry.id], agent_id)
+        return True
+
+    def _waiting_high(self) -> int:
+        """HIGH tasks that may run now (not backing off) on some agent"""
+        return sum(
+            1 for run in self.pending_high.values()
+            if run.queued_since <= self.now and pick_agent(self.models, list(self.models), run.codecs)
+        )
+
+    def _candidates(self) -> List[_Running]:
+        candidates = []
+        for agent_id, run in self.running.items():
+            done = run.task.work - run.remaining + (self.now - run.started) * self.agents[agent_id].speed
+            candidates.append(_Running(
+                run.task.id,
+                run.task.priority,
+                min(100.0 * done / run.task.work, 100.0) if run.task.work else 0.0,
+                EPOCH + timedelta(seconds=run.started),
+                run.preempt_count
+            ))
+        return candidates
+
+    def _preempt_for_waiting(self, now: datetime):
+        """As TaskScheduler._preempt_for_waiting"""
+        victims = plan_preemptions(
+            self._waiting_high, self._candidates, self.preempting, self.preemption, now, self._last_preemption
+        )
+        for victim in victims:
+            run = self.runs[victim.id]
+            self.preempting[victim.id] = self.now
+            self._at(self.now + self.preempt_delay, "stopped", (victim.id, run.attempt))
+            self.preemptions += 1
+        if victims:
+            self._last_preemption = now
+        elif not self._wake_pending and self._waiting_high():
+            # The cooldown may run out or victims reach their minimum runtime
+            # without any event: the real scheduler's periodic sweep tries again
+            self._wake_pending = True
+            self._at(self.now + self.sweep_interval, "wake")
+
+    def report(self, first_arrival: float = 0.0) -> Dict:
+        """Makespan, queue waits, utilisation and starvation of the last run"""
+        runs = list(self.runs.values())
+        finished = [run.finished for run in runs if run.finished is not None]
+        makespan = max(finished, default=first_arrival) - first_arrival
+        waits = [run.wait for run in runs if run.first_start is not None]
+        capacity = len(self.agents) * makespan
+        by_priority = {}
+        for priority in (TaskPriority.HIGH, TaskPriority.MEDIUM, TaskPriority.LOW):
+            group = [run for run in runs if run.task.priority == priority]
+            group_waits = [run.wait for run in group if run.first_start is not None]
+            by_priority[priority.value] = {
+                "tasks": len(group),
+                "wait_mean": round(mean(group_waits), 1) if group_waits else 0.0,
+                "wait_p99": round(percentile(group_waits, 0.99), 1),
+                "wait_max": round(max(group_waits, default=0.0), 1),
+                "starved": sum(1 for run in group if run.longest_wait > self.starvation_seconds)
+            }
+        return {
+            "tasks": len(runs),
+            "completed": sum(1 for run in runs if run.status == "COMPLETED"),
+            "failed": sum(1 for run in runs if run.status == "FAILED"),
+            # Unfinished when the events ran out: never placed (no agent encodes
+            # their codecs), or still preempted or backing off
+            "stuck": sum(1 for run in runs if run.finished is None),
+            "makespan": round(makespan, 1),
+            "wait_mean": round(mean(waits), 1) if waits else 0.0,
+            "wait_p99": round(percentile(waits, 0.99), 1),
+            "wait_max": round(max(waits, default=0.0), 1),
+            "turnaround_mean": round(mean(run.finished - run.task.arrival for run in runs if run.finished is not None), 1)
+            if finished else 0.0,
+            "utilisation": round(self.busy_seconds / capacity, 3) if capacity else 0.0,
+            "wasted_work": round(self.wasted_work / sum(run.task.work for run in runs), 3) if runs else 0.0,
+            # Tasks that waited longer than starvation_seconds at a stretch
+            "starved": sum(1 for run in runs if run.longest_wait > self.starvation_seconds),
+            "preemptions": self.preemptions,
+            "retries": sum(run.retries for run in runs),
+            "by_priority": by_priority
+        }
@@ -0,0 +1,106 @@
+from collections import deque
+from datetime import datetime
+from statistics import median
+from typing import Deque, Dict, Iterable, List, Optional, Tuple
+
+from app.models.task import Task, TaskStatus
+
+class SpeculationLimits:
+    """When a running task counts as a straggler worth duplicating"""
+
+    def __init__(
+        self,
+        slowdown: float = 0.5,
+        min_runtime: float = 60.0,
+        max_in_flight: int = 2,
+        min_samples: int = 3
+    ):
+        self.slowdown = slowdown  # speed below this fraction of the expected speed
+        self.min_runtime = min_runtime  # seconds running before the speed is trusted
+        self.max_in_flight = max_in_flight  # duplicates running at once (0 = no limit)
+        self.min_samples = min_samples  # completed tasks needed to know what to expect
+
+class SpeedModel:
+    """Expected encode speed per codec and resolution.
+
+    Speed is what ffmpeg reports: seconds of source encoded per second of
+    wall-clock time, so it doesn't depend on how long the source is. The
+    expectation is the median of the last ``history`` completed tasks with
+    the same codec and resolution, which one slow host can't drag down.
+    """
+
+    def __init__(self, history: int = 50):
+        self.history = history
+        self.samples: Dict[Tuple[str, str], Deque[float]] = {}
+        self.loaded = False
+
+    @staticmethod
+    def key(output_settings: Dict) -> Tuple[str, str]:
+        renditions = output_settings.get("renditions")
+        if renditions:
+            # A ladder is one process, its cost follows the whole set of sizes
+            resolution = "+".join(sorted(r.get("resolution") or "source" for r in renditions))
+        else:
+            resolution = output_settings.get("resolution") or "source"
+        return (output_settings.get("codec") or "h264", resolution)
+
+    def observe(self, output_settings: Dict, speed: Optional[float]):
+        if not speed or speed <= 0:
+            return
+        key = self.key(output_settings or {})
+        self.samples.setdefault(key, deque(maxlen=self.history)).append(speed)
+
+    def expected(self, output_settings: Dict, min_samples: int = 1) -> Optional[float]:
+        samples = self.samples.get(self.key(output_settings or {}))
+        if not samples or len(samples) < max(min_samples, 1):
+            return None
+        return median(samples)
+
+    def stats(self) -> Dict[str, Dict]:
+        return {
+            f"{codec}/{resolution}": {"expected_speed": round(median(samples), 3), "samples": len(samples)}
+            for (codec, resolution), samples in self.samples.items()
+        }
+
+def speculatable(task: Task) -> bool:
+    """Whether a second attempt can run next to the first without clobbering it.
+
+    Both attempts publish whole files atomically; segmented outputs are
+    written in place piece by piece and resumed encodes share their parts.
+    """
+    settings = task.output_settings or {}
+    return settings.get("format", "file") == "file" and not task.resume_state
+
+def select_stragglers(
+    running: Iterable[Task],
+    model: SpeedModel,
+    limits: SpeculationLimits,
+    now: Optional[datetime] = None
+) -> List[Task]:
+    """Running tasks a fresh attempt at the expected speed would overtake, slowest first.
+
+    A task qualifies when its speed is below ``slowdown`` times the expected
+    speed and a duplicate starting now would still finish first: the source
+    length follows from the speed, the run time and the progress so far.
+    """
+    now = now or datetime.utcnow()
+    stragglers = []
+    for task in running:
+        if task.status != TaskStatus.RUNNING or task.speculative_agent_id or not speculatable(task):
+            continue
+        if not task.started_at or not task.encode_speed:
+            continue
+        elapsed = (now - task.started_at).total_seconds()
+        progress = task.progress or 0.0
+        if elapsed < limits.min_runtime or not 0 < progress < 100:
+            continue
+        expected = model.expected(task.output_settings, limits.min_samples)
+        if not expected or task.encode_speed >= limits.slowdown * expected:
+            continue
+        source_seconds = task.encode_speed * elapsed / (progress / 100)
+        remaining = elapsed * (100 - progress) / progress
+        if source_seconds / expected >= remaining:
+            continue
+        stragglers.append((task.encode_speed / expected, task))
+    stragglers.sort(key=lambda item: item[0])
+    return [task for _, task in stragglers]
@@ -0,0 +1,71 @@
+import json
+from typing import Any, Union
+
+try:
+    import orjson
+except ImportError:  # orjson is optional, the standard library encodes otherwise
+    orjson = None
+
+class EncodedDict(dict):
+    """A dict that keeps its JSON encoding once it has been made.
+
+    Encoders splice the cached bytes into whatever message carries the
+    dict, so one payload is encoded once however often it is sent. It must
+    not be changed after it was first encoded; copy it to extend it.
+    """
+    __slots__ = ("_json",)
+
+    def json(self) -> bytes:
+        try:
+            return self._json
+        except AttributeError:
+            self._json = _dumps(self)
+            return self._json
+
+def _dumps(obj: Any) -> bytes:
+    if orjson is not None:
+        try:
+            return orjson.dumps(obj, default=str, option=orjson.OPT_NON_STR_KEYS)
+        except TypeError:
+            pass
+    return json.dumps(obj, separators=(",", ":"), default=str).encode()
+
+def _encoded(value: Any) -> bool:
+    # Lists of payloads are homogeneous, the first item tells
+    return isinstance(value, EncodedDict) or (type(value) is list and bool(value) and isinstance(value[0], EncodedDict))
+
+def _splice(value: Any) -> bytes:
+    if isinstance(value, EncodedDict):
+        return value.json()
+    return b"[" + b",".join(item.json() if isinstance(item, EncodedDict) else _dumps(item) for item in value) + b"]"
+
+def json_bytes(obj: Any) -> bytes:
+    """Compact JSON as UTF-8 bytes, with orjson when it is installed.
+
+    Anything JSON can't represent is encoded as its str(), like the
+    ``default=str`` used throughout. Values orjson refuses (integers beyond
+    64 bits) fall back to the standard library. EncodedDict values (and
+    lists of them) at the top level reuse their cached encoding.
+    """
+    if isinstance(obj, EncodedDict):
+        return obj.json()
+    if isinstance(obj, dict):
+        # Payloads inside a message ({"task": ...}, {"tasks": [...]}) keep their encoding
+        spliced = [key for key, value in obj.items() if _encoded(value)]
+        if spliced:
+            rest = _dumps({key: value for key, value in obj.items() if key not in spliced})
+            return rest[:-1] + (b"," if len(rest) > 2 else b"") + b",".join(
+                _dumps(str(key)) + b":" + _splice(obj[key]) for key in spliced
+            ) + b"}"
+    return _dumps(obj)
+
+def json_text(obj: Any) -> str:
+    """Compact JSON as a str, for text frames and JSON columns"""
+    if orjson is not None or isinstance(obj, dict):
+        return json_bytes(obj).decode()
+    return json.dumps(obj, separators=(",", ":"), default=str)
+
+def json_loads(data: Union[str, bytes, bytearray]) -> Any:
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
@@ -1,4 +1,6 @@
 from .manager import ConnectionManager, AgentConnection
 from .messages import AgentMessage, OrchestratorMessage, AgentMessageType, OrchestratorMessageType
+from .frontend import FrontendHub, Subscription, PROTOCOL_VERSION
+from .codec import Encoding, negotiate_encoding, encode_message, decode_message
 
-__all__ = ['ConnectionManager', 'AgentConnection', 'AgentMessage', 'OrchestratorMessage', 'AgentMessageType', 'OrchestratorMessageType']
\ No newline at end of file
+__all__ = ['ConnectionManager', 'AgentConnection', 'AgentMessage', 'OrchestratorMessage', 'AgentMessageType', 'OrchestratorMessageType', 'Encoding', 'negotiate_encoding', 'encode_message', 'decode_message', 'FrontendHub', 'Subscription', 'PROTOCOL_VERSION']
\ No newline at end of file
@@ -0,0 +1,46 @@
+import logging
+from enum import Enum
+from typing import Any, Dict, List, Optional, Union
+
+try:
+    import msgpack
+except ImportError:  # msgpack is optional, JSON is always available
+    msgpack = None
+
+from app.serialization import json_loads, json_text
+
+logger = logging.getLogger(__name__)
+
+class Encoding(str, Enum):
+    JSON = "json"
+    MSGPACK = "msgpack"
+
+def supported_encodings() -> List[str]:
+    """Encodings this side can speak, most compact first"""
+    encodings = []
+    if msgpack is not None:
+        encodings.append(Encoding.MSGPACK.value)
+    encodings.append(Encoding.JSON.value)
+    return encodings
+
+def negotiate_encoding(offered: Optional[List[str]]) -> Encoding:
+    """Pick the first encoding offered by the peer that we also support"""
+    supported = supported_encodings()
+    for name in offered or []:
+        if name in supported:
+            return Encoding(name)
+    return Encoding.JSON
+
+def encode_message(message: Dict[str, Any], encoding: Encoding = Encoding.JSON) -> Union[str, bytes]:
+    """Encode a message; JSON goes out as a text frame, msgpack as a binary frame"""
+    if encoding == Encoding.MSGPACK and msgpack is not None:
+        return msgpack.packb(message, use_bin_type=True, default=str)
+    return json_text(message)
+
+def decode_message(frame: Union[str, bytes]) -> Dict[str, Any]:
+    """Decode a frame, using the frame type to tell the encodings apart"""
+    if isinstance(frame, (bytes, bytearray)):
+        if msgpack is None:
+            raise ValueError("Received binary frame but msgpack is not installed")
+        return msgpack.unpackb(frame, raw=False)
+    return json_loads(frame)
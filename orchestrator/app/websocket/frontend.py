@@ -0,0 +1,273 @@
+import asyncio
+import logging
+from typing import Any, Callable, Dict, Iterable, List, Optional, Set
+
+from fastapi import WebSocket
+
+from app.models.task import TaskStatus
+from app.serialization import json_text
+
+logger = logging.getLogger(__name__)
+
+PROTOCOL_VERSION = 2
+
+# Tasks in these states receive no further updates unless restarted, so the
+# hub stops tracking them once their final state has been sent
+TERMINAL_STATUSES = {TaskStatus.COMPLETED.value, TaskStatus.FAILED.value, TaskStatus.CANCELLED.value}
+
+_MISSING = object()
+
+def _encode(message: Dict[str, Any]) -> str:
+    return json_text(message)
+
+def diff_fields(previous: Dict[str, Any], current: Dict[str, Any]) -> Dict[str, Any]:
+    """Top-level fields of current that differ from previous"""
+    return {
+        key: value for key, value in current.items()
+        if previous.get(key, _MISSING) != value
+    }
+
+class Subscription:
+    """Subset of the fleet a frontend client wants to hear about.
+
+    Empty filters match everything; filters are combined with AND.
+    """
+
+    def __init__(
+        self,
+        statuses: Optional[Iterable[str]] = None,
+        agent_ids: Optional[Iterable[str]] = None,
+        task_ids: Optional[Iterable[str]] = None,
+        agents: bool = True
+    ):
+        self.statuses: Set[str] = set(statuses or ())
+        self.agent_ids: Set[str] = set(agent_ids or ())
+        self.task_ids: Set[str] = set(task_ids or ())
+        self.agents = agents
+
+    @classmethod
+    def from_message(cls, data: Dict[str, Any]) -> 'Subscription':
+        statuses = data.get("statuses") or []
+        valid = {status.value for status in TaskStatus}
+        unknown = [status for status in statuses if status not in valid]
+        if unknown:
+            raise ValueError(f"Unknown task statuses: {', '.join(map(str, unknown))}")
+        return cls(
+            statuses=statuses,
+            agent_ids=data.get("agent_ids"),
+            task_ids=data.get("task_ids"),
+            agents=bool(data.get("agents", True))
+        )
+
+    @property
+    def filtered(self) -> bool:
+        return bool(self.statuses or self.agent_ids or self.task_ids)
+
+    def matches_task(self, task: Dict[str, Any]) -> bool:
+        if self.statuses and task.get("status") not in self.statuses:
+            return False
+        if self.agent_ids and task.get("agent_id") not in self.agent_ids:
+            return False
+        if self.task_ids and task.get("id") not in self.task_ids:
+            return False
+        return True
+
+    def matches_agent(self, agent_id: str) -> bool:
+        return self.agents and (not self.agent_ids or agent_id in self.agent_ids)
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "statuses": sorted(self.statuses),
+            "agent_ids": sorted(self.agent_ids),
+            "task_ids": sorted(self.task_ids),
+            "agents": self.agents
+        }
+
+class FrontendClient:
+    def __init__(self, websocket: WebSocket, max_pending: int = 1000, send_timeout: float = 10.0):
+        self.websocket = websocket
+        self.subscription = Subscription()
+        self.seq = 0
+        # Tasks this client currently holds, so deltas can be sent instead of
+        # full objects and tasks leaving the subscription can be removed
+        self.visible_tasks: Set[str] = set()
+        # Deltas are only sent once the client has its snapshot
+        self.ready = False
+        # Messages waiting for the writer; a client this far behind is dropped
+        self.outbox: asyncio.Queue = asyncio.Queue(max_pending)
+        self.send_timeout = send_timeout
+        self.writer: Optional[asyncio.Task] = None
+
+    def send(self, body: str) -> bool:
+        """Queue a pre-encoded message, stamped with this client's sequence
+        number; False if the client has too many messages waiting"""
+        self.seq += 1
+        try:
+            self.outbox.put_nowait(f'{{"seq":{self.seq},{body[1:]}')
+        except asyncio.QueueFull:
+            return False
+        return True
+
+    async def write(self):
+        """Send queued messages in order until one fails or takes longer than send_timeout"""
+        while True:
+            body = await self.outbox.get()
+            await asyncio.wait_for(self.websocket.send_text(body), self.send_timeout)
+
+class FrontendHub:
+    """Snapshot-plus-delta protocol for dashboard clients.
+
+    The hub remembers the last state it published for every active task and
+    every agent. Updates are diffed against it and only changed fields go
+    out, each message encoded once and shared by every client that gets it.
+    Every message carries a per-client ``seq`` so gaps can be detected.
+
+    Messages are queued per client under the lock and sent by one writer
+    task per client, so a slow client never holds up the others or the
+    publisher. A client with ``max_pending`` messages waiting, or whose
+    send takes longer than ``send_timeout`` seconds, is disconnected; it
+    reconnects and starts over from a snapshot.
+    """
+
+    def __init__(self, max_pending: int = 1000, send_timeout: float = 10.0):
+        self.max_pending = max_pending
+        self.send_timeout = send_timeout
+        self.clients: Dict[WebSocket, FrontendClient] = {}
+        self.tasks: Dict[str, Dict[str, Any]] = {}
+        self.agents: Dict[str, Dict[str, Any]] = {}
+        # Serializes queueing so every client sees deltas in publish order
+        self._lock = asyncio.Lock()
+
+    async def connect(self, websocket: WebSocket) -> FrontendClient:
+        await websocket.accept()
+        client = FrontendClient(websocket, self.max_pending, self.send_timeout)
+        self.clients[websocket] = client
+        client.writer = asyncio.create_task(self._write(client))
+        return client
+
+    def disconnect(self, websocket: WebSocket):
+        client = self.clients.pop(websocket, None)
+        if client and client.writer and client.writer is not asyncio.current_task():
+            client.writer.cancel()
+
+    async def _write(self, client: FrontendClient):
+        try:
+            await client.write()
+        except asyncio.CancelledError:
+            raise
+        except asyncio.TimeoutError:
+            logger.warning(f"Frontend client took over {self.send_timeout}s to receive a message, disconnecting it")
+            await self._drop(client)
+        except Exception as e:
+            logger.error(f"Error sending to frontend: {e}")
+            await self._drop(client)
+
+    async def _drop(self, client: FrontendClient):
+        self.disconnect(client.websocket)
+        try:
+            await client.websocket.close()
+        except Exception:
+            pass
+
+    async def send_snapshot(
+        self,
+        client: FrontendClient,
+        load_tasks: Callable[[Subscription], List[Dict[str, Any]]],
+        agents: Dict[str, Dict[str, Any]]
+    ):
+        """(Re)send the full state matching the client's subscription"""
+        async with self._lock:
+            subscription = client.subscription
+            # Loaded under the lock: anything published later reaches the
+            # client as a delta after the snapshot
+            tasks = [task for task in load_tasks(subscription) if subscription.matches_task(task)]
+            client.visible_tasks = {task["id"] for task in tasks}
+            client.ready = True
+            self._send(client, _encode({
+                "type": "snapshot",
+                "version": PROTOCOL_VERSION,
+                "subscription": subscription.to_dict(),
+                "agents": {
+                    agent_id: agent for agent_id, agent in agents.items()
+                    if subscription.matches_agent(agent_id)
+                },
+                "tasks": tasks
+            }))
+
+    async def publish_task(self, task: Dict[str, Any]):
+        task_id = task["id"]
+        async with self._lock:
+            previous = self.tasks.get(task_id)
+            changes = diff_fields(previous, task) if previous is not None else task
+            if not changes:
+                return
+            terminal = task.get("status") in TERMINAL_STATUSES
+            if terminal:
+                self.tasks.pop(task_id, None)
+            else:
+                self.tasks[task_id] = task
+
+            frames: Dict[str, str] = {}
+            def frame(kind: str) -> str:
+                if kind not in frames:
+                    if kind == "delta":
+                        frames[kind] = _encode({"type": "task_delta", "task_id": task_id, "changes": changes})
+                    elif kind == "full":
+                        frames[kind] = _encode({"type": "task", "task": task})
+                    else:
+                        frames[kind] = _encode({"type": "task_removed", "task_id": task_id})
+                return frames[kind]
+
+            for client in list(self.clients.values()):
+                if not client.ready:
+                    continue
+                visible = task_id in client.visible_tasks
+                if client.subscription.matches_task(task):
+                    body = frame("delta" if visible and previous is not None else "full")
+                    client.visible_tasks.add(task_id)
+                elif visible:
+                    body = frame("removed")
+                    client.visible_tasks.discard(task_id)
+                else:
+                    continue
+                if terminal:
+                    # Untracked from here on, a restart is sent in full
+                    client.visible_tasks.discard(task_id)
+                self._send(client, body)
+
+    async def publish_agents(self, agents: Dict[str, Dict[str, Any]]):
+        """Send what changed between the last agent view and this one"""
+        async with self._lock:
+            messages = []
+            for agent_id, agent in agents.items():
+                previous = self.agents.get(agent_id)
+                changes = diff_fields(previous, agent) if previous is not None else agent
+                if changes:
+                    messages.append((agent_id, _encode({"type": "agent_delta", "agent_id": agent_id, "changes": changes})))
+            for agent_id in self.agents.keys() - agents.keys():
+                messages.append((agent_id, _encode({"type": "agent_removed", "agent_id": agent_id})))
+            self.agents = dict(agents)
+
+            for client in list(self.clients.values()):
+                if not client.ready:
+                    continue
+                for agent_id, body in messages:
+                    if client.subscription.matches_agent(agent_id):
+                        self._send(client, body)
+
+    async def publish_event(self, message: Dict[str, Any], task_id: Optional[str] = None):
+        """Any other event; task events only go to clients holding that task"""
+        async with self._lock:
+            body = _encode(message)
+            for client in list(self.clients.values()):
+                if not client.ready:
+                    continue
+                if task_id and client.subscription.filtered and task_id not in client.visible_tasks:
+                    continue
+                self._send(client, body)
+
+    def _send(self, client: FrontendClient, body: str):
+        if client.websocket in self.clients and not client.send(body):
+            logger.warning(f"Frontend client has {self.max_pending} messages waiting, disconnecting it")
+            self.disconnect(client.websocket)
+            asyncio.create_task(self._drop(client))
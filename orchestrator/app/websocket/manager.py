@@ -1,28 +1,58 @@
-from typing import Dict, Optional, Set
+from typing import Any, Dict, Optional
 from fastapi import WebSocket
 from datetime import datetime
 import json
 import logging
+from app import config
 from app.models.agent import Agent, AgentStatus
 from app.websocket.messages import OrchestratorMessage, OrchestratorMessageType
+from app.websocket.codec import Encoding, encode_message
+from app.websocket.frontend import FrontendHub, FrontendClient
+from app.api.cache import ReadCache
 
 logger = logging.getLogger(__name__)
 
 class AgentConnection:
-    def __init__(self, websocket: WebSocket, agent_id: str):
+    def __init__(self, websocket: WebSocket, agent_id: str, encoding: Encoding = Encoding.JSON):
         self.websocket = websocket
         self.agent_id = agent_id
+        self.encoding = encoding
         self.connected_at = datetime.utcnow()
         self.last_heartbeat = datetime.utcnow()
 
+    async def send(self, message: dict):
+        """Send a message using the encoding negotiated at connect time"""
+        frame = encode_message(message, self.encoding)
+        if isinstance(frame, bytes):
+            await self.websocket.send_bytes(frame)
+        else:
+            await self.websocket.send_text(frame)
+
 class ConnectionManager:
     def __init__(self):
         self.active_connections: Dict[str, AgentConnection] = {}
         self.agents: Dict[str, Agent] = {}
-        self.frontend_connections: Set[WebSocket] = set()
-
-    async def connect_agent(self, websocket: WebSocket, agent_id: str):
-        connection = AgentConnection(websocket, agent_id)
+        self.frontend = FrontendHub(config.FRONTEND_MAX_PENDING, config.FRONTEND_SEND_TIMEOUT)
+        # Read endpoints are invalidated by the same events the frontend gets
+        self.read_cache = ReadCache(ttl=config.READ_CACHE_TTL)
+        # Cluster mode: change feed shared with other orchestrator instances and
+        # the agents those instances own, keyed by instance id
+        self.feed = None
+        self.remote_agents: Dict[str, Dict[str, Dict[str, Any]]] = {}
+        self.remote_seen: Dict[str, datetime] = {}
+        # Agent -> last applied outbox seq, loaded from the database on connect
+        self.delivered: Dict[str, int] = {}
+
+    async def connect_agent(
+        self,
+        websocket: WebSocket,
+        agent_id: str,
+        encoding: Encoding = Encoding.JSON,
+        capabilities: Optional[Dict[str, Any]] = None,
+        delivered: int = 0
+    ):
+        connection = AgentConnection(websocket, agent_id, encoding)
+        self.delivered[agent_id] = delivered
         self.active_connections[agent_id] = connection
 
         if agent_id not in self.agents:
@@ -33,79 +63,184 @@ class ConnectionManager:
             )
         else:
             self.agents[agent_id].status = AgentStatus.ONLINE
+        if capabilities is not None:
+            # The agent's ffmpeg may have changed since it last connected
+            self.agents[agent_id].capabilities = capabilities
 
-        logger.info(f"Agent {agent_id} connected")
+        logger.info(f"Agent {agent_id} connected (encoding: {encoding.value})")
         await self.broadcast_agent_status()
 
     def disconnect_agent(self, agent_id: str):
         if agent_id in self.active_connections:
             del self.active_connections[agent_id]
             if agent_id in self.agents:
+                # Reclaimed by the agent's reconnect message if it comes back in time
                 self.agents[agent_id].status = AgentStatus.OFFLINE
+                self.agents[agent_id].current_task_id = None
             logger.info(f"Agent {agent_id} disconnected")
 
-    async def connect_frontend(self, websocket: WebSocket):
-        await websocket.accept()
-        self.frontend_connections.add(websocket)
+    def is_delivered(self, agent_id: str, seq: int) -> bool:
+        """Whether the agent's outbox message seq was applied already (a replay)"""
+        return seq <= self.delivered.get(agent_id, 0)
+
+    async def confirm_delivery(self, agent_id: str, seq: int):
+        """Record seq as applied (call after persisting it) and let the agent drop it from its outbox"""
+        self.delivered[agent_id] = max(self.delivered.get(agent_id, 0), seq)
+        await self.send_to_agent(agent_id, OrchestratorMessage(type=OrchestratorMessageType.DELIVERED, seq=seq))
+
+    def record_heartbeat(self, agent_id: str, load: Optional[Dict[str, Any]] = None) -> bool:
+        """Record a heartbeat; returns True if the agent just recovered from ERROR"""
+        now = datetime.utcnow()
+        if agent_id in self.active_connections:
+            self.active_connections[agent_id].last_heartbeat = now
+        agent = self.agents.get(agent_id)
+        if agent:
+            agent.last_heartbeat = now
+            if load is not None:
+                agent.load = load
+            if agent.status == AgentStatus.ERROR:
+                # Responsive again after its lease expired
+                agent.status = AgentStatus.BUSY if agent.current_task_id else AgentStatus.ONLINE
+                logger.info(f"Agent {agent_id} is healthy again")
+                return True
+        return False
+
+    def mark_unhealthy(self, agent_id: str):
+        """Stop scheduling onto an agent whose lease expired.
+
+        Its current task is kept: if the agent recovers it stays busy until
+        it reports that task stopped.
+        """
+        agent = self.agents.get(agent_id)
+        if agent and agent_id in self.active_connections:
+            agent.status = AgentStatus.ERROR
+            logger.warning(f"Agent {agent_id} marked unhealthy")
+
+    async def connect_frontend(self, websocket: WebSocket) -> FrontendClient:
+        client = await self.frontend.connect(websocket)
         logger.info("Frontend client connected")
+        return client
 
     def disconnect_frontend(self, websocket: WebSocket):
-        self.frontend_connections.discard(websocket)
+        self.frontend.disconnect(websocket)
         logger.info("Frontend client disconnected")
 
     async def send_to_agent(self, agent_id: str, message: OrchestratorMessage):
         if agent_id in self.active_connections:
             connection = self.active_connections[agent_id]
             try:
-                await connection.websocket.send_json(message.dict())
+                await connection.send(message.to_wire())
                 return True
             except Exception as e:
                 logger.error(f"Error sending to agent {agent_id}: {e}")
                 self.disconnect_agent(agent_id)
         return False
 
-    async def broadcast_to_frontend(self, message: dict):
-        disconnected = set()
-        for websocket in self.frontend_connections:
-            try:
-                await websocket.send_json(message)
-            except Exception as e:
-                logger.error(f"Error broadcasting to frontend: {e}")
-                disconnected.add(websocket)
-
-        # Clean up disconnected clients
-        for websocket in disconnected:
-            self.disconnect_frontend(websocket)
-
-    async def broadcast_agent_status(self):
-        agents_status = {
-            "type": "agents_update",
-            "agents": {
-                agent_id: agent.to_dict()
-                for agent_id, agent in self.agents.items()
-            }
+    async def cancel_on_agent(self, task_id: str, agent_id: Optional[str], reason: str = "cancel") -> bool:
+        """Ask the agent running task_id to stop it; False if that agent isn't connected here"""
+        if not agent_id or agent_id not in self.active_connections:
+            return False
+        message = OrchestratorMessage(
+            type=OrchestratorMessageType.CANCEL,
+            task={"id": task_id},
+            reason=reason
+        )
+        return await self.send_to_agent(agent_id, message)
+
+    async def broadcast_to_frontend(self, message: dict, task_id: Optional[str] = None):
+        await self.frontend.publish_event(message, task_id)
+
+    def agents_snapshot(self) -> Dict[str, Dict[str, Any]]:
+        """All known agents: local ones plus those owned by other instances"""
+        snapshot = {}
+        for agents in self.remote_agents.values():
+            for agent_id, agent in agents.items():
+                if agent_id not in snapshot or snapshot[agent_id]["status"] == AgentStatus.OFFLINE.value:
+                    snapshot[agent_id] = agent
+        for agent_id, agent in self.agents.items():
+            # A local agent that went offline may have reconnected to another instance
+            if agent_id in snapshot and agent.status == AgentStatus.OFFLINE:
+                continue
+            snapshot[agent_id] = agent.to_dict()
+        return snapshot
+
+    def apply_remote_agents(self, instance_id: str, agents: Dict[str, Dict[str, Any]]):
+        """Replace the view of agents owned by another instance"""
+        if agents:
+            self.remote_agents[instance_id] = agents
+            self.remote_seen[instance_id] = datetime.utcnow()
+        else:
+            self.remote_agents.pop(instance_id, None)
+            self.remote_seen.pop(instance_id, None)
+
+    def expire_remote_agents(self, max_age_seconds: float) -> bool:
+        """Forget instances that stopped announcing themselves"""
+        now = datetime.utcnow()
+        expired = [
+            instance_id for instance_id, seen in self.remote_seen.items()
+            if (now - seen).total_seconds() > max_age_seconds
+        ]
+        for instance_id in expired:
+            logger.warning(f"Instance {instance_id} stopped announcing, dropping its agents")
+            self.apply_remote_agents(instance_id, {})
+        return bool(expired)
+
+    def local_agents_dict(self) -> Dict[str, Dict[str, Any]]:
+        return {
+            agent_id: agent.to_dict()
+            for agent_id, agent in self.agents.items()
         }
-        await self.broadcast_to_frontend(agents_status)
 
-    async def broadcast_task_update(self, task_dict: dict):
+    async def broadcast_agent_status(self, publish: bool = True):
+        self.read_cache.invalidate_agents()
+        # Frontend clients only receive the agents that changed
+        await self.frontend.publish_agents(self.agents_snapshot())
+        if publish and self.feed:
+            self.feed.publish("agents_update", {"agents": self.local_agents_dict()})
+
+    async def broadcast_task_update(self, task_dict: dict, publish: bool = True):
+        self.read_cache.invalidate_task(task_dict.get("id"))
+        await self.frontend.publish_task(task_dict)
+        if publish and self.feed:
+            self.feed.publish("task_update", {"task": task_dict})
+
+    def is_available(self, agent_id: str) -> bool:
+        """Idle, connected and with enough headroom on its host"""
+        agent = self.agents.get(agent_id)
+        if not agent or agent.status != AgentStatus.ONLINE or agent.current_task_id is not None:
+            return False
+        if agent_id not in self.active_connections:
+            return False
+        reason = agent.saturation_reason(
+            max_external_cpu_percent=config.AGENT_MAX_EXTERNAL_CPU_PERCENT,
+            max_load_per_cpu=config.AGENT_MAX_LOAD_PER_CPU,
+            min_free_memory_mb=config.AGENT_MIN_FREE_MEMORY_MB,
+            min_free_scratch_mb=config.AGENT_MIN_FREE_SCRATCH_MB
+        )
+        if reason:
+            logger.debug(f"Skipping agent {agent_id}: {reason}")
+            return False
+        return True
+
+    async def broadcast_segments(self, task_id: str, segments: list, publish: bool = True):
         message = {
-            "type": "task_update",
-            "task": task_dict
+            "type": "segments_ready",
+            "task_id": task_id,
+            "segments": segments
         }
-        await self.broadcast_to_frontend(message)
-
-    def get_available_agent(self) -> Optional[str]:
-        for agent_id, agent in self.agents.items():
-            if agent.status == AgentStatus.ONLINE and agent.current_task_id is None:
-                return agent_id
-        return None
+        await self.broadcast_to_frontend(message, task_id)
+        if publish and self.feed:
+            self.feed.publish("segments_ready", message)
 
     def assign_task_to_agent(self, agent_id: str, task_id: str):
         if agent_id in self.agents:
             self.agents[agent_id].status = AgentStatus.BUSY
             self.agents[agent_id].current_task_id = task_id
 
-    def free_agent(self, agent_id: str):
+    def free_agent(self, agent_id: str, task_id: Optional[str] = None):
+        """Mark the agent idle; with task_id only if that is still the task it runs"""
         if agent_id in self.agents:
+            if task_id is not None and self.agents[agent_id].current_task_id != task_id:
+                return
             self.agents[agent_id].status = AgentStatus.ONLINE
             self.agents[agent_id].current_task_id = None
\ No newline at end of file
@@ -1,28 +1,62 @@
-from pydantic import BaseModel
-from typing import Optional, Dict, Any
+from pydantic import BaseModel, SkipValidation
+from typing import Optional, Dict, Any, List
 from enum import Enum
 
 class AgentMessageType(str, Enum):
     CONNECT = "connect"
     HEARTBEAT = "heartbeat"
     PROGRESS = "progress"
+    SEGMENT = "segment"
     COMPLETE = "complete"
     FAILED = "failed"
     RECONNECT = "reconnect"
+    BATCH = "batch"
+    PREEMPTED = "preempted"
+    CANCELLED = "cancelled"
 
 class OrchestratorMessageType(str, Enum):
     ASSIGN = "assign"
     CANCEL = "cancel"
     PING = "ping"
     ACK = "acknowledge"
+    DELIVERED = "delivered"
 
 class AgentMessage(BaseModel):
     type: AgentMessageType
     agent_id: str
     task_id: Optional[str] = None
     data: Optional[Dict[str, Any]] = {}
+    # Position in the agent's outbox; set on messages it replays until confirmed
+    seq: Optional[int] = None
+
+    def unbatch(self) -> List["AgentMessage"]:
+        """Expand a batch frame into its individual messages"""
+        if self.type != AgentMessageType.BATCH:
+            return [self]
+        return [
+            AgentMessage(agent_id=self.agent_id, **item)
+            for item in (self.data or {}).get("messages", [])
+        ]
 
 class OrchestratorMessage(BaseModel):
     type: OrchestratorMessageType
-    task: Optional[Dict[str, Any]] = None
-    message: Optional[str] = None
\ No newline at end of file
+    # Not validated (copied) so a task payload keeps its cached encoding
+    task: Optional[SkipValidation[Dict[str, Any]]] = None
+    message: Optional[str] = None
+    encoding: Optional[str] = None
+    # Why a task is cancelled: "preempt" asks the agent to save resumable
+    # progress, anything else discards the task's partial outputs
+    reason: Optional[str] = None
+    # DELIVERED: the agent's outbox messages up to seq have been applied
+    seq: Optional[int] = None
+
+    def to_wire(self) -> Dict[str, Any]:
+        """The message as sent, without the deep copy of model_dump()"""
+        return {
+            "type": self.type.value,
+            "task": self.task,
+            "message": self.message,
+            "encoding": self.encoding,
+            "reason": self.reason,
+            "seq": self.seq
+        }
\ No newline at end of file
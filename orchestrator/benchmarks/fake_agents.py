@@ -0,0 +1,156 @@
+"""Fake-agent harness: drives a running orchestrator with simulated agents.
+
+Each fake agent speaks the agent protocol (connect, heartbeats, progress,
+complete, cancel) but only pretends to encode, advancing through a source of
+``--duration`` seconds at ``--speed`` times realtime. ``--slow`` of them run
+``--slow-factor`` times slower, like a degraded host. The harness submits a
+batch of tasks, waits for all of them and reports the makespan, which agent
+finished each task and how many speculative copies were started.
+
+Start an orchestrator with short speculation thresholds, then run this from
+the orchestrator directory:
+    SPECULATION_MIN_RUNTIME=5 SPECULATION_MIN_SAMPLES=2 uvicorn app.main:app --port 8000
+    python benchmarks/fake_agents.py --agents 4 --slow 1 --tasks 8
+
+Run it again against an orchestrator started with SPECULATION_ENABLED=false
+to compare.
+"""
+import argparse
+import asyncio
+import json
+import time
+import urllib.request
+from typing import Dict, Optional
+
+import websockets
+
+PROGRESS_INTERVAL = 0.5
+HEARTBEAT_INTERVAL = 5.0
+
+class FakeAgent:
+    def __init__(self, agent_id: str, url: str, speed: float, duration: float):
+        self.agent_id = agent_id
+        self.url = url
+        self.speed = speed
+        self.duration = duration
+        self.websocket = None
+        self.running: Dict[str, asyncio.Task] = {}
+        self.completed = 0
+        self.cancelled = 0
+
+    async def send(self, message_type: str, task_id: Optional[str] = None, data: Optional[dict] = None):
+        message = {"type": message_type, "agent_id": self.agent_id, "data": data or {}}
+        if task_id:
+            message["task_id"] = task_id
+        await self.websocket.send(json.dumps(message))
+
+    async def run(self):
+        async with websockets.connect(self.url) as websocket:
+            self.websocket = websocket
+            await self.send("connect")
+            heartbeat = asyncio.create_task(self._heartbeats())
+            try:
+                async for frame in websocket:
+                    message = json.loads(frame)
+                    if message["type"] == "assign":
+                        task_id = message["task"]["id"]
+                        self.running[task_id] = asyncio.create_task(self._encode(task_id))
+                    elif message["type"] == "cancel":
+                        await self._cancel(message["task"]["id"], message.get("reason"))
+                    elif message["type"] == "ping":
+                        await self.send("heartbeat")
+            finally:
+                heartbeat.cancel()
+
+    async def _heartbeats(self):
+        while True:
+            await self.send("heartbeat")
+            await asyncio.sleep(HEARTBEAT_INTERVAL)
+
+    async def _encode(self, task_id: str):
+        encoded = 0.0
+        while encoded < self.duration:
+            await asyncio.sleep(PROGRESS_INTERVAL)
+            encoded = min(encoded + self.speed * PROGRESS_INTERVAL, self.duration)
+            progress = min(encoded / self.duration * 100, 99.9)
+            await self.send("progress", task_id, {"progress": progress, "speed": self.speed})
+        self.running.pop(task_id, None)
+        self.completed += 1
+        await self.send("complete", task_id)
+
+    async def _cancel(self, task_id: str, reason: Optional[str]):
+        encode = self.running.pop(task_id, None)
+        if not encode:
+            return
+        encode.cancel()
+        self.cancelled += 1
+        if reason == "preempt":
+            await self.send("preempted", task_id)
+        else:
+            await self.send("cancelled", task_id)
+
+def api(base_url: str, method: str, path: str, body: Optional[dict] = None):
+    request = urllib.request.Request(
+        base_url + path,
+        data=json.dumps(body).encode() if body is not None else None,
+        headers={"Content-Type": "application/json"},
+        method=method
+    )
+    with urllib.request.urlopen(request) as response:
+        return json.loads(response.read())
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--api", default="http://localhost:8000")
+    parser.add_argument("--ws", default="ws://localhost:8000/ws/agent")
+    parser.add_argument("--agents", type=int, default=4)
+    parser.add_argument("--slow", type=int, default=1, help="how many agents are degraded")
+    parser.add_argument("--slow-factor", type=float, default=0.25)
+    parser.add_argument("--speed", type=float, default=4.0, help="source seconds encoded per second")
+    parser.add_argument("--duration", type=float, default=60.0, help="source seconds per task")
+    parser.add_argument("--tasks", type=int, default=8)
+    args = parser.parse_args()
+
+    agents = [
+        FakeAgent(
+            f"fake-{i}",
+            args.ws,
+            args.speed * (args.slow_factor if i < args.slow else 1.0),
+            args.duration
+        )
+        for i in range(args.agents)
+    ]
+    connections = [asyncio.create_task(agent.run()) for agent in agents]
+    await asyncio.sleep(1.0)
+
+    started = time.monotonic()
+    task_ids = [
+        api(args.api, "POST", "/api/tasks/", {
+            "input_files": [{"storage": "shared", "path": f"fake/source{i}.mp4"}],
+            "output_settings": {"storage": "shared", "path": f"fake/out{i}.mp4", "codec": "h264", "resolution": "1280x720"}
+        })["id"]
+        for i in range(args.tasks)
+    ]
+
+    speculated = set()
+    while True:
+        tasks = [api(args.api, "GET", f"/api/tasks/{task_id}") for task_id in task_ids]
+        speculated.update(task["id"] for task in tasks if task.get("speculative_agent_id"))
+        if all(task["status"] in ("COMPLETED", "FAILED", "CANCELLED") for task in tasks):
+            break
+        await asyncio.sleep(0.5)
+    makespan = time.monotonic() - started
+
+    for connection in connections:
+        connection.cancel()
+
+    print(f"{args.tasks} tasks on {args.agents} agents ({args.slow} at {args.slow_factor}x): {makespan:.1f}s")
+    print(f"speculative copies started: {len(speculated)}")
+    for task in tasks:
+        copy = " (speculated)" if task["id"] in speculated else ""
+        print(f"  {task['id'][:8]} {task['status']:<10} on {task['agent_id']}{copy}")
+    for agent in agents:
+        print(f"  {agent.agent_id}: {agent.completed} completed, {agent.cancelled} cancelled")
+
+if __name__ == "__main__":
+    asyncio.run(main())
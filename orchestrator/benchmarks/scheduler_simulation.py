@@ -0,0 +1,156 @@
+"""Offline comparison of scheduling policies on a simulated fleet.
+
+Replays a workload trace through app.scheduler.simulation (the real queue,
+policies, agent selection, preemption and retry backoff on a virtual clock)
+once per policy and reports makespan, mean and p99 queue wait overall and
+per priority, utilisation, tasks starved for longer than ``--starvation``
+seconds, preemptions and retries. Without ``--trace`` a synthetic workload
+is generated: Poisson arrivals at ``--load`` times the fleet's capacity,
+log-normal source lengths, a mix of priorities, queues, codecs, sizes and
+ABR ladders, and ``--failure-rate`` of tasks failing once (a tenth of them
+for good). ``--dump-trace`` writes it out as a JSON list to edit or replay.
+
+Policies are fifo, fair and cost (see SCHEDULING_POLICY), each optionally
+with "+preempt" for preemption with the PREEMPTION_* limits. Run from the
+orchestrator directory:
+    python benchmarks/scheduler_simulation.py --agents 8 --tasks 2000 --load 1.1
+    python benchmarks/scheduler_simulation.py --trace trace.json --policies fair,fair+preempt
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app import config
+from app.models.task import TaskPriority
+from app.scheduler import PreemptionLimits, build_policy
+from app.scheduler.simulation import SimulatedAgent, SimulatedTask, Simulator
+
+PRIORITY_MIX = ((TaskPriority.HIGH, 0.1), (TaskPriority.MEDIUM, 0.6), (TaskPriority.LOW, 0.3))
+CODEC_MIX = (("h264", 0.6), ("h265", 0.25), ("vp9", 0.15))
+RESOLUTION_MIX = (("1280x720", 0.3), ("1920x1080", 0.5), ("3840x2160", 0.2))
+LADDER = [
+    {"name": "1080p", "resolution": "1920x1080"},
+    {"name": "720p", "resolution": "1280x720"},
+    {"name": "480p", "resolution": "854x480"}
+]
+
+def choose(rng: random.Random, mix):
+    return rng.choices([value for value, _ in mix], weights=[weight for _, weight in mix])[0]
+
+def synthetic_workload(args, fleet_speed: float) -> list:
+    rng = random.Random(args.seed)
+    queues = [f"tenant-{chr(ord('a') + i)}" for i in range(args.queues)]
+    # The first tenant submits most of the work
+    queue_weights = [2 ** (args.queues - i) for i in range(args.queues)]
+    tasks = []
+    for i in range(args.tasks):
+        settings = {"codec": choose(rng, CODEC_MIX)}
+        if rng.random() < args.ladder_rate:
+            settings["renditions"] = LADDER
+        else:
+            settings["resolution"] = choose(rng, RESOLUTION_MIX)
+        failed = rng.random() < args.failure_rate
+        tasks.append(SimulatedTask(
+            f"task-{i:05d}",
+            0.0,
+            min(rng.lognormvariate(0.0, 1.0) * args.median_duration, args.median_duration * 20),
+            choose(rng, PRIORITY_MIX),
+            rng.choices(queues, weights=queue_weights)[0],
+            settings,
+            failures=1 if failed else 0,
+            fail_at=rng.uniform(0.1, 0.9),
+            permanent=failed and rng.random() < 0.1
+        ))
+    # Arrival rate that keeps the fleet busy load times over
+    mean_work = sum(task.work for task in tasks) / len(tasks)
+    rate = args.load * fleet_speed / mean_work
+    now = 0.0
+    for task in tasks:
+        task.arrival = now
+        now += rng.expovariate(rate)
+    return tasks
+
+def build_fleet(args) -> list:
+    agents = []
+    for i in range(args.agents):
+        speed = args.agent_speed / (args.slow_factor if i < args.slow else 1.0)
+        agents.append(SimulatedAgent(f"agent-{i + 1:03d}", speed))
+    return agents
+
+def simulate(name: str, tasks: list, args) -> dict:
+    policy, _, preempt = name.partition("+")
+    if policy not in ("fifo", "fair", "cost") or preempt not in ("", "preempt"):
+        raise SystemExit(f"unknown policy {name}")
+    simulator = Simulator(
+        build_fleet(args),
+        build_policy(policy),
+        preemption=PreemptionLimits(
+            min_runtime=config.PREEMPTION_MIN_RUNTIME,
+            max_per_task=config.PREEMPTION_MAX_PER_TASK,
+            max_progress=config.PREEMPTION_MAX_PROGRESS,
+            max_in_flight=config.PREEMPTION_MAX_IN_FLIGHT,
+            cooldown=config.PREEMPTION_COOLDOWN
+        ) if preempt else None,
+        starvation_seconds=args.starvation
+    )
+    started = time.perf_counter()
+    result = simulator.run(tasks)
+    result["policy"] = name
+    result["simulated_in"] = round(time.perf_counter() - started, 2)
+    return result
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--trace", help="JSON list of tasks to replay instead of a synthetic workload")
+    parser.add_argument("--dump-trace", help="write the workload to this file")
+    parser.add_argument("--policies", default="fifo,fair,cost,fair+preempt", help="comma-separated policies to compare")
+    parser.add_argument("--agents", type=int, default=8)
+    parser.add_argument("--agent-speed", type=float, default=1.0, help="work per second (1 = 1080p h264 realtime)")
+    parser.add_argument("--slow", type=int, default=0, help="agents that are slower")
+    parser.add_argument("--slow-factor", type=float, default=3.0)
+    parser.add_argument("--tasks", type=int, default=2000)
+    parser.add_argument("--load", type=float, default=0.95, help="offered work relative to the fleet's capacity")
+    parser.add_argument("--median-duration", type=float, default=120.0, help="median source length in seconds")
+    parser.add_argument("--queues", type=int, default=2)
+    parser.add_argument("--ladder-rate", type=float, default=0.2, help="share of tasks encoding an ABR ladder")
+    parser.add_argument("--failure-rate", type=float, default=0.05)
+    parser.add_argument("--starvation", type=float, default=3600.0, help="seconds of waiting that count as starved")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--json", action="store_true", help="print the full results as JSON")
+    args = parser.parse_args()
+
+    if args.trace:
+        with open(args.trace) as f:
+            tasks = [SimulatedTask.from_dict(item) for item in json.load(f)]
+    else:
+        fleet_speed = sum(agent.speed for agent in build_fleet(args))
+        tasks = synthetic_workload(args, fleet_speed)
+    if args.dump_trace:
+        with open(args.dump_trace, "w") as f:
+            json.dump([task.to_dict() for task in tasks], f, indent=1)
+
+    results = [simulate(name.strip(), tasks, args) for name in args.policies.split(",") if name.strip()]
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+
+    print(f"{len(tasks)} tasks on {args.agents} agents, waits and makespan in seconds")
+    header = (f"{'policy':<14}{'makespan':>10}{'wait':>8}{'p99':>8}{'HIGH p99':>10}{'LOW p99':>9}"
+              f"{'util':>7}{'starved':>9}{'preempt':>9}{'retries':>9}{'failed':>8}")
+    print(header)
+    for result in results:
+        priorities = result["by_priority"]
+        print(
+            f"{result['policy']:<14}{result['makespan']:>10.0f}{result['wait_mean']:>8.0f}{result['wait_p99']:>8.0f}"
+            f"{priorities['HIGH']['wait_p99']:>10.0f}{priorities['LOW']['wait_p99']:>9.0f}"
+            f"{result['utilisation']:>7.1%}{result['starved']:>9}{result['preemptions']:>9}"
+            f"{result['retries']:>9}{result['failed']:>8}"
+        )
+
+if __name__ == "__main__":
+    main()
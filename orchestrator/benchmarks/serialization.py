@@ -0,0 +1,101 @@
+"""Microbenchmark for the serialization on the task hot paths.
+
+Measures events per second for a task assignment as the orchestrator
+handles it: the task payload, the assign frame to the agent and the
+frontend frames (encoded once per update however many clients receive
+them, the payload itself once for all of them), and the body of ``GET /api/tasks`` for ``--tasks`` tasks. Each case
+runs with the standard library json module and with orjson (when
+installed); the assignment also runs the way it was sent before, with a
+fresh payload and a model_dump() copy of the message.
+
+Run from the orchestrator directory:
+    python benchmarks/serialization.py
+"""
+import argparse
+import os
+import sys
+import timeit
+import uuid
+from datetime import datetime
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import app.serialization as serialization
+from app.models.task import Task, TaskPriority, TaskStatus
+from app.websocket import OrchestratorMessage, OrchestratorMessageType, encode_message
+from app.websocket.frontend import diff_fields, _encode
+
+def make_task(renditions: int = 3) -> Task:
+    now = datetime.utcnow()
+    return Task(
+        id=str(uuid.uuid4()),
+        status=TaskStatus.ASSIGNED,
+        priority=TaskPriority.MEDIUM,
+        queue="default",
+        agent_id="agent-001",
+        input_files=[{"storage": "shared", "path": "input/source.mp4", "start": 12.0, "end": 92.0}],
+        output_settings={
+            "storage": "shared",
+            "path": "output/ladder",
+            "renditions": [
+                {"name": f"{height}p", "codec": "h264", "resolution": f"{height * 16 // 9}x{height}", "bitrate": "3M"}
+                for height in (1080, 720, 480)[:renditions]
+            ]
+        },
+        progress=0.0,
+        created_at=now,
+        queued_at=now,
+        started_at=now,
+        io_timings={"download": 1.25, "upload": 0.5},
+        depends_on=[str(uuid.uuid4())],
+        retry_count=0,
+        max_retries=3
+    )
+
+def assign_event(task: Task, previous: dict, memo: bool):
+    """One assignment: payload, agent frame, then a delta and a full frontend frame"""
+    if memo:
+        # A new state of the row: the payload and its encoding are made once for this event
+        task.__dict__.pop("_payload", None)
+    task_dict = task.to_dict() if memo else task._build_dict()
+    message = OrchestratorMessage(type=OrchestratorMessageType.ASSIGN, task=task_dict)
+    encode_message(message.to_wire() if memo else message.model_dump())
+    changes = diff_fields(previous, task_dict)
+    _encode({"type": "task_delta", "task_id": task.id, "changes": changes})
+    _encode({"type": "task", "task": task_dict})
+
+def rate(fn, seconds: float) -> float:
+    timer = timeit.Timer(fn)
+    number, _ = timer.autorange()
+    runs = max(1, int(number * seconds / 0.2))
+    return runs / timer.timeit(number=runs)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--tasks", type=int, default=500, help="tasks in the list body")
+    parser.add_argument("--seconds", type=float, default=1.0, help="time per case")
+    args = parser.parse_args()
+
+    task = make_task()
+    previous = dict(task._build_dict(), status="PENDING", agent_id=None)
+    tasks = [make_task() for _ in range(args.tasks)]
+    backends = [("json", None)]
+    if serialization.orjson is not None:
+        backends.append(("orjson", serialization.orjson))
+    else:
+        print("orjson is not installed, only the standard library is measured")
+
+    print(f"{'case':<34}{'backend':<9}{'per second':>14}")
+    for name, module in backends:
+        serialization.orjson = module
+        for t in tasks:
+            # Encoded with this backend, then reused like a read cache would
+            t.__dict__.pop("_payload", None)
+        for label, memo in (("assign (fresh, model_dump)", False), ("assign (shared payload)", True)):
+            events = rate(lambda: assign_event(task, previous, memo), args.seconds)
+            print(f"{label:<34}{name:<9}{events:>14,.0f}")
+        bodies = rate(lambda: serialization.json_bytes({"tasks": [t.to_dict() for t in tasks]}), args.seconds)
+        print(f"{f'GET /api/tasks ({args.tasks} tasks)':<34}{name:<9}{bodies:>14,.1f}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,96 @@
+"""Microbenchmark for the agent <-> orchestrator wire encodings.
+
+Measures encode/decode cost and bytes per message for JSON and msgpack,
+for single progress frames, batched progress frames and task assignments.
+
+Run from the orchestrator directory:
+    python benchmarks/wire_protocol.py
+"""
+import os
+import sys
+import timeit
+import uuid
+from datetime import datetime
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.websocket.codec import Encoding, encode_message, decode_message, supported_encodings
+
+ITERATIONS = 20000
+BATCH_SIZE = 10
+
+def progress_message(task_id: str, progress: float) -> dict:
+    return {
+        "type": "progress",
+        "agent_id": "agent-001",
+        "task_id": task_id,
+        "data": {"progress": progress}
+    }
+
+def batch_message(task_id: str, size: int) -> dict:
+    return {
+        "type": "batch",
+        "agent_id": "agent-001",
+        "data": {
+            "messages": [
+                {"type": "progress", "task_id": task_id, "data": {"progress": float(i)}}
+                for i in range(size)
+            ]
+        }
+    }
+
+def assign_message(task_id: str) -> dict:
+    now = datetime.utcnow().isoformat()
+    return {
+        "type": "assign",
+        "task": {
+            "id": task_id,
+            "priority": "MEDIUM",
+            "status": "ASSIGNED",
+            "agent_id": "agent-001",
+            "input_files": [{"storage": "shared", "path": "input/source.mp4"}],
+            "output_settings": {
+                "storage": "shared",
+                "path": "output/transcoded.mp4",
+                "codec": "h264",
+                "resolution": "1280x720"
+            },
+            "progress": 0.0,
+            "created_at": now,
+            "started_at": now,
+            "completed_at": None,
+            "error_message": None
+        },
+        "message": None
+    }
+
+def measure(message: dict, encoding: Encoding, messages_per_frame: int = 1) -> dict:
+    frame = encode_message(message, encoding)
+    encode_time = timeit.timeit(lambda: encode_message(message, encoding), number=ITERATIONS)
+    decode_time = timeit.timeit(lambda: decode_message(frame), number=ITERATIONS)
+    size = len(frame.encode("utf-8") if isinstance(frame, str) else frame)
+    return {
+        "encode_us": encode_time / ITERATIONS / messages_per_frame * 1e6,
+        "decode_us": decode_time / ITERATIONS / messages_per_frame * 1e6,
+        "bytes": size / messages_per_frame,
+    }
+
+def main():
+    task_id = str(uuid.uuid4())
+    cases = [
+        ("progress", progress_message(task_id, 42.5), 1),
+        (f"progress x{BATCH_SIZE} (batch)", batch_message(task_id, BATCH_SIZE), BATCH_SIZE),
+        ("assign", assign_message(task_id), 1),
+    ]
+
+    print(f"{'case':<24}{'encoding':<10}{'encode us/msg':>15}{'decode us/msg':>15}{'bytes/msg':>12}")
+    for name, message, per_frame in cases:
+        for encoding in supported_encodings():
+            result = measure(message, Encoding(encoding), per_frame)
+            print(
+                f"{name:<24}{encoding:<10}"
+                f"{result['encode_us']:>15.2f}{result['decode_us']:>15.2f}{result['bytes']:>12.1f}"
+            )
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,22 @@
+import os
+import sys
+import tempfile
+
+# The engine is created when app.database is imported: point it at a
+# throwaway database first
+os.environ.setdefault("DATABASE_URL", f"sqlite:///{tempfile.mkdtemp()}/test.db")
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pytest
+
+from app.database import SessionLocal, init_db
+
+init_db()
+
+@pytest.fixture
+def db():
+    session = SessionLocal()
+    try:
+        yield session
+    finally:
+        session.close()
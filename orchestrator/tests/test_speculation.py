@@ -0,0 +1,124 @@
+"""Speculative copies of straggling tasks: picking the stragglers, starting
+the copy on a free agent and stopping the copy that loses the race."""
+import asyncio
+import json
+from datetime import datetime, timedelta
+
+from app import main
+from app.database import TaskOperations
+from app.models.task import Task, TaskStatus
+from app.scheduler import SpeculationLimits, SpeedModel, TaskScheduler, select_stragglers
+from app.websocket.manager import ConnectionManager
+from app.websocket.messages import AgentMessage, AgentMessageType
+
+SETTINGS = {"storage": "shared", "path": "out.mp4", "codec": "h264", "resolution": "1280x720"}
+LIMITS = SpeculationLimits(slowdown=0.5, min_runtime=60.0, max_in_flight=2, min_samples=3)
+
+class FakeWebSocket:
+    """Records what the orchestrator sends to an agent"""
+
+    def __init__(self):
+        self.sent = []
+
+    async def send_text(self, frame: str):
+        self.sent.append(json.loads(frame))
+
+    async def send_bytes(self, frame: bytes):
+        raise AssertionError("fake agents negotiate JSON")
+
+def speed_model(speed: float = 2.0) -> SpeedModel:
+    model = SpeedModel()
+    for _ in range(LIMITS.min_samples):
+        model.observe(SETTINGS, speed)
+    model.loaded = True
+    return model
+
+def running_task(agent_id: str, encode_speed: float, progress: float = 10.0, minutes: float = 5.0) -> Task:
+    return Task(
+        status=TaskStatus.RUNNING,
+        agent_id=agent_id,
+        input_files=[{"storage": "shared", "path": "in.mp4"}],
+        output_settings=dict(SETTINGS),
+        progress=progress,
+        encode_speed=encode_speed,
+        started_at=datetime.utcnow() - timedelta(minutes=minutes)
+    )
+
+async def connect(manager: ConnectionManager, *agent_ids: str) -> dict:
+    sockets = {}
+    for agent_id in agent_ids:
+        sockets[agent_id] = FakeWebSocket()
+        await manager.connect_agent(sockets[agent_id], agent_id)
+    return sockets
+
+def store(db, task: Task) -> Task:
+    db.add(task)
+    db.commit()
+    db.refresh(task)
+    return task
+
+def test_select_stragglers_picks_slow_tasks_only():
+    slow = running_task("a1", encode_speed=0.4)
+    fast = running_task("a2", encode_speed=1.9)
+    young = running_task("a3", encode_speed=0.4, minutes=0.5)
+    assert select_stragglers([fast, slow, young], speed_model(), LIMITS) == [slow]
+
+def test_select_stragglers_needs_enough_samples():
+    model = SpeedModel()
+    model.observe(SETTINGS, 2.0)
+    assert select_stragglers([running_task("a1", encode_speed=0.4)], model, LIMITS) == []
+
+def test_speculate_copies_straggler_to_free_agent(db):
+    async def scenario():
+        manager = ConnectionManager()
+        sockets = await connect(manager, "a1", "a2")
+        task = store(db, running_task("a1", encode_speed=0.4))
+        manager.assign_task_to_agent("a1", task.id)
+        scheduler = TaskScheduler(manager, speculation=LIMITS, speeds=speed_model())
+
+        assert await scheduler._speculate(db) == 1
+        # One copy per task, however slow it stays
+        assert await scheduler._speculate(db) == 0
+        return sockets, task.id, manager
+
+    sockets, task_id, manager = asyncio.run(scenario())
+    assigned = [message for message in sockets["a2"].sent if message["type"] == "assign"]
+    assert len(assigned) == 1
+    assert assigned[0]["task"]["id"] == task_id
+    assert assigned[0]["task"]["speculative"] is True
+    assert not [message for message in sockets["a1"].sent if message["type"] == "assign"]
+    assert manager.agents["a2"].current_task_id == task_id
+
+    db.expire_all()
+    task = TaskOperations.get_task(db, task_id)
+    assert task.agent_id == "a1"
+    assert task.speculative_agent_id == "a2"
+
+def test_losing_copy_is_cancelled(db, monkeypatch):
+    async def scenario():
+        manager = ConnectionManager()
+        monkeypatch.setattr(main, "manager", manager)
+        sockets = await connect(manager, "a1", "a2")
+        task = store(db, running_task("a1", encode_speed=0.4))
+        manager.assign_task_to_agent("a1", task.id)
+        assert TaskOperations.start_speculation(db, task.id, "a2")
+        manager.assign_task_to_agent("a2", task.id)
+
+        # The copy finishes first
+        complete = AgentMessage(type=AgentMessageType.COMPLETE, agent_id="a2", task_id=task.id, data={})
+        await main.handle_agent_message("a2", complete, db)
+        return sockets, task.id, manager
+
+    sockets, task_id, manager = asyncio.run(scenario())
+    cancels = [message for message in sockets["a1"].sent if message["type"] == "cancel"]
+    assert len(cancels) == 1
+    assert cancels[0]["task"]["id"] == task_id
+    assert cancels[0]["reason"] == "superseded"
+    assert not [message for message in sockets["a2"].sent if message["type"] == "cancel"]
+    assert manager.agents["a2"].current_task_id is None
+
+    db.expire_all()
+    task = TaskOperations.get_task(db, task_id)
+    assert task.status == TaskStatus.COMPLETED
+    assert task.agent_id == "a2"
+    assert task.speculative_agent_id is None